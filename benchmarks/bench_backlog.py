@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+""" measure the memory used by a backlog of tasklets set up but not
+started yet.
+
+    python benchmarks/bench_backlog.py [count]
+"""
+
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+# run from a checkout, the package is in the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from flower import core
+
+COUNT = 1000000
+
+
+def handler(i):
+    pass
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else COUNT
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    start = time.time()
+    tasks = [core.tasklet(handler)(i) for i in range(count)]
+    elapsed = time.time() - start
+
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    print("%d queued tasklets: %.1f MB, %.0f bytes per tasklet, "
+            "%.2fs to set up" % (count, used / 1e6, used / count, elapsed))
+
+    start = time.time()
+    core.run()
+    print("run in %.2fs" % (time.time() - start))
+    del tasks
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+""" measure the rate of values streamed from a producer to a consumer
+tasklet through a channel, one at a time and in batches with send_many()
+and receive_many().
+
+    python benchmarks/bench_batch.py [count] [batch ...]
+"""
+
+import os
+import sys
+import time
+
+# run from a checkout, the package is in the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from flower import core
+
+COUNT = 200000
+BATCHES = [1, 16, 256]
+
+
+def run(count, batch):
+    ch = core.channel()
+
+    def produce():
+        if batch == 1:
+            for i in range(count):
+                ch.send(i)
+            return
+        for i in range(0, count, batch):
+            ch.send_many(range(i, min(i + batch, count)))
+
+    def consume():
+        received = 0
+        while received < count:
+            if batch == 1:
+                ch.receive()
+                received += 1
+            else:
+                received += len(ch.receive_many(batch))
+
+    core.tasklet(consume)()
+    core.tasklet(produce)()
+
+    sched = core.get_scheduler()
+    switches = sched.switches
+    start = time.time()
+    core.run()
+    return time.time() - start, sched.switches - switches
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else COUNT
+    batches = [int(b) for b in sys.argv[2:]] or BATCHES
+    print("%-10s %-15s %s" % ("batch", "values/s", "switches/value"))
+    for batch in batches:
+        elapsed, switches = run(count, batch)
+        print("%-10s %-15.0f %.3f" % (batch, count / elapsed,
+            switches / float(count)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+""" measure the rate of values streamed from a producer to a consumer
+tasklet through a channel, depending on the size of its buffer.
+
+    python benchmarks/bench_buffered.py [count] [capacity ...]
+"""
+
+import os
+import sys
+import time
+
+# run from a checkout, the package is in the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from flower import core
+
+COUNT = 200000
+CAPACITIES = [0, 1, 16, 256, 4096]
+
+
+def run(count, capacity):
+    ch = core.channel(capacity)
+
+    def produce():
+        for i in range(count):
+            ch.send(i)
+
+    def consume():
+        for i in range(count):
+            ch.receive()
+
+    core.tasklet(produce)()
+    core.tasklet(consume)()
+
+    sched = core.get_scheduler()
+    switches = sched.switches
+    start = time.time()
+    core.run()
+    return time.time() - start, sched.switches - switches
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else COUNT
+    capacities = [int(c) for c in sys.argv[2:]] or CAPACITIES
+    print("%-10s %-15s %s" % ("capacity", "values/s", "switches/value"))
+    for capacity in capacities:
+        elapsed, switches = run(count, capacity)
+        print("%-10s %-15.0f %.3f" % (capacity, count / elapsed,
+            switches / float(count)))
+
+if __name__ == "__main__":
+    main()
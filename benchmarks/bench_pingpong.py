@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+""" measure the rate of round trips between two tasklets over a pair of
+channels while other tasklets are runnable, with the default scheduling
+and with direct handoff.
+
+    python benchmarks/bench_pingpong.py [count] [runnable]
+"""
+
+import os
+import sys
+import time
+
+# run from a checkout, the package is in the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from flower import core
+
+COUNT = 20000
+RUNNABLE = 10
+
+
+def ping(count, out, back, done):
+    for i in range(count):
+        out.send(i)
+        back.receive()
+    done.append(True)
+
+
+def pong(count, out, back):
+    for i in range(count):
+        back.send(out.receive())
+
+
+def busy(done):
+    # other tasklets of the server, always runnable
+    while not done:
+        core.schedule()
+
+
+def run(count, runnable, handoff):
+    out = core.channel(handoff=handoff)
+    back = core.channel(handoff=handoff)
+    done = []
+    core.tasklet(pong)(count, out, back)
+    core.tasklet(ping)(count, out, back, done)
+    for i in range(runnable):
+        core.tasklet(busy)(done)
+
+    sched = core.get_scheduler()
+    switches = sched.switches
+    start = time.time()
+    core.run()
+    return time.time() - start, sched.switches - switches
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else COUNT
+    runnable = int(sys.argv[2]) if len(sys.argv) > 2 else RUNNABLE
+    print("%-10s %-15s %s" % ("mode", "round trips/s", "switches/trip"))
+    for name, handoff in (("default", False), ("handoff", True)):
+        elapsed, switches = run(count, runnable, handoff)
+        print("%-10s %-15.0f %.1f" % (name, count / elapsed,
+            switches / float(count)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+""" measure the throughput of CPU bound tasklets against the I/O latency
+for several polling cadences (see Scheduler.set_poll_cadence). The
+latency is how late a periodic timer of the event loop fires.
+
+    python benchmarks/bench_polling.py [tasklets] [duration]
+"""
+
+import os
+import sys
+import time
+
+import pyuv
+
+# run from a checkout, the package is in the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from flower import core
+from flower.core.uv import uv_server
+
+TASKLETS = 100
+DURATION = 1.0
+PERIOD = 0.001 # period of the timer, in seconds
+WORK = 200 # loop iterations run by a tasklet before it yields
+
+# (batch, interval)
+CADENCES = [(1, None), (8, None), (64, None), (1024, None), (1024, 0.001)]
+
+
+def busy(state):
+    while not state['done']:
+        for i in range(WORK):
+            pass
+        state['work'] += 1
+        core.schedule()
+
+
+def measure(uv, batch, interval, tasklets, duration):
+    sched = core.get_scheduler()
+    sched.set_poll_cadence(batch, interval)
+    state = dict(done=False, work=0, last=time.time())
+    lateness = []
+    done = core.channel()
+    deadline = time.time() + duration
+
+    def _tick(handle):
+        now = time.time()
+        lateness.append(now - state['last'] - PERIOD)
+        state['last'] = now
+        if now >= deadline:
+            handle.stop()
+            state['done'] = True
+            done.send(None)
+
+    tasks = [core.tasklet(busy)(state) for i in range(tasklets)]
+    polls = sched.polls
+    timer = pyuv.Timer(uv.loop)
+    timer.start(_tick, PERIOD, PERIOD)
+    done.receive()
+    while any(t.alive for t in tasks):
+        core.schedule()
+
+    sched.set_poll_cadence()
+    lateness = lateness[1:] or [0.0]
+    return (state['work'] / duration, (sched.polls - polls) / duration,
+            sum(lateness) / len(lateness), max(lateness))
+
+
+def bench(uv, tasklets, duration):
+    print("%-8s %-10s %-12s %-10s %-14s %s" % ("batch", "interval",
+        "work/s", "polls/s", "latency (ms)", "max (ms)"))
+    for batch, interval in CADENCES:
+        work, polls, mean, worst = measure(uv, batch, interval, tasklets,
+                duration)
+        print("%-8s %-10s %-12.0f %-10.0f %-14.3f %.3f" % (batch, interval,
+            work, polls, mean * 1000, worst * 1000))
+
+
+def main():
+    tasklets = int(sys.argv[1]) if len(sys.argv) > 1 else TASKLETS
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else DURATION
+    uv = uv_server()
+    core.tasklet(bench)(uv, tasklets, duration)
+    core.run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+""" measure the cost of the scheduler run queue operations depending on
+the number of queued tasklets.
+
+    python benchmarks/bench_runqueue.py [size ...]
+
+The cost per operation should stay flat from 100 to 1M tasklets.
+"""
+
+import os
+import random
+import sys
+import time
+
+# run from a checkout, the package is in the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from flower.core.sched import tasklet
+from flower.core.runqueue import RunQueue
+
+SIZES = [100, 1000, 10000, 100000, 1000000]
+OPS = 100000
+
+
+def bench(size, ops=OPS):
+    rq = RunQueue()
+    tasks = [tasklet(label=str(i)) for i in range(size)]
+    for t in tasks:
+        rq.append(t)
+
+    # pick the tasks we will work on in advance, anywhere in the queue
+    picked = [random.choice(tasks) for i in range(ops)]
+
+    results = {}
+
+    start = time.time()
+    for t in picked:
+        rq.remove(t)
+        rq.append(t)
+    results['remove+append'] = time.time() - start
+
+    start = time.time()
+    for t in picked:
+        t in rq
+    results['contains'] = time.time() - start
+
+    start = time.time()
+    for t in picked:
+        rq.appendnext(t)
+    results['appendnext'] = time.time() - start
+
+    start = time.time()
+    for i in range(ops):
+        rq.rotate()
+    results['rotate'] = time.time() - start
+
+    return results
+
+
+def main():
+    sizes = [int(s) for s in sys.argv[1:]] or SIZES
+    print("%-10s %-15s %s" % ("tasklets", "operation", "ns/op"))
+    for size in sizes:
+        results = bench(size)
+        for name in sorted(results):
+            print("%-10s %-15s %.0f" % (size, name,
+                results[name] * 1e9 / OPS))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+""" measure the number of tasklets spawned and run per second, with a new
+tasklet each time and with the recycling spawn().
+
+    python benchmarks/bench_spawn.py [count]
+"""
+
+import os
+import sys
+import time
+
+# run from a checkout, the package is in the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from flower import core
+
+COUNT = 100000
+BATCH = 100
+
+
+def handler(i):
+    pass
+
+
+def spawn_new(count):
+    for i in range(count // BATCH):
+        for j in range(BATCH):
+            core.tasklet(handler)(j)
+        core.run()
+
+
+def spawn_recycled(count):
+    for i in range(count // BATCH):
+        for j in range(BATCH):
+            core.spawn(handler, j)
+        core.run()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else COUNT
+    print("%-10s %s" % ("spawn", "tasklets/s"))
+    for name, func in (("new", spawn_new), ("recycled", spawn_recycled)):
+        start = time.time()
+        func(count)
+        print("%-10s %.0f" % (name, count / (time.time() - start)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+""" run the core micro-benchmarks: spawn and switch rates, channel
+ping-pong, timers, actor messages and registry lookups.
+
+    python benchmarks/suite.py [-q] [-k name] [-o results.json]
+                               [-b baseline.json] [-t threshold]
+
+All the results are rates, higher is better. `-o` saves them in JSON, a
+file saved on a previous run can then be given as baseline with `-b`:
+the results slower than the baseline by more than `threshold` (10% by
+default) are reported as regressions and the exit status is 1.
+
+The other scripts of this directory measure a single thing in more
+details.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+# run from a checkout, the package is in the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+from flower import core
+from flower.core.timer import Timer, sleep
+
+from bench_pingpong import run as run_pingpong
+from bench_spawn import spawn_new, spawn_recycled
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+# name -> function(scale) returning a dict of rates, in running order
+BENCHMARKS = []
+
+def benchmark(func):
+    BENCHMARKS.append((func.__name__[len("bench_"):], func))
+    return func
+
+
+@benchmark
+def bench_spawn(scale):
+    count = int(100000 * scale)
+    results = {}
+    for name, func in (("new", spawn_new), ("recycled", spawn_recycled)):
+        start = _clock()
+        func(count)
+        results[name] = count / (_clock() - start)
+    return results
+
+
+@benchmark
+def bench_switch(scale):
+    count = int(1000 * scale)
+
+    def f():
+        for i in range(count):
+            core.schedule()
+
+    for i in range(100):
+        core.tasklet(f)()
+
+    sched = core.get_scheduler()
+    switches = sched.switches
+    start = _clock()
+    core.run()
+    return {"switches": (sched.switches - switches) / (_clock() - start)}
+
+
+def _pingpong(count, capacity=None):
+    out = core.channel(capacity)
+    back = core.channel(capacity)
+
+    def ping():
+        for i in range(count):
+            out.send(i)
+            back.receive()
+
+    def pong():
+        for i in range(count):
+            back.send(out.receive())
+
+    core.tasklet(pong)()
+    core.tasklet(ping)()
+    start = _clock()
+    core.run()
+    return count / (_clock() - start)
+
+
+@benchmark
+def bench_channel(scale):
+    count = int(50000 * scale)
+    elapsed, switches = run_pingpong(count, 10, True)
+    results = {"sync": _pingpong(count),
+            "buffered": _pingpong(count, 1),
+            "handoff_loaded": count / elapsed}
+
+    # values streamed through a buffered channel
+    ch = core.channel(64)
+
+    def produce():
+        for i in range(count):
+            ch.send(i)
+
+    def consume():
+        for i in range(count):
+            ch.receive()
+
+    core.tasklet(produce)()
+    core.tasklet(consume)()
+    start = _clock()
+    core.run()
+    results["buffered_stream"] = count / (_clock() - start)
+    return results
+
+
+@benchmark
+def bench_timers(scale):
+    count = int(1000000 * scale)
+    fired = [0]
+
+    def callback(now, t):
+        fired[0] += 1
+
+    # due within 2ms, in no particular order
+    timers = [Timer(callback, 0.001 + (i * 7919 % 1000) * 1e-6)
+            for i in range(count)]
+    start = _clock()
+    for t in timers:
+        t.start()
+    started = _clock()
+    core.run()
+    results = {"start": count / (started - start),
+            "fire": fired[0] / (_clock() - started)}
+
+    # tasklets sleeping in turn
+    sleepers = int(1000 * scale)
+
+    def f():
+        for i in range(10):
+            sleep(0.001)
+
+    for i in range(sleepers):
+        core.tasklet(f)()
+    start = _clock()
+    core.run()
+    results["sleep"] = sleepers * 10 / (_clock() - start)
+    return results
+
+
+@benchmark
+def bench_actor(scale):
+    from flower.actor import receive, send, spawn
+
+    size = 100
+    laps = int(1000 * scale)
+
+    def node():
+        _, next_ref = receive()
+        for i in range(laps):
+            _, n = receive()
+            send(next_ref, n + 1)
+
+    refs = [spawn(node) for i in range(size)]
+    for i, ref in enumerate(refs):
+        send(ref, refs[(i + 1) % size])
+
+    start = _clock()
+    send(refs[0], 0)
+    core.run()
+    return {"ring": size * laps / (_clock() - start)}
+
+
+@benchmark
+def bench_registry(scale):
+    from flower.registry import registry
+
+    count = int(10000 * scale)
+    names = ["bench-%s" % i for i in range(count)]
+    start = _clock()
+    for i, name in enumerate(names):
+        registry.register(name, i)
+    results = {"register": count / (_clock() - start)}
+
+    start = _clock()
+    for i in range(10):
+        for name in names:
+            registry[name]
+            name in registry
+    results["lookup"] = count * 20 / (_clock() - start)
+
+    for name in names:
+        registry.unregister(name)
+    return results
+
+
+def run(names=None, scale=1.0, repeat=3, out=sys.stdout):
+    """ run the benchmarks and return the best rate of each """
+    results = {}
+    for name, func in BENCHMARKS:
+        if names and name not in names:
+            continue
+        best = {}
+        for i in range(repeat):
+            for key, rate in func(scale).items():
+                key = "%s.%s" % (name, key)
+                best[key] = max(best.get(key, 0), rate)
+        for key in sorted(best):
+            out.write("%-28s %14.0f /s\n" % (key, best[key]))
+            out.flush()
+        results.update(best)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """ print the change of each result against the baseline and return
+    the names of the regressions """
+    regressions = []
+    print("\n%-28s %14s %14s %8s" % ("benchmark", "baseline", "now",
+        "change"))
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        change = results[key] / baseline[key] - 1
+        flag = ""
+        if change < -threshold:
+            regressions.append(key)
+            flag = "  REGRESSION"
+        print("%-28s %14.0f %14.0f %+7.1f%%%s" % (key, baseline[key],
+            results[key], change * 100, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="flower benchmarks")
+    parser.add_argument("-k", dest="names", action="append",
+            help="only run this benchmark, can be repeated")
+    parser.add_argument("-q", "--quick", action="store_true",
+            help="run 10 times less iterations")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+            help="runs of each benchmark, the best is kept")
+    parser.add_argument("-o", "--output", help="save the results in JSON")
+    parser.add_argument("-b", "--baseline",
+            help="JSON results to compare with")
+    parser.add_argument("-t", "--threshold", type=float, default=0.1,
+            help="slowdown reported as a regression (default: 0.1)")
+    args = parser.parse_args()
+
+    scale = 0.1 if args.quick else 1.0
+    results = run(args.names, scale, args.repeat)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(dict(python=platform.python_version(),
+                implementation=platform.python_implementation(),
+                machine=platform.machine(), scale=scale,
+                results=results), f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("scale", 1.0) != scale:
+            print("warning: the baseline was run with a scale of %s" %
+                    baseline.get("scale"))
+        if compare(results, baseline["results"], args.threshold):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+# Echo server running one worker process per CPU
+from flower.net import PreforkServer
+
+
+# handle the connection. It return data to the sender.
+def handle_connection(conn):
+    while True:
+        data = conn.read()
+        if not data:
+            break
+
+        conn.write(data)
+
+
+# Listen on tcp port 8000 on localhost. Each worker accepts the
+# connections on the shared socket and handles them in new tasks.
+server = PreforkServer(('127.0.0.1', 8000), handle_connection)
+server.serve_forever()
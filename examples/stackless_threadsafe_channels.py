@@ -1,15 +1,11 @@
 import threading
-import sys
-if sys.version_info[0] <= 2:
-    import thread
-else:
-    import _thread as thread
-
 
 import flower
 
 commandChannel = flower.channel()
 
+# runs in a plain thread, not a tasklet. When the receiver isn't ready, send
+# parks the thread until the tasklet takes the command.
 def master_func():
     commandChannel.send("ECHO 1")
     commandChannel.send("ECHO 2")
@@ -25,12 +21,11 @@ def slave_func():
             break
     print("SLAVE ENDING")
 
-def scheduler_run(tasklet_func):
-    t = flower.tasklet(tasklet_func)()
-    while t.alive:
-        flower.run()
-
-th = threading.Thread(target=scheduler_run, args=(master_func,))
+th = threading.Thread(target=master_func)
 th.start()
 
-scheduler_run(slave_func)
+flower.tasklet(slave_func)()
+
+# wait for the thread to wake up the blocked tasklet instead of returning
+flower.run(wait=True)
+th.join()
@@ -11,6 +11,12 @@ from flower.core import (
         # channel functions
         channel, bomb, set_channel_callback)
 
+try:
+    from flower.core.aio import await_, to_asyncio
+except ImportError:
+    # no asyncio before python 3.4
+    pass
 
-from flower.actor import (spawn, spawn_link, spawn_after, send,
-        send_after, receive, flush)
+
+from flower.actor import (spawn, spawn_many, spawn_link, spawn_after,
+        send, send_after, receive, flush)
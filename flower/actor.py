@@ -4,6 +4,7 @@
 
 from collections import deque
 import inspect
+import itertools
 import operator
 import sys
 import threading
@@ -20,22 +21,16 @@ def self():
     return core.getcurrent()
 
 
-class ActorRef(object):
+# counter giving the actor refs, next() on it is atomic
+_ref_count = itertools.count()
 
-    __slots__ = ['ref', '_actor_ref', 'is_alive', '__dict__', 'actor']
+class ActorRef(object):
 
-    __shared_state__ = dict(
-            _ref_count = 0
-    )
+    __slots__ = ['ref', '_actor_ref', '__weakref__']
 
     def __init__(self, actor):
-        self.__dict__ = self.__shared_state__
         self._actor_ref = weakref.ref(actor)
-
-        # increment the ref counter
-        with threading.RLock():
-            self.ref = self._ref_count
-            self._ref_count += 1
+        self.ref = next(_ref_count)
 
     def __str__(self):
         return "<actor:%s>" % self.ref
@@ -74,12 +69,17 @@ class Mailbox(object):
 
     Each actors have an attached mailbox used to send him some any
     messages.
+
+    The queue, the channel and the lock are only created when needed so
+    an idle actor stays small.
     """
 
+    __slots__ = ['messages', 'channel', '_lock']
+
     def __init__(self):
-        self.messages = deque()
-        self.channel = core.channel()
-        self._lock = threading.RLock()
+        self.messages = None
+        self.channel = None
+        self._lock = None
 
     def send(self, msg):
         """ append a message to the queue or if the actor is accepting
@@ -89,50 +89,69 @@ class Mailbox(object):
             self.channel.send(msg)
         else:
             # no waiters append to the queue and return
+            if self.messages is None:
+                self.messages = deque()
             self.messages.append(msg)
             return
 
     def receive(self):
         """ fetch a message from the queue or wait for a new one """
-        try:
+        if self.messages:
             return self.messages.popleft()
-        except IndexError:
-            pass
+
+        if self.channel is None:
+            self.channel = core.channel()
         return self.channel.receive()
 
     def flush(self):
+        if self._lock is None:
+            self._lock = threading.RLock()
+
         with self._lock:
-            while True:
-                try:
-                    yield self.messages.popleft()
-                except IndexError:
-                    raise StopIteration
+            while self.messages:
+                yield self.messages.popleft()
 
     def clear(self):
-        self.messages.clear()
+        if self.messages is not None:
+            self.messages.clear()
+
+def _run_actor(func, args, kwargs):
+    func(*args, **kwargs)
+    # let the messages sent be delivered
+    sleep(0.0)
+
 
 class Actor(core.tasklet):
 
     """ An actor is like a tasklet but with a mailbox. """
 
-    def __init__(self):
-        core.tasklet.__init__(self)
+    def __init__(self, func=None):
+        core.tasklet.__init__(self, func)
         self.ref = ActorRef(self)
         self.links = []
         self.mailbox = Mailbox()
 
     @classmethod
     def spawn(cls, func, *args, **kwargs):
-        instance = cls()
-
-        # wrap func to be scheduled immediately
-        def _func():
-            func(*args, **kwargs)
-            sleep(0.0)
-        instance.bind(_func)
-        instance.setup()
+        instance = cls(_run_actor)
+        instance.setup(func, args, kwargs)
         return instance.ref
 
+    @classmethod
+    def spawn_many(cls, func, iterable):
+        """ spawn an actor running ``func(*args)`` for each tuple of
+        arguments in `iterable`. The actors are queued at once, their refs
+        are returned. """
+        sched = core.get_scheduler()
+        instances = []
+        for args in iterable:
+            instance = cls(_run_actor)
+            instance._setup(sched, (func, args, {}), {})
+            instances.append(instance)
+
+        sched.extend(instances)
+        return [instance.ref for instance in instances]
+
     @classmethod
     def spawn_link(cls, func, *args, **kwargs):
         curr = core.getcurrent()
@@ -197,6 +216,7 @@ class Actor(core.tasklet):
 
 
 spawn = Actor.spawn
+spawn_many = Actor.spawn_many
 spawn_link = Actor.spawn_link
 spawn_after = Actor.spawn_after
 wrap = Actor.wrap
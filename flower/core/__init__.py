@@ -4,10 +4,26 @@
 
 from flower.core.sched import (tasklet,  get_scheduler, getruncount,
         getcurrent, getmain, set_schedule_callback, schedule,
-        schedule_remove, run, taskwakeup)
+        schedule_remove, run, taskwakeup, get_stats, spawn, spawn_many,
+        set_poll_cadence,
+        PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+
+from flower.core.runqueue import TaskletGroup, default_group, group_stats
 
 from flower.core.channel import (bomb, channel, set_channel_callback)
 
+from flower.core.select import select
+
+from flower.core.pool import SchedulerPool
+
+from flower.core.scope import cancel_scope, task_group
+
+from flower.core.threadpool import (ThreadPool, CancelledError,
+        run_in_thread, get_thread_pool, set_thread_pool_size)
+
+from flower.core.processpool import (ProcessPool, run_in_process,
+        process_map, get_process_pool)
+
 
 def defer(func):
     """ A "defer" function invokes a function whose execution is
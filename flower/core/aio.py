@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+import asyncio
+import functools
+import sys
+import threading
+
+from .sched import get_scheduler, getcurrent, tasklet
+from .threadpool import WorkItem
+
+_tls = threading.local()
+
+
+class AsyncioLoop(object):
+    """ run the tasklets of the current thread from an asyncio event loop.
+
+    Each time tasklets become runnable, the scheduler runs them in a
+    callback of the loop until they are all blocked. Timers and wakeups
+    from other threads go through the loop, so both stacks share the
+    thread::
+
+        install(loop)
+        loop.run_until_complete(to_asyncio(main)())
+    """
+
+    def __init__(self, loop=None):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+        self.sched = get_scheduler()
+        self._runner = None # tasklet running the loop
+        self._handle = None # next run of the scheduler
+
+    @property
+    def task(self):
+        """ the tasklet running the loop """
+        return self._runner or self.sched.getmain()
+
+    def start(self):
+        self.sched.poller = self
+        self._schedule()
+
+    def stop(self):
+        if self.sched.poller is self:
+            self.sched.poller = None
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def wakeup(self):
+        self.loop.call_soon_threadsafe(self._schedule)
+
+    def _schedule(self):
+        if self._handle is None:
+            self._handle = self.loop.call_soon(self._run)
+
+    def _run(self):
+        self._handle = None
+        self._runner = self.sched.getcurrent()
+        self.sched.run_once()
+
+    def sleep(self, seconds):
+        """ block the current tasklet for `seconds` while the loop keeps
+        running. Used by the scheduler to wait for its next timer. """
+        sched = self.sched
+        curr = getcurrent()
+
+        def _wake():
+            if curr.blocked:
+                sched.unblock(curr)
+                self._schedule()
+
+        handle = self.loop.call_later(seconds, _wake)
+        curr.blocked = True
+        sched.remove(curr)
+        try:
+            sched.schedule()
+        finally:
+            handle.cancel()
+
+    def await_(self, aw):
+        """ block the current tasklet until the awaitable `aw` is done """
+        sched = self.sched
+        curr = getcurrent()
+        if curr is self._runner:
+            raise RuntimeError("the tasklet running the asyncio loop "
+                    "can't wait for it")
+
+        fut = asyncio.ensure_future(aw, loop=self.loop)
+
+        def _done(f):
+            if curr.blocked:
+                sched.unblock(curr)
+                self._schedule()
+
+        fut.add_done_callback(_done)
+        try:
+            while not fut.done():
+                curr.blocked = True
+                sched.remove(curr)
+                sched.schedule()
+        except:
+            fut.remove_done_callback(_done)
+            if curr.blocked:
+                curr.blocked = False
+                sched.blocked -= 1
+            fut.cancel()
+            raise
+        return fut.result()
+
+    def spawn(self, func, args, kwargs):
+        """ run `func(*args, **kwargs)` in a new tasklet and return an
+        asyncio future of its result """
+        fut = self.loop.create_future()
+
+        def _run():
+            try:
+                result = func(*args, **kwargs)
+            except TaskletExit:
+                if not fut.done():
+                    fut.cancel()
+                raise
+            except Exception:
+                if not fut.done():
+                    fut.set_exception(sys.exc_info()[1])
+            else:
+                if not fut.done():
+                    fut.set_result(result)
+
+        task = tasklet(_run)()
+
+        def _cancel(f):
+            if f.cancelled():
+                task.cancel()
+                self._schedule()
+
+        fut.add_done_callback(_cancel)
+        self._schedule()
+        return fut
+
+
+def install(loop=None):
+    """ run the scheduler of the current thread from the asyncio `loop`,
+    the event loop of the thread by default """
+    bridge = getattr(_tls, 'bridge', None)
+    if bridge is not None:
+        bridge.stop()
+    bridge = _tls.bridge = AsyncioLoop(loop)
+    bridge.start()
+    return bridge
+
+def uninstall():
+    bridge = getattr(_tls, 'bridge', None)
+    if bridge is not None:
+        bridge.stop()
+        _tls.bridge = None
+
+def _get_bridge():
+    bridge = getattr(_tls, 'bridge', None)
+    if bridge is None:
+        raise RuntimeError("no asyncio loop installed in this thread")
+    return bridge
+
+def await_(aw, loop=None):
+    """ block the current tasklet until the asyncio awaitable `aw` is done
+    and return its result or raise its exception. The other tasklets keep
+    running meanwhile.
+
+    By default `aw` runs in the loop installed in the thread. `loop` can
+    be a loop running in another thread, `aw` must then be a coroutine.
+    If the tasklet is killed or cancelled, the asyncio task is
+    cancelled. """
+    bridge = getattr(_tls, 'bridge', None)
+    if loop is None or (bridge is not None and loop is bridge.loop):
+        return _get_bridge().await_(aw)
+
+    future = asyncio.run_coroutine_threadsafe(aw, loop)
+    item = WorkItem(None, (), {})
+
+    def _done(f):
+        if f.cancelled():
+            exc = asyncio.CancelledError()
+        else:
+            exc = f.exception()
+        if exc is None:
+            item._finish(f.result())
+        else:
+            item._finish(exc_info=(exc.__class__, exc, exc.__traceback__))
+
+    future.add_done_callback(_done)
+    try:
+        return item.wait()
+    except:
+        future.cancel()
+        raise
+
+def to_asyncio(func):
+    """ wrap `func` so that calling it runs it in a new tasklet and
+    returns an asyncio future of its result, to be awaited from a
+    coroutine of the installed loop. Cancelling the future cancels the
+    tasklet::
+
+        data = await to_asyncio(fetch)(url)
+    """
+    @functools.wraps(func)
+    def _wrapper(*args, **kwargs):
+        return _get_bridge().spawn(func, args, kwargs)
+    return _wrapper
@@ -8,10 +8,7 @@ import threading
 
 import six
 
-from flower.core.sched import (
-    schedule, getcurrent, get_scheduler,
-    schedrem, thread_ident
-)
+from flower.core.sched import get_scheduler
 
 class bomb(object):
     def __init__(self, exp_type=None, exp_value=None, exp_traceback=None):
@@ -23,17 +20,95 @@ class bomb(object):
         six.reraise(self.type, self.value, self.traceback)
 
 class ChannelWaiter(object):
+    """ a tasklet blocked on a channel and the value it exchanges. Each
+    tasklet reuses the same waiter. """
 
-    __slots__ = ['scheduler', 'task', 'thread_id', 'arg']
+    __slots__ = ['task', 'arg', 'channel']
 
-    def __init__(self, task, scheduler, arg):
+    # set on the waiters of a select, see flower.core.select
+    selection = None
+    # maximum number of values taken at once by a receive_many() waiter
+    batch = 0
+
+    def __init__(self, task, arg):
         self.task = task
-        self.scheduler = scheduler
         self.arg = arg
-        self.thread_id = thread_ident()
+        self.channel = None # the channel it's queued in
+
+    @property
+    def scheduler(self):
+        return self.task.sched
+
+    def release(self):
+        """ withdraw the waiter from the channel it's queued in """
+        ch = self.channel
+        if ch is not None:
+            self.channel = None
+            ch._release(self)
 
     def __str__(self):
-        "waiter: %s" % str(self.task)
+        return "waiter: %s" % str(self.task)
+
+class BatchWaiter(ChannelWaiter):
+    """ a tasklet blocked in receive_many(). send_many() hands it a list
+    of values in `values`, a send() a single value in `arg`. """
+
+    __slots__ = ['batch', 'values']
+
+    def __init__(self, task, batch):
+        super(BatchWaiter, self).__init__(task, None)
+        self.batch = batch
+        self.values = None
+
+class RingBuffer(object):
+    """ fixed size FIFO queue holding the values of a buffered channel.
+    Its slots are allocated once, pushing and popping a value doesn't
+    allocate memory. """
+
+    __slots__ = ['items', 'size', 'head', 'count']
+
+    def __init__(self, size):
+        self.items = [None] * size
+        self.size = size
+        self.head = 0 # index of the oldest value
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def full(self):
+        return self.count == self.size
+
+    def push(self, value):
+        i = self.head + self.count
+        if i >= self.size:
+            i -= self.size
+        self.items[i] = value
+        self.count += 1
+
+    def pop(self):
+        if not self.count:
+            raise IndexError("pop from an empty buffer")
+        head = self.head
+        value = self.items[head]
+        self.items[head] = None
+        head += 1
+        self.head = 0 if head == self.size else head
+        self.count -= 1
+        return value
+
+# shared by the channels until a waiter is queued
+_EMPTY = ()
+
+# the queues of a channel are changed under one of these locks so tasklets
+# and plain threads running in different threads can share a channel. A
+# table of locks is used instead of one lock per channel to keep them small.
+_LOCKS = 64
+_locks = [threading.Lock() for i in range(_LOCKS)]
+
+def _channel_lock(ch):
+    return _locks[(id(ch) >> 4) % _LOCKS]
 
 class channel(object):
     """
@@ -46,21 +121,33 @@ class channel(object):
     the channel. If the capacity is greater than zero, the channel is
     asynchronous: communication operations succeed without blocking if
     the buffer is not full (sends) or not empty (receives), and elements
-    are received in the order they are sent. If the capacity is zero or
-    absent, the communication succeeds only when both a sender and
-    receiver are ready.
+    are received in the order they are sent. A sender blocks while the
+    buffer is full and a receiver while it's empty, as with the channels
+    of Go. If the capacity is zero or absent, the communication succeeds
+    only when both a sender and receiver are ready.
+
+    With `handoff`, a tasklet of the same thread waiting on the channel is
+    switched to directly when its peer arrives: it runs right away,
+    before the other runnable tasklets, and the peer runs next.
     """
 
+    __slots__ = ['capacity', 'closing', 'recvq', 'sendq', 'buffer',
+            'label', 'preference', 'schedule_all', 'handoff',
+            '__weakref__']
 
-    def __init__(self, capacity=None, label=''):
+    def __init__(self, capacity=None, label='', handoff=False):
         self.capacity = capacity
+        # values sent and not received yet, None if the channel is
+        # synchronous
+        self.buffer = RingBuffer(capacity) if capacity else None
         self.closing = False
-        self.recvq = deque()
-        self.sendq = deque()
-        self._lock = threading.Lock()
+        # the queues are only allocated when a waiter is queued
+        self.recvq = _EMPTY
+        self.sendq = _EMPTY
         self.label = label
         self.preference = -1
         self.schedule_all = False
+        self.handoff = handoff
 
     def __str__(self):
         return 'channel[%s](%s,%s)' % (self.label, self.balance, self.queue)
@@ -76,7 +163,12 @@ class channel(object):
 
     @property
     def balance(self):
-        return len(self.sendq) - len(self.recvq)
+        """ number of values ready to be received, buffered or from
+        blocked senders, or minus the number of blocked receivers """
+        balance = len(self.sendq) - len(self.recvq)
+        if self.buffer is not None:
+            balance += self.buffer.count
+        return balance
 
     @property
     def closed(self):
@@ -90,15 +182,71 @@ class channel(object):
 
     def enqueue(self, d, waiter):
         if d > 0:
+            if self.sendq is _EMPTY:
+                self.sendq = deque()
             return self.sendq.append(waiter)
         else:
+            if self.recvq is _EMPTY:
+                self.recvq = deque()
             return self.recvq.append(waiter)
 
+    def _release(self, waiter):
+        """ forget the waiter of a tasklet that stopped waiting. Returns
+        False if a peer already took it. """
+        with _channel_lock(self):
+            for q in (self.recvq, self.sendq):
+                if waiter in q:
+                    q.remove(waiter)
+                    return True
+        return False
+
     def dequeue(self, d):
+        q = self.recvq if d > 0 else self.sendq
+        if not q:
+            raise IndexError("pop from an empty channel queue")
+        waiter = q.popleft()
+        waiter.channel = None
+        return waiter
+
+    def _take_peer(self, d):
+        """ pop the first waiter a send (d > 0) or a receive can be done
+        with, None if there is none. The lock must be held. The waiters
+        of a select already done through another channel are dropped. """
+        q = self.recvq if d > 0 else self.sendq
+        while q:
+            waiter = q.popleft()
+            waiter.channel = None
+            selection = waiter.selection
+            if selection is None or selection.claim(waiter):
+                return waiter
+        return None
+
+    def _try_locked(self, d, arg):
+        """ do a send or a receive if it doesn't have to block. The lock
+        must be held. It returns a tuple (done, value, peer waiter to wake
+        up). """
+        buf = self.buffer
+        target = self._take_peer(d)
         if d > 0:
-            return self.recvq.popleft()
+            if target is not None:
+                target.arg = arg
+            elif buf is not None and buf.count < buf.size:
+                buf.push(arg)
+            else:
+                return False, None, None
+            return True, None, target
+
+        if buf is not None and buf.count:
+            value = buf.pop()
+            if target is not None:
+                buf.push(target.arg)
+        elif target is not None:
+            value = target.arg
         else:
-            return self.sendq.popleft()
+            return False, None, None
+        if target is not None:
+            target.arg = None
+        return True, value, target
 
     def _channel_action(self, arg, d):
         """
@@ -114,60 +262,114 @@ class channel(object):
         assert abs(d) == 1
 
         do_schedule = False
-        curr = getcurrent()
-        source = ChannelWaiter(curr, get_scheduler(), arg)
-
-        if d > 0:
-            if not self.capacity:
-                cando = self.balance < 0
-            else:
-                cando = len(self.recvq) <= self.capacity
-            dir = d
-        else:
-            if not self.capacity:
-                cando = self.balance > 0
+        sched = get_scheduler()
+        curr = sched.getcurrent()
+
+        lock = _channel_lock(self)
+        callback = _channel_callback
+        lock.acquire()
+        while True:
+            buf = self.buffer
+            # senders and receivers don't wait on a channel at the same
+            # time, except for the waiters of a select
+            if d > 0:
+                cando = len(self.recvq) > 0 or (buf is not None and
+                        buf.count < buf.size)
+                dir = d
             else:
-                cando = len(self.sendq) <= self.capacity
-            dir = 0
-
-        if _channel_callback is not None:
-            with self._lock:
-                _channel_callback(self, getcurrent(), dir, not cando)
-
-        if cando:
-            # there is somebody waiting
-            try:
-                target = self.dequeue(d)
-            except IndexError:
-                # capacity is not None but nobody is waiting
-                if d > 0:
-                    self.enqueue(dir, ChannelWaiter(None, None, arg))
+                cando = len(self.sendq) > 0 or (buf is not None and
+                        buf.count > 0)
+                dir = 0
+
+            if callback is None:
+                break
+            # the callback is called without the lock so it can use the
+            # channels too, this one is looked at again afterwards
+            lock.release()
+            callback(self, curr, dir, not cando)
+            callback = None
+            lock.acquire()
+
+        target = self._take_peer(d) if cando else None
+        if buf is not None and (d < 0 and buf.count or
+                d > 0 and target is None and buf.count < buf.size):
+            # the value goes through the buffer, nobody is switched to
+            if d > 0:
+                buf.push(arg)
+                lock.release()
                 return None
 
-            source.arg, target.arg = target.arg, source.arg
-            if target.task is not None:
-                if self.schedule_all:
-                    target.scheduler.unblock(target.task)
-                    do_schedule = True
-                elif self.preference == -d:
-                    target.scheduler.unblock(target.task, False)
-                    do_schedule = True
+            value = buf.pop()
+            if target is not None:
+                # a sender was waiting for room in the buffer
+                buf.push(target.arg)
+                target.arg = None
+            lock.release()
+
+            if target is not None:
+                target.task.sched.unblock(target.task)
+            if isinstance(value, bomb):
+                value.raise_()
+            return value
+
+        if target is not None:
+            # a peer is waiting, exchange the values with its waiter
+            lock.release()
+            value, target.arg = target.arg, arg
+            task = target.task
+            if (self.handoff and task.sched is sched and
+                    sched.handoffs < sched.max_handoffs):
+                sched.handoffs += 1
+                if d > 0 and curr._rq is not None:
+                    # the receiver runs at once
+                    sched.handoff(curr, task)
                 else:
-                    target.scheduler.unblock(target.task)
+                    # the sender runs next, as in Go's runnext slot
+                    sched.unblock(task, False)
+            elif self.handoff:
+                # let the other runnable tasklets have a turn
+                sched.handoffs = 0
+                task.sched.unblock(task)
+            elif buf is not None:
+                # like Go, a buffered channel doesn't yield to the
+                # receiver it hands the value to
+                task.sched.unblock(task)
+            elif self.schedule_all:
+                task.sched.unblock(task)
+                do_schedule = True
+            elif self.preference == -d:
+                task.sched.unblock(task, False)
+                do_schedule = True
+            else:
+                task.sched.unblock(task)
         else:
-            # nobody is waiting
-            source.task.blocked == 1
-            self.enqueue(dir, source)
-            schedrem(source.task)
-            do_schedule = True
+            # nobody is waiting. A peer in another thread can take the
+            # waiter as soon as the lock is released, it then unblocks the
+            # tasklet through our scheduler inbox.
+            waiter = curr._waiter
+            if waiter is None:
+                waiter = curr._waiter = ChannelWaiter(curr, arg)
+            else:
+                waiter.arg = arg
+            waiter.channel = self
+            curr.blocked = 1
+            self.enqueue(dir, waiter)
+            lock.release()
+            sched.remove(curr)
+            try:
+                sched.schedule()
+            finally:
+                # woken up by a raise_exception(), ... the waiter may still
+                # be queued
+                waiter.release()
+            value, waiter.arg = waiter.arg, None
 
         if do_schedule:
-            schedule()
-
+            sched.schedule()
 
-        if isinstance(source.arg, bomb):
-            source.arg.raise_()
-        return source.arg
+        if isinstance(value, bomb):
+            value.raise_()
+        return value
 
     def receive(self):
         """
@@ -187,6 +389,184 @@ class channel(object):
         for item in iterable:
             self.send(item)
 
+    def send_many(self, items):
+        """
+        channel.send_many(items) -- send the values of items, in order.
+        The waiting receivers are given their values at once and woken up
+        once each: a receiver blocked in receive_many() gets a whole batch.
+        The values left are buffered. When they don't fit, the next value
+        is sent like send() and the rest handed over once the sender is
+        woken up. Returns the number of values sent.
+        The receivers woken up are only made runnable: unlike send(), the
+        preference, schedule_all and handoff flags of the channel don't
+        apply.
+        """
+        items = list(items)
+        n = len(items)
+        i = 0
+        while True:
+            i = self._hand_many(items, i)
+            if i == n:
+                return n
+            self.send(items[i])
+            i += 1
+
+    def _hand_many(self, items, i):
+        # hand the values from items[i] to the waiting receivers and the
+        # buffer without blocking. Returns the index of the first value
+        # left.
+        n = len(items)
+        woken = []
+        lock = _channel_lock(self)
+        lock.acquire()
+        while i < n:
+            target = self._take_peer(1)
+            if target is None:
+                break
+            if target.batch:
+                values = []
+                while i < n and len(values) < target.batch:
+                    item = items[i]
+                    if values and isinstance(item, bomb):
+                        # the values before it are received first
+                        break
+                    values.append(item)
+                    i += 1
+                    if isinstance(item, bomb):
+                        break
+                target.values = values
+            else:
+                target.arg = items[i]
+                i += 1
+            woken.append(target)
+
+        buf = self.buffer
+        while buf is not None and i < n and buf.count < buf.size:
+            buf.push(items[i])
+            i += 1
+        lock.release()
+
+        for target in woken:
+            target.task.sched.unblock(target.task)
+        return i
+
+    def _take_sender(self, bombs):
+        # like _take_peer(-1) but a sender of an exception is left in the
+        # queue unless `bombs` is true
+        q = self.sendq
+        while q:
+            target = q[0]
+            if not bombs and isinstance(target.arg, bomb):
+                return None
+            q.popleft()
+            target.channel = None
+            selection = target.selection
+            if selection is None or selection.claim(target):
+                return target
+        return None
+
+    def receive_many(self, max_items, timeout=None):
+        """
+        channel.receive_many(max_items, timeout=None) -- receive up to
+        max_items values over the channel, returned in a list.
+        It takes the values ready, buffered or from blocked senders,
+        without switching. If there is none it blocks until a sender
+        comes: send_many() hands a whole batch at once. After `timeout`
+        seconds without a value an empty list is returned. An exception
+        sent with send_exception() ends a batch, it's raised by the next
+        call.
+        """
+        if max_items < 1:
+            raise ValueError("max_items must be at least 1")
+
+        sched = get_scheduler()
+        curr = sched.getcurrent()
+        values = []
+        woken = []
+
+        lock = _channel_lock(self)
+        lock.acquire()
+        buf = self.buffer
+        while len(values) < max_items:
+            if buf is not None and buf.count:
+                value = buf.items[buf.head]
+                if values and isinstance(value, bomb):
+                    break
+                buf.pop()
+                target = self._take_peer(-1)
+                if target is not None:
+                    # a sender was waiting for room in the buffer
+                    buf.push(target.arg)
+            else:
+                target = self._take_sender(not values)
+                if target is None:
+                    break
+                value = target.arg
+            if target is not None:
+                target.arg = None
+                woken.append(target)
+            values.append(value)
+            if isinstance(value, bomb):
+                break
+
+        if values or (timeout is not None and timeout <= 0):
+            lock.release()
+            for target in woken:
+                target.task.sched.unblock(target.task)
+        else:
+            # nothing to receive, wait for a sender
+            waiter = BatchWaiter(curr, max_items)
+            waiter.channel = self
+            curr.blocked = 1
+            self.enqueue(0, waiter)
+            lock.release()
+            values = self._wait_batch(sched, curr, waiter, timeout)
+
+        if values and isinstance(values[0], bomb):
+            values[0].raise_()
+        return values
+
+    def _wait_batch(self, sched, curr, waiter, timeout):
+        def expired(now, t):
+            if self._release(waiter):
+                waiter.values = []
+                curr.sched.unblock(curr)
+
+        timer = None
+        if timeout is not None:
+            # the timer module imports this one
+            from flower.core.timer import Timer
+            timer = Timer(expired, timeout)
+            timer.start()
+
+        saved, curr._waiter = curr._waiter, waiter
+        sched.remove(curr)
+        try:
+            sched.schedule()
+        finally:
+            curr._waiter = saved
+            waiter.release()
+            if timer is not None:
+                timer.stop()
+
+        if waiter.values is not None:
+            return waiter.values
+        return [waiter.arg]
+
+    def iter_many(self, prefetch=64):
+        """
+        channel.iter_many(prefetch=64) -- iterate over the values received,
+        fetched up to `prefetch` at a time with receive_many(). The
+        iteration ends when StopIteration is sent with send_exception().
+        """
+        while True:
+            try:
+                values = self.receive_many(prefetch)
+            except StopIteration:
+                return
+            for value in values:
+                yield value
+
     def send(self, msg):
         """
         channel.send(value) -- send a value over the channel.
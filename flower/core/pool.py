@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+from collections import deque
+import threading
+
+from flower.util import cpu_count
+from .sched import tasklet, get_scheduler, thread_ident
+
+
+class Worker(object):
+    """ a thread running its own scheduler and the tasklets the pool
+    gave to it """
+
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.pending = deque() # tasklets not started yet, can be stolen
+        self.pinned = deque() # tasklets that must run on this worker
+        self.sched = None
+        self.main = None
+        self._lock = threading.Lock()
+        self._started = threading.Event()
+        self.thread = threading.Thread(target=self._run,
+                name="flower-worker-%s" % index)
+        self.thread.daemon = True
+
+    def __str__(self):
+        return "<worker[%s]>" % self.index
+
+    __repr__ = __str__
+
+    @property
+    def load(self):
+        """ number of tasklets waiting to start or to run """
+        load = len(self.pending) + len(self.pinned)
+        if self.sched is not None:
+            load += len(self.sched.runnable) + self.sched.blocked
+        return load
+
+    def start(self):
+        self.thread.start()
+        self._started.wait()
+
+    def put(self, item, pin=False):
+        if pin:
+            self.pinned.append(item)
+        else:
+            self.pending.append(item)
+        self.notify()
+
+        if not pin and len(self.pending) > 1:
+            # a backlog is building, let an idle worker steal from it
+            self.pool._wake_idle(self)
+
+    @property
+    def idle(self):
+        return self.main is not None and self.main.blocked
+
+    def notify(self):
+        """ wake up the worker main tasklet if it's waiting for work """
+        if self.main is None:
+            # not started yet
+            return
+
+        with self._lock:
+            if self.main.blocked:
+                self.sched.unblock(self.main)
+            else:
+                self.sched.wakeup()
+
+    def _busy(self):
+        # are there other tasklets to run than the worker main tasklet,
+        # the event loop and the timers tasklet?
+        runnable = self.sched.runnable
+        n = len(runnable) - (self.main in runnable)
+        poller = self.sched.poller
+        if poller is not None and poller.task in runnable:
+            n -= 1
+        timers = self.sched.timers
+        if timers is not None and timers.task in runnable:
+            n -= 1
+        return n > 0
+
+    def _take(self):
+        try:
+            return self.pinned.popleft()
+        except IndexError:
+            pass
+
+        try:
+            return self.pending.popleft()
+        except IndexError:
+            return None
+
+    def _start(self, item):
+        task, args, kwargs = item
+        if args is None:
+            task.attach()
+        else:
+            task.thread_id = thread_ident()
+            task.setup(*args, **kwargs)
+
+    def _admit(self):
+        # move the tasklets waiting to start to the scheduler, but keep a
+        # backlog so idle workers can steal them
+        while len(self.sched.runnable) < self.pool.batch:
+            item = self._take()
+            if item is None:
+                break
+            self._start(item)
+
+        if not self._busy():
+            # nothing to do, steal a tasklet waiting on another worker
+            item = self.pool._steal(self)
+            if item is not None:
+                self._start(item)
+
+    def _run(self):
+        self.sched = get_scheduler()
+        self.main = self.sched.getmain()
+        self._started.set()
+
+        while True:
+            self._admit()
+
+            if self._busy():
+                self.sched.schedule()
+                continue
+
+            with self._lock:
+                if self.pending or self.pinned:
+                    continue
+                if self.pool.stopping:
+                    break
+
+                # wait for new tasklets
+                self.main.blocked = True
+                self.sched.remove(self.main)
+            self.sched.schedule()
+
+
+class SchedulerPool(object):
+    """ a pool of worker threads, each one running its own scheduler.
+
+    Tasklets spawned in the pool are given to the least loaded worker.
+    Until they are started they can be stolen by an idle worker, unless
+    they have been pinned to a worker. Tasklets communicate across
+    workers with channels.
+
+    Example::
+
+        pool = SchedulerPool(4)
+        pool.start()
+        c = channel()
+        for data in chunks:
+            pool.spawn(compress, data, c)
+        results = [c.receive() for data in chunks]
+        pool.stop()
+    """
+
+    def __init__(self, size=None, batch=64):
+        if size is None:
+            size = cpu_count()
+        self.size = size
+        self.batch = batch # max number of runnable tasklets per worker
+        self.workers = [Worker(self, i) for i in range(size)]
+        self.stopping = False
+        self.started = False
+
+    def start(self):
+        if self.started:
+            return
+        self.started = True
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self, timeout=None):
+        """ stop the workers once the tasklets they run are done.
+        Tasklets still blocked at this time are dropped. """
+        self.stopping = True
+        for worker in self.workers:
+            worker.notify()
+
+        for worker in self.workers:
+            worker.thread.join(timeout)
+
+    def least_loaded(self):
+        return min(self.workers, key=lambda w: w.load)
+
+    def _worker(self, index):
+        if index is None:
+            return self.least_loaded()
+        return self.workers[index]
+
+    def spawn(self, func, *args, **kwargs):
+        """ spawn a tasklet on the least loaded worker. It returns the
+        tasklet. """
+        task = tasklet(func)
+        self.least_loaded().put((task, args, kwargs))
+        return task
+
+    def spawn_on(self, index, func, *args, **kwargs):
+        """ spawn a tasklet pinned to the worker `index` """
+        task = tasklet(func)
+        self.workers[index].put((task, args, kwargs), pin=True)
+        return task
+
+    def submit(self, task, index=None):
+        """ move a tasklet set up in the current thread and not started
+        yet to a worker. The tasklet is pinned if a worker index is
+        given, otherwise it goes to the least loaded worker. """
+        if task._is_started:
+            raise RuntimeError("only an unstarted tasklet can be submitted")
+        task.sched.remove(task)
+        self._worker(index).put((task, None, None), pin=index is not None)
+        return task
+
+    def _wake_idle(self, busy):
+        for worker in self.workers:
+            if worker is not busy and worker.idle:
+                worker.notify()
+                return
+
+    def _steal(self, thief):
+        # take the last unpinned tasklet waiting on the busiest worker
+        victim = max(self.workers, key=lambda w: len(w.pending))
+        if victim is thief:
+            return None
+
+        try:
+            return victim.pending.pop()
+        except IndexError:
+            return None
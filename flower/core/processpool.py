@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+import multiprocessing
+import sys
+import threading
+
+from six.moves import cPickle as pickle
+
+from flower.util import cpu_count
+from .channel import bomb, channel
+from .sched import get_scheduler, helper_thread, add_helper_thread
+from .threadpool import WorkItem
+
+
+def _call(func, args, kwargs):
+    # run in the worker process. The exception is returned so it doesn't
+    # depend on the error callback of the pool.
+    try:
+        return True, func(*args, **kwargs)
+    except Exception:
+        return False, sys.exc_info()[1]
+
+# marks the end of the results of a map
+_DONE = object()
+
+# apply_async() reports the calls it can't send to the processes since
+# python 3.2
+_ERROR_CALLBACK = sys.version_info >= (3, 2)
+
+def _receive_from_thread(ch):
+    # the thread feeding the channel keeps run() going meanwhile
+    sched = get_scheduler()
+    sched.pending += 1
+    try:
+        return ch.receive()
+    finally:
+        sched.pending -= 1
+
+
+class ProcessPool(object):
+    """ a pool of processes running the CPU bound calls of the tasklets.
+
+    The processes are started on the first call. Results are read by the
+    threads of the pool and handed to the scheduler of the waiting tasklet,
+    which keeps running the other tasklets and polling I/O meanwhile::
+
+        pool = ProcessPool(4)
+        digest = pool.run(compute_digest, data)
+        for result in pool.map(compress, chunks):
+            ...
+
+    Functions, arguments and results must be picklable.
+    """
+
+    def __init__(self, size=None):
+        if size is None:
+            size = cpu_count()
+        self.size = size
+        self._pool = None
+        self._lock = threading.Lock()
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    pool = multiprocessing.Pool(self.size)
+                    # the threads handing the calls to the processes
+                    for name in ('_worker_handler', '_task_handler',
+                            '_result_handler'):
+                        th = getattr(pool, name, None)
+                        if th is not None:
+                            add_helper_thread(th)
+                    self._pool = pool
+        return self._pool
+
+    def close(self):
+        """ stop the processes once the queued calls are done """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def submit(self, func, *args, **kwargs):
+        """ queue a call and return its WorkItem without waiting. A call
+        cancelled can still run, its result is then dropped. """
+        item = WorkItem(func, args, kwargs)
+
+        def _done(res):
+            ok, value = res
+            if ok:
+                item._finish(value)
+            else:
+                item._finish(exc_info=(value.__class__, value, None))
+
+        def _error(exc):
+            # the call, its arguments or its result couldn't be pickled
+            item._finish(exc_info=(exc.__class__, exc, None))
+
+        if _ERROR_CALLBACK:
+            self.pool.apply_async(_call, (func, args, kwargs),
+                    callback=_done, error_callback=_error)
+            return item
+
+        # the pool would lose the call, make sure it can be sent first
+        try:
+            pickle.dumps((func, args, kwargs), pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            _error(sys.exc_info()[1])
+            return item
+        self.pool.apply_async(_call, (func, args, kwargs), callback=_done)
+        return item
+
+    def run(self, func, *args, **kwargs):
+        """ run `func(*args, **kwargs)` in a process of the pool and wait
+        for its result """
+        return self.submit(func, *args, **kwargs).wait()
+
+    def map(self, func, iterable, ordered=True, chunksize=1):
+        """ call `func` on each item of `iterable` in the processes of the
+        pool and iterate over the results as they arrive, in the order of
+        the items unless `ordered` is False.
+
+        The results are sent to the current tasklet over a channel, the
+        next one is only read once it has been received. An exception
+        raised by a call stops the iteration. """
+        ch = channel()
+        state = {'stopped': False}
+
+        if ordered:
+            results = self.pool.imap(func, iterable, chunksize)
+        else:
+            results = self.pool.imap_unordered(func, iterable, chunksize)
+
+        def feed():
+            try:
+                for result in results:
+                    if state['stopped']:
+                        break
+                    ch.send(result)
+            except Exception:
+                ch.send(bomb(*sys.exc_info()))
+            ch.send(_DONE)
+
+        th = helper_thread(feed, "flower-process-map")
+        return self._receive(th, ch, state)
+
+    def _receive(self, th, ch, state):
+        th.start()
+        try:
+            while True:
+                result = _receive_from_thread(ch)
+                if result is _DONE:
+                    return
+                yield result
+        except GeneratorExit:
+            # the caller stopped early, release the feeding thread
+            state['stopped'] = True
+            while True:
+                try:
+                    if _receive_from_thread(ch) is _DONE:
+                        break
+                except Exception:
+                    pass
+            raise
+        except Exception:
+            # a call failed, the thread sends the end of the results next
+            _receive_from_thread(ch)
+            raise
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_process_pool():
+    """ return the process pool used by run_in_process and process_map """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPool()
+    return _pool
+
+def run_in_process(func, *args, **kwargs):
+    """ run a CPU bound function in a process of the pool. The current
+    tasklet waits for the result while the others keep running. """
+    return get_process_pool().run(func, *args, **kwargs)
+
+def process_map(func, iterable, ordered=True, chunksize=1):
+    """ iterate over the results of `func` called on each item of
+    `iterable` in the processes of the pool. See ProcessPool.map. """
+    return get_process_pool().map(func, iterable, ordered, chunksize)
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+import weakref
+
+# tasklet priorities, the lower value runs first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITIES = 3
+
+
+class RunQueue(object):
+    """ queue of runnable tasks used by the scheduler.
+
+    Tasks are linked together in a circular doubly linked list, the
+    queue itself being the sentinel node. Links are stored on the tasks
+    (``_rq``, ``_rq_prev`` and ``_rq_next`` attributes) so appending,
+    removing, testing the membership and rotating the queue are done in
+    constant time whatever the number of queued tasks.
+
+    A task can only be queued once. Queuing a task already in the queue
+    moves it to its new position.
+    """
+
+    __slots__ = ['_rq_prev', '_rq_next', '_len', 'owner', 'level', 'group']
+
+    def __init__(self, owner=None, level=None, group=None):
+        self._rq_prev = self._rq_next = self
+        self._len = 0
+        # set when the queue is part of a PriorityRunQueue
+        self.owner = owner
+        self.level = level
+        self.group = group
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+    __nonzero__ = __bool__
+
+    def __contains__(self, task):
+        return getattr(task, '_rq', None) is self
+
+    def __iter__(self):
+        node = self._rq_next
+        while node is not self:
+            next = node._rq_next
+            yield node
+            node = next
+
+    def __getitem__(self, idx):
+        if idx == 0 and self._len:
+            return self._rq_next
+        elif idx == -1 and self._len:
+            return self._rq_prev
+        raise IndexError("run queue index out of range")
+
+    def _detach(self, task):
+        rq = getattr(task, '_rq', None)
+        if rq is not None:
+            rq._unlink(task)
+
+    def _link(self, task, prev):
+        next = prev._rq_next
+        task._rq_prev = prev
+        task._rq_next = next
+        prev._rq_next = next._rq_prev = task
+        task._rq = self
+        self._len += 1
+
+    def _unlink(self, task):
+        prev, next = task._rq_prev, task._rq_next
+        prev._rq_next = next
+        next._rq_prev = prev
+        task._rq = task._rq_prev = task._rq_next = None
+        self._len -= 1
+
+    def append(self, task):
+        """ add a task at the end of the queue """
+        self._detach(task)
+        self._link(task, self._rq_prev)
+
+    def appendleft(self, task):
+        """ add a task at the head of the queue """
+        self._detach(task)
+        self._link(task, self)
+
+    def appendnext(self, task):
+        """ add a task right after the head of the queue, so it will be
+        the next one to run """
+        if self._rq_next is task:
+            return
+        self._detach(task)
+        if self._len:
+            self._link(task, self._rq_next)
+        else:
+            self._link(task, self)
+
+    def remove(self, task):
+        """ remove a task from the queue. Raise ValueError if the task
+        isn't queued """
+        if getattr(task, '_rq', None) is not self:
+            raise ValueError("task not in the run queue")
+        self._unlink(task)
+
+    def popleft(self):
+        if not self._len:
+            raise IndexError("pop from an empty run queue")
+        task = self._rq_next
+        self._unlink(task)
+        return task
+
+    def rotate(self):
+        """ move the head of the queue to its end """
+        if self._len > 1:
+            # the queue is circular, moving the sentinel after the head
+            # is enough
+            head = self._rq_next
+            next, tail = head._rq_next, self._rq_prev
+            next._rq_prev = self
+            self._rq_next = next
+            tail._rq_next = head
+            head._rq_prev = tail
+            head._rq_next = self
+            self._rq_prev = head
+
+    def pick(self, curr):
+        """ return the task to run after `curr`, or None if the queue is
+        empty. If `curr` is the head of the queue, it's moved to its end
+        first. """
+        head = self._rq_next
+        if head is not curr or self._len < 2:
+            return head if head is not self else None
+
+        # rotate inlined, it's called on each switch
+        next, tail = head._rq_next, self._rq_prev
+        next._rq_prev = self
+        self._rq_next = next
+        tail._rq_next = head
+        head._rq_prev = tail
+        head._rq_next = self
+        self._rq_prev = head
+        return next
+
+    def clear(self):
+        while self._len:
+            self.popleft()
+
+
+class TaskletGroup(object):
+    """ a group of tasklets sharing the CPU with the other groups.
+
+    When tasklets of several groups are runnable at the same priority,
+    the scheduler runs first the group that consumed the least run time
+    relative to its shares. The tasklets created by a tasklet of a group
+    belong to the same group. Tasklets without a group belong to
+    `default_group`.
+    """
+
+    _groups = weakref.WeakKeyDictionary()
+
+    def __init__(self, name='', shares=1):
+        if shares <= 0:
+            raise ValueError("shares must be positive")
+        self.name = name
+        self.shares = shares
+        self.usage = 0.0 # run time consumed by the tasklets, in seconds
+        self.switches = 0 # number of switches to the tasklets
+        self.vtime = 0.0 # run time weighted by the shares
+        self._groups[self] = True
+
+    def __str__(self):
+        return '<group[%s]>' % self.name
+
+    __repr__ = __str__
+
+    def charge(self, elapsed):
+        self.usage += elapsed
+        self.vtime += elapsed / self.shares
+
+    def stats(self):
+        return dict(name=self.name, shares=self.shares, usage=self.usage,
+                switches=self.switches)
+
+default_group = TaskletGroup('default')
+
+def group_stats():
+    """ return the usage of all the tasklet groups """
+    return [group.stats() for group in list(TaskletGroup._groups)]
+
+
+class FairQueue(object):
+    """ a level of a PriorityRunQueue. Each tasklet group has its own
+    RunQueue and the next task is taken from the group with the least
+    weighted run time. """
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.queues = {} # group -> RunQueue
+        self._rqs = [] # the queues, iterated on each pick
+
+    def __len__(self):
+        return sum(rq._len for rq in self._rqs)
+
+    def __iter__(self):
+        for rq in list(self._rqs):
+            for task in rq:
+                yield task
+
+    def queue(self, task):
+        """ return the queue of the task group """
+        group = task.group
+        if group is None:
+            group = default_group
+
+        rq = self.queues.get(group)
+        if rq is None:
+            self._prune()
+            rq = self.queues[group] = RunQueue(self.owner, self, group)
+            self._rqs.append(rq)
+
+        if not rq._len:
+            # the group becomes runnable, it doesn't get back the time it
+            # has been idle
+            vmin = self.min_vtime()
+            if vmin is not None and group.vtime < vmin:
+                group.vtime = vmin
+        return rq
+
+    def _prune(self):
+        # forget the groups without runnable tasks
+        for group, rq in list(self.queues.items()):
+            if not rq._len and group is not default_group:
+                del self.queues[group]
+                self._rqs.remove(rq)
+
+    def min_vtime(self):
+        vmin = None
+        for rq in self._rqs:
+            if rq._len and (vmin is None or rq.group.vtime < vmin):
+                vmin = rq.group.vtime
+        return vmin
+
+    def next(self):
+        """ return the queue of the group to run, None if the level is
+        empty """
+        rqs = self._rqs
+        if len(rqs) == 1:
+            # a single group, the common case
+            rq = rqs[0]
+            return rq if rq._len else None
+
+        best = None
+        for rq in rqs:
+            if rq._len and (best is None or
+                    rq.group.vtime < best.group.vtime):
+                best = rq
+        return best
+
+    def clear(self):
+        for rq in self._rqs:
+            rq.clear()
+
+
+class PriorityRunQueue(object):
+    """ multi-level run queue.
+
+    Tasks are queued in the level given by their ``priority`` attribute
+    and the tasks of a level are only picked when all the levels before
+    are empty. To not starve the lower levels, a level skipped
+    `starvation_limit` times in a row while it had tasks waiting is
+    picked once. A task alone at the head of the levels yields to the
+    next level when it reschedules itself.
+
+    In a level the CPU is shared between the tasklet groups (see
+    FairQueue).
+
+    It exposes the same interface as RunQueue.
+    """
+
+    def __init__(self, levels=PRIORITIES, starvation_limit=16):
+        self.levels = [FairQueue(self) for i in range(levels)]
+        self.starvation_limit = starvation_limit
+        self._skips = [0] * levels
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+    __nonzero__ = __bool__
+
+    def __contains__(self, task):
+        rq = getattr(task, '_rq', None)
+        return rq is not None and rq.owner is self
+
+    def __iter__(self):
+        for level in self.levels:
+            for task in level:
+                yield task
+
+    def __getitem__(self, idx):
+        levels = self.levels if idx >= 0 else reversed(self.levels)
+        for level in levels:
+            rq = level.next()
+            if rq is not None:
+                return rq[idx]
+        raise IndexError("run queue index out of range")
+
+    def _queue(self, task):
+        # the queue of the task level and group. The task is counted
+        # here, it's detached from the queue it's in when linked again.
+        rq = task._rq
+        if rq is not None and rq.owner is not None:
+            rq.owner._len -= 1
+        self._len += 1
+        return self.levels[task.priority].queue(task)
+
+    def append(self, task):
+        self._queue(task).append(task)
+
+    def appendleft(self, task):
+        self._queue(task).appendleft(task)
+
+    def appendnext(self, task):
+        self._queue(task).appendnext(task)
+
+    def remove(self, task):
+        rq = getattr(task, '_rq', None)
+        if rq is None or rq.owner is not self:
+            raise ValueError("task not in the run queue")
+        rq.remove(task)
+        self._len -= 1
+
+    def popleft(self):
+        for level in self.levels:
+            rq = level.next()
+            if rq is not None:
+                self._len -= 1
+                return rq.popleft()
+        raise IndexError("pop from an empty run queue")
+
+    def rotate(self):
+        for level in self.levels:
+            rq = level.next()
+            if rq is not None:
+                return rq.rotate()
+
+    def clear(self):
+        for level in self.levels:
+            level.clear()
+        self._len = 0
+
+    def pick(self, curr):
+        """ return the task to run after `curr`, or None if the queue is
+        empty. If `curr` is at the head of its queue, it's moved to the
+        end of the queue first. """
+        yielding = None
+        rq = curr._rq
+        if rq is not None and rq._rq_next is curr and rq.owner is self:
+            if rq._len > 1:
+                rq.rotate()
+            elif len(rq.level) == 1:
+                yielding = rq.level
+
+        skips = self._skips
+        chosen = None
+        for i, level in enumerate(self.levels):
+            if level is yielding:
+                continue
+            rqs = level._rqs
+            if len(rqs) == 1:
+                # level.next() inlined, it's called on each switch
+                rq = rqs[0]
+                if not rq._len:
+                    continue
+            else:
+                rq = level.next()
+                if rq is None:
+                    continue
+
+            if chosen is None:
+                chosen = rq
+                skips[i] = 0
+            else:
+                # waiting behind a higher priority level
+                skips[i] += 1
+                if skips[i] >= self.starvation_limit:
+                    skips[i] = 0
+                    chosen = rq
+                    break
+
+        if chosen is None:
+            if yielding is not None:
+                return curr
+            return None
+        return chosen._rq_next
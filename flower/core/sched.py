@@ -4,17 +4,23 @@
 
 
 from collections import deque
-import operator
+import sys
 import threading
 import time
+import weakref
 
 _tls = threading.local()
 
 import greenlet
 import six
 
+from .runqueue import (PriorityRunQueue, PRIORITY_HIGH, PRIORITY_NORMAL,
+        PRIORITY_LOW, PRIORITIES, default_group)
 from .util import thread_ident
 
+# clock used to account the run time of the tasklets
+_clock = getattr(time, 'perf_counter', time.time)
+
 
 class TaskletExit(Exception):
     pass
@@ -27,8 +33,21 @@ except ImportError:
     setattr(builtins, 'TaskletExit', TaskletExit)
 
 CoroutineExit = TaskletExit
+
+# shared by the tasklets set up without keyword arguments, it's only
+# unpacked in a call so never modified
+_NO_KWARGS = {}
 _global_task_id = 0
 
+def _thread_id():
+    # the id of the current thread, the same int object is shared by the
+    # tasklets of the thread
+    try:
+        return _tls.thread_id
+    except AttributeError:
+        tid = _tls.thread_id = thread_ident()
+        return tid
+
 def _coroutine_getcurrent():
     try:
         return _tls.current_coroutine
@@ -39,32 +58,76 @@ def _coroutine_getmain():
     try:
         return _tls.main_coroutine
     except AttributeError:
-        main = coroutine()
+        # the main coroutine becomes the main tasklet of the scheduler
+        main = tasklet.__new__(tasklet, label='main')
         main._is_started = -1
         main._greenlet = greenlet.getcurrent()
+        main._bound = None
         _tls.main_coroutine = main
         return _tls.main_coroutine
 
+def _run_starter():
+    # body of the greenlet starting the new greenlets, see coroutine.switch
+    gr = greenlet.getcurrent().parent.switch()
+    while True:
+        gr = gr.switch()
+
+def _get_starter():
+    try:
+        return _tls.starter
+    except AttributeError:
+        starter = _tls.starter = greenlet.greenlet(_run_starter)
+        starter.switch()
+        return starter
+
 class coroutine(object):
-    """ simple wrapper to bind lazily a greenlet to a function """
+    """ simple wrapper to bind lazily a greenlet to a function. The
+    greenlet is only created when the coroutine is switched to for the
+    first time. """
 
-    _is_started = 0
+    __slots__ = ['_is_started', '_greenlet', '_bound', '__dict__',
+            '__weakref__']
 
     def __init__(self):
-        self._greenlet = greenlet
+        self._is_started = 0
+        self._greenlet = None
+        self._bound = None
 
     def bind(self, func, *args, **kwargs):
-        def _run():
-            _tls.current_coroutine = self
-            self._is_started = 1
-            func(*args, **kwargs)
         self._is_started = 0
-        self._greenlet = greenlet.greenlet(_run)
+        self._bound = (func, args, kwargs)
+        self._greenlet = None
+
+    def _bootstrap(self):
+        _tls.current_coroutine = self
+        self._is_started = 1
+        func, args, kwargs = self._bound
+        self._bound = None
+        self._run(func, args, kwargs)
+
+    def _run(self, func, args, kwargs):
+        func(*args, **kwargs)
+
+    def _get_greenlet(self):
+        gr = self._greenlet
+        if gr is None:
+            # first switch. The main greenlet of the thread is the parent
+            # so the coroutine returns to it when it ends.
+            gr = self._greenlet = greenlet.greenlet(self._bootstrap,
+                    _coroutine_getmain()._greenlet)
+        return gr
 
     def switch(self):
         current = _coroutine_getcurrent()
         try:
-            self._greenlet.switch()
+            if self._greenlet is None and current is not _tls.main_coroutine:
+                # a greenlet starts at the recursion depth of the one
+                # switching to it. Start it from a greenlet at the bottom
+                # of the stack so the depth doesn't add up when blocked
+                # tasklets start each other.
+                _get_starter().switch(self._get_greenlet())
+            else:
+                self._get_greenlet().switch()
         finally:
             _tls.current_coroutine = current
 
@@ -77,7 +140,7 @@ class coroutine(object):
     def throw(self, *args):
         current = _coroutine_getcurrent()
         try:
-            self._greenlet.throw(*args)
+            self._get_greenlet().throw(*args)
         finally:
             _tls.current_coroutine = current
 
@@ -87,7 +150,8 @@ class coroutine(object):
 
     @property
     def is_zombie(self):
-        return self._is_started > 0 and bool(self._greenlet.dead)
+        return (self._is_started > 0 and self._greenlet is not None
+                and bool(self._greenlet.dead))
 
     getcurrent = staticmethod(_coroutine_getcurrent)
 
@@ -107,28 +171,72 @@ class tasklet(coroutine):
     At program start, there is always one running main tasklet.
     New tasklets can be created with methods from the stackless
     module.
+
+    The priority sets the run queue level of the tasklet:
+    PRIORITY_HIGH, PRIORITY_NORMAL (default) or PRIORITY_LOW. A change of
+    priority is applied the next time the tasklet is queued.
+
+    The group is the TaskletGroup its run time is charged to. By default a
+    tasklet belongs to the group of the tasklet creating it.
+
+    ``switches`` counts the switches to the tasklet and ``run_time`` is
+    the time it has been running, in seconds.
+
+    A tasklet set up inside a cancel scope belongs to it, see
+    flower.core.scope.
     """
+
+    # attributes are slots to keep a tasklet small, other attributes are
+    # stored in a __dict__ created on first use.
+    __slots__ = ['func', 'label', 'priority', 'group', 'alive', 'blocked',
+            'sched', 'thread_id', '_task_id', 'switches', 'run_time',
+            # run queue links, see flower.core.runqueue
+            '_rq', '_rq_prev', '_rq_next',
+            # channel waiter reused each time the tasklet blocks
+            '_waiter']
+
     tempval = None
 
-    def __new__(cls, func=None, label=''):
+    # only set on the tasklets in a cancel scope
+    _scope = None
+    _cancelled = False # TaskletExit is raised when it's switched to
+
+    # only set on the tasklets created by Scheduler.spawn
+    _generation = 0 # incremented each time the tasklet is recycled
+    _work = None
+
+    def __new__(cls, func=None, label='', priority=PRIORITY_NORMAL,
+            group=None):
         res = coroutine.__new__(cls)
         res.label = label
         res._task_id = None
         return res
 
 
-    def __init__(self, func=None, label=''):
+    def __init__(self, func=None, label='', priority=PRIORITY_NORMAL,
+            group=None):
         coroutine.__init__(self)
-        self._init(func, label)
+        self._init(func, label, priority, group)
 
-    def _init(self, func=None, label=''):
+    def _init(self, func=None, label='', priority=PRIORITY_NORMAL,
+            group=None):
         global _global_task_id
+        if not 0 <= priority < PRIORITIES:
+            raise ValueError("invalid priority: %r" % priority)
         self.func = func
         self.label = label
+        self.priority = priority
+        self.switches = 0
+        self.run_time = 0.0
+        self._rq = self._rq_prev = self._rq_next = None
+        self._waiter = None
+        if group is None:
+            group = getattr(_coroutine_getcurrent(), 'group', None)
+        self.group = group
         self.alive = False
         self.blocked = False
         self.sched = None
-        self.thread_id = thread_ident()
+        self.thread_id = _thread_id()
         self._task_id = _global_task_id
         _global_task_id += 1
 
@@ -157,44 +265,163 @@ class tasklet(coroutine):
         """
         supply the parameters for the callable
         """
+        sched = get_scheduler()
+        self._setup(sched, argl, argd)
+        sched.append(self)
+        return self
+
+    def _setup(self, sched, argl, argd):
+        # bind the tasklet to its function, ready to be queued in sched
         if self.func is None:
             raise TypeError('tasklet function must be callable')
-        func = self.func
-        sched = self.sched = get_scheduler()
-
-        def _func():
+        self.sched = sched
+        # same as coroutine.bind() without packing the arguments again
+        self._is_started = 0
+        self._bound = (self.func, argl, argd or _NO_KWARGS)
+        self._greenlet = None
+        self.func = None
+        self.alive = True
+        self._join_scope()
+        if _spawn_callback is not None:
+            _spawn_callback(self)
+
+    def _join_scope(self):
+        # the tasklet belongs to the cancel scope of its creator
+        scope = getattr(_coroutine_getcurrent(), '_scope', None)
+        if scope is not None:
+            scope._add(self)
+
+    def _leave_scope(self):
+        scope = self._scope
+        if scope is not None:
+            self._scope = None
+            scope._discard(self)
+
+    def _run(self, func, argl, argd):
+        try:
+            try:
+                func(*argl, **argd)
+            except TaskletExit:
+                pass
+        finally:
+            # the tasklet may have been attached to another scheduler
+            self.sched.remove(self)
+            self.alive = False
+            self._leave_scope()
+
+    def attach(self):
+        """ attach a tasklet set up in another thread to the scheduler of
+        the current thread. Only a tasklet not started yet can be moved.
+        It must be removed first from the scheduler it was set up in. """
+        if not self.alive or self._is_started:
+            raise RuntimeError("only an unstarted tasklet can be attached")
+        if self in self.sched:
+            raise RuntimeError("the tasklet is still in another scheduler")
+
+        # the greenlet is created when the tasklet is first switched to,
+        # in the thread of the scheduler it's attached to
+        self.thread_id = thread_ident()
+        self.sched = get_scheduler()
+        self.sched.append(self)
+        return self
 
+    def _run_recyclable(self):
+        # body of the greenlet of a tasklet spawned with Scheduler.spawn.
+        # When the function returns, the tasklet waits in the free list of
+        # its scheduler to run the next one instead of ending.
+        while True:
+            func, args, kwargs = self._work
+            self._work = None
             try:
                 try:
-                    func(*argl, **argd)
+                    func(*args, **kwargs)
                 except TaskletExit:
                     pass
             finally:
-                sched.remove(self)
+                self.sched.remove(self)
                 self.alive = False
+                self._leave_scope()
 
-        self.func = None
-        coroutine.bind(self, _func)
-        self.alive = True
-        sched.append(self)
-        return self
+            if not self.sched._recycle(self):
+                return
+
+            try:
+                while self._work is None:
+                    self.sched.remove(self)
+                    self.sched.schedule()
+            except TaskletExit:
+                # cancelled before its next function started
+                self.alive = False
+                self._leave_scope()
+                return
 
     def run(self):
         self.insert()
         _scheduler_switch(getcurrent(), self)
 
     def kill(self):
-        if self.is_alive:
+        if self.alive and self.is_alive:
             # Killing the tasklet by throwing TaskletExit exception.
+            self._release_wait()
             coroutine.kill(self)
 
         schedrem(self)
         self.alive = False
 
+    def cancel(self):
+        """ raise TaskletExit in the tasklet where it's blocked or waiting
+        to run, the next time it's scheduled. A channel it's waiting on
+        forgets it. A tasklet not started yet is dropped. It can be called
+        from any thread. """
+        if not self.alive and self._is_started >= 0:
+            # ended, the main tasklet is never marked alive
+            return
+
+        sched = self.sched
+        if sched is not None and _thread_id() != sched.thread_id:
+            sched.call_soon_threadsafe(self.cancel)
+            return
+
+        if self is getcurrent() and not self.blocked:
+            raise TaskletExit
+
+        if not self._is_started:
+            # never ran, no need to switch to it
+            if sched is not None:
+                sched.remove(self)
+            self._bound = None
+            self._work = None
+            self.alive = False
+            self._leave_scope()
+            return
+
+        self._cancelled = True
+        if self._release_wait():
+            sched.append(self)
+
+    def _release_wait(self):
+        # stop waiting for a channel or a wakeup. Returns True if the
+        # tasklet was blocked.
+        waiter = self._waiter
+        if waiter is not None:
+            waiter.release()
+
+        if not self.blocked:
+            return False
+        self.blocked = False
+        if self.sched is not None:
+            self.sched.blocked -= 1
+        return True
+
     def raise_exception(self, exc, *args):
         if not self.is_alive:
             return
-        schedrem(self)
+        # it runs again like any runnable tasklet once it handled the
+        # error
+        self._release_wait()
+        sched = self.sched
+        if sched is not None and self not in sched:
+            sched.append(self)
         coroutine.throw(self, exc, *args)
 
 
@@ -218,85 +445,425 @@ class Scheduler(object):
         # define the main tasklet
         self._main_coroutine = _coroutine_getmain()
         self._main_tasklet = _coroutine_getcurrent()
-        self._main_tasklet.__class__ = tasklet
-        six.get_method_function(self._main_tasklet._init)(self._main_tasklet,
-                label='main')
+        self._main_tasklet._init(label='main')
+        self._main_tasklet.sched = self
+        _get_starter()
         self._last_task = self._main_tasklet
+        self._switch_time = _clock() # time of the last switch
+        self._idle_start = None
+
+        # statistics, see get_stats()
+        self.started = self._stats_time = self._switch_time
+        self.switches = 0
+        self._stats_switches = 0
+        self.busy_time = 0.0 # time running tasklets, the loop included
+        self.idle_time = 0.0 # time parked or waiting for I/O events
+        self.runnable_max = 0 # high-water mark of the run queue
+
+        # finished tasklets kept to be reused by spawn()
+        self.free = []
+        self.max_free = 1024
 
         self.thread_id = thread_ident() # the scheduler thread id
-        self._lock = threading.Lock() # global scheduler lock
+        self.thread = threading.current_thread()
+        self._inbox = deque() # callbacks queued by other threads
 
         self._callback = None # scheduler callback
         self._run_calls = [] # runcalls. (tasks where run apply
-        self.runnable = deque() # runnable tasks
+        self.runnable = PriorityRunQueue() # runnable tasks
         self.blocked = 0 # number of blocked/sleeping tasks
+        # blocked tasks only this thread can wake up, like the timers
+        # tasklet without timers
+        self.background = 0
+        self.pending = 0 # number of tasks waiting for a call in a thread
+        # direct handoffs between channel peers before the other
+        # runnable tasklets get a turn
+        self.handoffs = 0
+        self.max_handoffs = 16
+        self.poller = None # event loop polling I/O (see flower.core.uv)
+        self.timers = None # timers of the thread, see flower.core.timer
+        # I/O polling cadence: once it polled, the event loop tasklet runs
+        # again after `poll_batch` tasklets ran or `poll_interval` seconds,
+        # whichever comes first. See run_batch().
+        self.poll_batch = 1
+        self.poll_interval = None
+        self.polls = 0
+        self._poll_task = None # event loop tasklet waiting for its turn
+        self._poll_switches = 0
+        self._poll_deadline = None
+        self._parked = threading.Event() # set to wake up a parked thread
         self.append(self._main_tasklet)
 
     def send(self):
-        self._async.send()
+        self.wakeup()
+
+    def call_soon_threadsafe(self, func, *args):
+        """ call `func(*args)` from the thread of this scheduler. It can
+        be called from any thread, the scheduler thread is woken up to run
+        it the next time it schedules. `func` shouldn't block. """
+        self._inbox.append((func, args))
+        self.wakeup()
+
+    def drain(self):
+        """ run the callbacks queued by call_soon_threadsafe() """
+        inbox = self._inbox
+        while inbox:
+            func, args = inbox.popleft()
+            try:
+                func(*args)
+            except Exception:
+                sys.excepthook(*sys.exc_info())
+
+    def wakeup(self):
+        """ wake up the thread of this scheduler if it's parked or
+        polling the event loop. It can be called from any thread. """
+        poller = self.poller
+        if poller is not None:
+            poller.wakeup()
+        else:
+            self._parked.set()
+
+    def park(self, timeout=None):
+        """ block the thread until wakeup() is called or the timeout
+        expires. Returns False if the timeout expired. """
+        self.begin_idle()
+        woken = self._parked.wait(timeout)
+        self._parked.clear()
+        self.end_idle()
+        return woken
+
+    def _wakeup_possible(self):
+        # a blocked tasklet can be woken up by a call run in a thread for
+        # it or by any other thread, but the helper threads of flower
+        # (thread pool, watchdog, ...) which only run such calls.
+        if self.pending:
+            return True
+        for th in threading.enumerate():
+            if th is not self.thread and th not in _helper_threads:
+                return True
+        return False
+
+    def begin_idle(self):
+        """ the thread is about to wait for events """
+        self._idle_start = _clock()
+
+    def end_idle(self):
+        """ the thread is done waiting. The time spent is counted as idle
+        time instead of being charged to the current tasklet. """
+        if self._idle_start is None:
+            return
+        now = _clock()
+        self.idle_time += now - self._idle_start
+        self._idle_start = None
+        self._switch_time = max(self._switch_time, now)
+
+    def get_stats(self):
+        """ return a snapshot of the scheduler statistics:
+
+        - switches: number of switches between tasklets
+        - switches_per_sec: switch rate since the previous call
+        - runnable, runnable_max: size of the run queue and its high-water
+          mark
+        - blocked: number of blocked tasklets
+        - busy_time: time spent running tasklets, in seconds
+        - loop_time: part of busy_time spent in the event loop tasklet
+        - idle_time: time spent parked or waiting for I/O events
+        - polls: number of times the event loop polled for I/O while
+          tasklets were runnable
+        """
+        now = _clock()
+        elapsed = now - self._stats_time
+        if elapsed > 0:
+            rate = (self.switches - self._stats_switches) / elapsed
+        else:
+            rate = 0.0
+        self._stats_time = now
+        self._stats_switches = self.switches
+
+        poller = self.poller
+        loop_time = poller.task.run_time if poller is not None else 0.0
+        return dict(switches=self.switches,
+                switches_per_sec=rate,
+                runnable=len(self.runnable),
+                runnable_max=self.runnable_max,
+                blocked=self.blocked,
+                busy_time=self.busy_time,
+                loop_time=loop_time,
+                idle_time=self.idle_time,
+                polls=self.polls,
+                uptime=now - self.started)
+
+    def set_poll_cadence(self, batch=1, interval=None):
+        """ set how often the event loop polls for I/O while tasklets are
+        runnable: after `batch` tasklets ran or `interval` seconds elapsed,
+        whichever comes first. A large batch favours the throughput of the
+        tasklets, a small one or a short interval the I/O latency. """
+        if batch < 1:
+            raise ValueError("batch must be at least 1")
+        self.poll_batch = batch
+        self.poll_interval = interval
+
+    def run_batch(self, task):
+        """ called by the event loop tasklet `task` once it polled for
+        I/O. It's taken out of the run queue until a batch of the other
+        tasklets ran. The batch is never larger than the number of
+        tasklets waiting, so with a few of them I/O is still polled after
+        each round. """
+        self.polls += 1
+        waiting = len(self.runnable) - (task in self.runnable)
+        if waiting <= 0:
+            return
+
+        self._poll_task = task
+        self._poll_switches = self.switches + min(self.poll_batch, waiting)
+        if self.poll_interval is not None:
+            self._poll_deadline = _clock() + self.poll_interval
+        else:
+            self._poll_deadline = None
+        self.remove(task)
+        try:
+            self.schedule()
+        finally:
+            if self._poll_task is task:
+                self._poll_task = None
+                self.append(task)
+
+    def _poll_due(self):
+        # the batch is done, queue the event loop tasklet again
+        task, self._poll_task = self._poll_task, None
+        self.append(task)
+
+    def sleep(self, seconds):
+        """ wait at most `seconds` seconds without keeping the CPU busy.
+
+        Other runnable tasklets are run in the meantime. If the event
+        loop is running, the current tasklet is blocked until the delay
+        expires while the loop polls for I/O. Otherwise, when there is
+        nothing else to run, the thread is parked. The call can return
+        early, the caller must check its own wait condition. """
+        if self.poller is not None:
+            return self.poller.sleep(seconds)
+
+        curr = self.getcurrent()
+        if self._inbox:
+            self.drain()
+        if len(self.runnable) > (curr in self.runnable):
+            self.schedule()
+        else:
+            self.park(seconds)
+            # run what the thread waking us up handed to the scheduler
+            self.drain()
+
+    def spawn(self, func, *args, **kwargs):
+        """ set up a tasklet running ``func(*args, **kwargs)``.
+
+        Unlike ``tasklet(func)(*args)``, the tasklet object and its
+        greenlet are taken from a free list when possible and put back
+        there when the function returns, so a reference to the tasklet
+        must not be kept after it ended. If the function raises an
+        error, the tasklet isn't reused. """
+        task = None
+        while self.free:
+            task = self.free.pop()
+            if not task._greenlet.dead:
+                break
+            # killed while waiting in the free list
+            task = None
 
-    def wakeup(self, handle):
-        self.schedule()
+        if task is None:
+            task = tasklet()
+            task.sched = self
+            task._work = (func, args, kwargs)
+            coroutine.bind(task, task._run_recyclable)
+        else:
+            task.label = ''
+            task.priority = PRIORITY_NORMAL
+            task.group = getattr(_coroutine_getcurrent(), 'group', None)
+            task.switches = 0
+            task.run_time = 0.0
+            task._work = (func, args, kwargs)
+
+        task.alive = True
+        task._join_scope()
+        if _spawn_callback is not None:
+            _spawn_callback(task)
+        self.append(task)
+        return task
+
+    def spawn_many(self, func, iterable, limit=None):
+        """ spawn a tasklet running ``func(*args)`` for each tuple of
+        arguments in `iterable` and return the list of the tasklets.
+
+        The tasklets are created then queued at once. With `limit`, they
+        are instead created lazily: no more than `limit` of them run at a
+        time, the next one being spawned when one ends. The list returned
+        then holds the tasklets spawned so far and grows as the next ones
+        are spawned. """
+        if limit is None:
+            tasks = []
+            for args in iterable:
+                task = tasklet(func)
+                task._setup(self, args, {})
+                tasks.append(task)
+            self.extend(tasks)
+            return tasks
+
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+
+        tasks = []
+        it = iter(iterable)
+        def _start(args):
+            task = tasklet(_run)
+            task._setup(self, args, {})
+            tasks.append(task)
+            self.append(task)
+
+        def _run(*args):
+            try:
+                func(*args)
+            finally:
+                args = next(it, None)
+                if args is not None:
+                    _start(args)
+
+        for args in it:
+            _start(args)
+            limit -= 1
+            if not limit:
+                break
+        return tasks
+
+    def _recycle(self, task):
+        # put a finished tasklet in the free list. Return False if it
+        # can't be reused.
+        if len(self.free) >= self.max_free or task.thread_id != self.thread_id:
+            return False
+        if not self.runnable and not self._run_calls:
+            # nothing to switch to, the greenlet must end so its parent
+            # resumes
+            return False
+        task._generation += 1
+        self.free.append(task)
+        return True
 
     def set_callback(self, cb):
         self._callback = cb
 
+    # the run queue is only changed from the scheduler thread. Other
+    # threads go through unblock(), taskwakeup() or call_soon_threadsafe()
+    # which hand the change to the scheduler thread.
+
     def append(self, value, normal=True):
+        runnable = self.runnable
         if normal:
-            self.runnable.append(value)
+            runnable.append(value)
         else:
-            self.runnable.rotate(-1)
-            self.runnable.appendleft(value)
-            self.runnable.rotate(1)
+            runnable.appendnext(value)
+        if runnable._len > self.runnable_max:
+            self.runnable_max = runnable._len
+
+    def extend(self, tasks):
+        """ queue a list of tasks """
+        runnable = self.runnable
+        for task in tasks:
+            runnable.append(task)
+        if runnable._len > self.runnable_max:
+            self.runnable_max = runnable._len
 
     def appendleft(self, task):
         self.runnable.appendleft(task)
 
     def remove(self, task):
         """ remove a task from the runnable """
-
-        # the scheduler need to be locked here
-        with self._lock:
-            try:
-                self.runnable.remove(task)
-                # if the task is blocked increment their number
-                if task.blocked:
-                    self.blocked += 1
-            except ValueError:
-                pass
+        try:
+            self.runnable.remove(task)
+            # if the task is blocked increment their number
+            if task.blocked:
+                self.blocked += 1
+        except ValueError:
+            pass
 
     def unblock(self, task, normal=True):
-        """ unblock a task (put back from sleep)"""
-        with self._lock:
-            task.blocked = 0
-            self.blocked -= 1
+        """ unblock a task (put back from sleep). It can be called from
+        any thread. """
+        if _thread_id() != self.thread_id:
+            self.call_soon_threadsafe(self._unblock_blocked, task, normal)
+            return
+
+        task.blocked = 0
+        self.blocked -= 1
         self.append(task, normal)
 
+    def _unblock_blocked(self, task, normal):
+        # the task may have been unblocked since the call was queued
+        if task.blocked:
+            self.unblock(task, normal)
+
+    def handoff(self, curr, task):
+        """ unblock `task` and switch to it right away. `curr` is the
+        current tasklet, it must be in the run queue: it runs after `task`
+        unless a tasklet with a higher priority is runnable. """
+        task.blocked = 0
+        self.blocked -= 1
+        self.runnable.appendleft(task)
+        self.switch(curr, task)
+        if curr._cancelled:
+            curr._cancelled = False
+            raise TaskletExit
+
     def taskwakeup(self, task):
         if task is None:
             return
 
-        # the scheduler need to be locked here
-        with self._lock:
-            try:
-                self.runnable.remove(task)
-            except ValueError:
-                pass
+        if not task.blocked:
+            # the task is not waiting but may have parked the thread
+            self.wakeup()
+            return
+
+        if _thread_id() != self.thread_id:
+            self.call_soon_threadsafe(self.taskwakeup, task)
+            return
+
+        try:
+            self.runnable.remove(task)
+        except ValueError:
+            pass
 
         # eventually unblock the tasj
         self.unblock(task)
 
     def switch(self, current, next):
         prev = self._last_task
-        if (self._callback is not None and prev is not next):
-            self._callback(prev, next)
+
+        # charge the time spent since the last switch to the group of the
+        # task that was running
+        now = _clock()
+        elapsed = now - self._switch_time
+        self._switch_time = now
+        self.busy_time += elapsed
+        prev.run_time += elapsed
+        group = prev.group or default_group
+        group.usage += elapsed
+        group.vtime += elapsed / group.shares
+
+        if prev is not next:
+            self.switches += 1
+            next.switches += 1
+            (next.group or default_group).switches += 1
+            if self._callback is not None:
+                self._callback(prev, next)
         self._last_task = next
 
 
         assert not next.blocked
 
         if next is not current:
-            next.switch()
+            if next._cancelled:
+                next._cancelled = False
+                next.throw(TaskletExit)
+            else:
+                next.switch()
 
         return current
 
@@ -308,14 +875,31 @@ class Scheduler(object):
             retval = curr
 
         while True:
-            if self.runnable:
-                if self.runnable[0] is curr:
-                    self.runnable.rotate(-1)
-                task = self.runnable[0]
-            elif self._run_calls:
-                task = self._run_calls.pop()
-            else:
-                raise RuntimeError("no more tasks are sleeping")
+            if self._inbox:
+                self.drain()
+
+            if self._poll_task is not None and (
+                    self.switches >= self._poll_switches or
+                    (self._poll_deadline is not None and
+                        _clock() >= self._poll_deadline)):
+                self._poll_due()
+
+            task = self.runnable.pick(curr)
+
+            if task is None:
+                if self._poll_task is not None:
+                    # the others are blocked, poll for I/O now
+                    self._poll_due()
+                    continue
+                elif self._run_calls:
+                    task = self._run_calls.pop()
+                elif curr.blocked and self._wakeup_possible():
+                    # every tasklet is blocked, park the thread until
+                    # another thread wakes one up
+                    self.park()
+                    continue
+                else:
+                    raise RuntimeError("no more tasks are sleeping")
 
 
             # switch to next task
@@ -323,19 +907,45 @@ class Scheduler(object):
 
             # exit the loop if there are no more tasks
             if curr is self._last_task:
+                if curr._cancelled:
+                    # cancelled while this scheduler loop was running
+                    curr._cancelled = False
+                    raise TaskletExit
                 return retval
 
-    def run(self):
+    def run(self, wait=False):
+        """ run the tasklets until none can run and no call run in a
+        thread for them is pending. With `wait` the thread also waits for
+        the blocked tasklets to be woken up by other threads. """
         curr = self.getcurrent()
-        self._run_calls.append(curr)
         self.remove(curr)
         try:
             while True:
+                self._run_calls.append(curr)
                 self.schedule()
-                if not curr.blocked:
+                if (not curr.blocked and not self.pending and
+                        not (wait and self.blocked > self.background)):
                     break
-                time.sleep(0.0001)
+                # nothing can run, wait for another thread to wake us up
+                self.park()
+        finally:
+            # schedule() may return before our run call has been used
+            while curr in self._run_calls:
+                self._run_calls.remove(curr)
+            self.append(curr)
+
+    def run_once(self):
+        """ run the tasklets until none can run, without waiting for the
+        blocked ones. Used to run the scheduler from the callbacks of
+        another event loop. """
+        curr = self.getcurrent()
+        self.remove(curr)
+        self._run_calls.append(curr)
+        try:
+            self.schedule()
         finally:
+            while curr in self._run_calls:
+                self._run_calls.remove(curr)
             self.append(curr)
 
     def runcount(self):
@@ -352,11 +962,7 @@ class Scheduler(object):
             return curr
 
     def __contains__(self, value):
-        try:
-            operator.indexOf(self.runnable, value)
-            return True
-        except ValueError:
-            return False
+        return value in self.runnable
 
 _channel_callback = None
 
@@ -364,6 +970,36 @@ def set_channel_callback(channel_cb):
     global _channel_callback
     _channel_callback = channel_cb
 
+_spawn_callback = None
+
+def set_spawn_callback(spawn_cb):
+    """ set a function called with each tasklet set up to run """
+    global _spawn_callback
+    _spawn_callback = spawn_cb
+
+# the threads started by flower for itself, see helper_thread()
+_helper_threads = weakref.WeakKeyDictionary()
+
+def helper_thread(target, name, args=()):
+    """ return a daemon thread running ``target(*args)``. Unlike the
+    other threads, it isn't expected to wake up the blocked tasklets:
+    the calls it runs for a tasklet are counted in Scheduler.pending. """
+    th = threading.Thread(target=target, name=name, args=args)
+    th.daemon = True
+    add_helper_thread(th)
+    return th
+
+def add_helper_thread(th):
+    """ mark `th` as a helper thread, see helper_thread() """
+    _helper_threads[th] = True
+
+# thread id -> scheduler of the thread
+_schedulers = weakref.WeakValueDictionary()
+
+def get_schedulers():
+    """ return the schedulers of all the threads """
+    return list(_schedulers.values())
+
 
 def get_scheduler():
     global _tls
@@ -371,6 +1007,7 @@ def get_scheduler():
         return _tls.scheduler
     except AttributeError:
         scheduler = _tls.scheduler = Scheduler()
+        _schedulers[scheduler.thread_id] = scheduler
         return scheduler
 
 
@@ -382,12 +1019,29 @@ def getruncount():
     sched = get_scheduler()
     return sched.runcount()
 
+def spawn(func, *args, **kwargs):
+    """ spawn a tasklet, reusing a finished one if possible. See
+    Scheduler.spawn """
+    return get_scheduler().spawn(func, *args, **kwargs)
+
+def spawn_many(func, iterable, limit=None):
+    """ spawn a tasklet for each tuple of arguments. See
+    Scheduler.spawn_many """
+    return get_scheduler().spawn_many(func, iterable, limit)
+
+def get_stats():
+    """ return the statistics of the scheduler of the current thread """
+    return get_scheduler().get_stats()
+
 def getcurrent():
     return get_scheduler().getcurrent()
 
 def getmain():
     return get_scheduler().getmain()
 
+def set_poll_cadence(batch=1, interval=None):
+    get_scheduler().set_poll_cadence(batch, interval)
+
 def set_schedule_callback(scheduler_cb):
     sched = get_scheduler()
     sched.set_callback(scheduler_cb)
@@ -409,9 +1063,9 @@ def schedrem(task):
     scheduler = get_scheduler()
     scheduler.remove(task)
 
-def run():
+def run(wait=False):
     sched = get_scheduler()
-    sched.run()
+    sched.run(wait)
 
 # bootstrap the scheduler
 def _bootstrap():
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+from .sched import getcurrent, get_scheduler, TaskletExit, _thread_id
+from .timer import Timer
+
+
+class cancel_scope(object):
+    """ cancel together the tasklets working on the same request.
+
+    The tasklets set up inside the scope, and the ones they set up in
+    turn, belong to it. When the scope is cancelled, by calling cancel(),
+    because its `timeout` expired or because the scope it's nested in has
+    been cancelled, TaskletExit is raised in all of them where they are
+    blocked (channel.receive, sleep, ...) and in the body of the ``with``
+    statement. The scope catches its own cancellation::
+
+        with cancel_scope(timeout=5.0) as scope:
+            tasklet(fetch)(url, results)
+            data = results.receive()
+
+        if scope.cancelled_caught:
+            ...
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.owner = None
+        self.parent = None
+        self.tasks = set() # tasklets in the scope
+        self.scopes = set() # nested scopes
+        self.cancel_called = False
+        self.cancelled_caught = False
+        self.thread_id = None
+        self._timer = None
+        self._active = False
+
+    def __enter__(self):
+        self.owner = getcurrent()
+        self.thread_id = _thread_id()
+        self.parent = self.owner._scope
+        if self.parent is not None:
+            self.parent.scopes.add(self)
+        self.owner._scope = self
+        self._active = True
+
+        if self.parent is not None and self.parent.cancel_called:
+            self.cancel_called = True
+        elif self.timeout is not None:
+            self._timer = Timer(self._expired, self.timeout)
+            self._timer.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self._active = False
+        if self._timer is not None:
+            self._timer.stop()
+            self._timer = None
+        self.owner._scope = self.parent
+        if self.parent is not None:
+            self.parent.scopes.discard(self)
+
+        if (exc_type is not None and issubclass(exc_type, TaskletExit)
+                and self.cancel_called and not self._parent_cancelled()):
+            # our own cancellation
+            self.owner._cancelled = False
+            self.cancelled_caught = True
+            return True
+        return False
+
+    def _parent_cancelled(self):
+        parent = self.parent
+        while parent is not None:
+            if parent.cancel_called:
+                return True
+            parent = parent.parent
+        return False
+
+    def _add(self, task):
+        task._scope = self
+        self.tasks.add(task)
+
+    def _discard(self, task):
+        self.tasks.discard(task)
+
+    def _expired(self, now, t):
+        self.cancel()
+
+    def cancel(self):
+        """ cancel the tasklets of the scope and the body of the ``with``
+        statement. It can be called from any thread. """
+        sched = self.owner.sched if self.owner is not None else None
+        if self.thread_id is not None and _thread_id() != self.thread_id:
+            sched.call_soon_threadsafe(self.cancel)
+            return
+
+        owners = []
+        self._cancel(owners)
+        _cancel_owners(owners)
+
+    def _cancel(self, owners):
+        # cancel the tasklets of the scope and of the nested scopes. The
+        # tasklets running the bodies are collected in `owners`.
+        self.cancel_called = True
+        for scope in list(self.scopes):
+            scope._cancel(owners)
+        _cancel_tasks(self.tasks, owners)
+        if self._active and self.owner not in owners:
+            owners.append(self.owner)
+
+
+def _cancel_tasks(tasks, owners):
+    # the current tasklet is one of the scope tasklets when it cancels its
+    # own scope, it's left in `owners` to be cancelled last
+    curr = getcurrent()
+    for task in list(tasks):
+        if task is not curr:
+            task.cancel()
+        elif curr not in owners:
+            owners.append(curr)
+
+
+def _cancel_owners(owners):
+    # the current tasklet is cancelled last, TaskletExit is raised at once
+    curr = getcurrent()
+    for owner in owners:
+        if owner is not curr:
+            owner.cancel()
+    if curr in owners:
+        curr.cancel()
+
+
+class task_group(cancel_scope):
+    """ a cancel scope waiting for its tasklets when the ``with``
+    statement ends. If the body raises an error, the tasklets are
+    cancelled first::
+
+        with task_group(timeout=1.0):
+            for url in urls:
+                tasklet(fetch)(url)
+        # all the fetches are done or cancelled
+    """
+
+    def __init__(self, timeout=None):
+        super(task_group, self).__init__(timeout)
+        self._waiter = None
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if exc_type is not None and not issubclass(exc_type, TaskletExit):
+            self.cancel_children()
+
+        while self.tasks:
+            try:
+                self._wait()
+            except TaskletExit:
+                if not self.cancel_called or self._parent_cancelled():
+                    # cancelled from outside, stop waiting
+                    self.cancel_children()
+                    super(task_group, self).__exit__(TaskletExit, None, None)
+                    raise
+                exc_type = exc_type or TaskletExit
+
+        return super(task_group, self).__exit__(exc_type, exc_value, tb)
+
+    def cancel_children(self):
+        """ cancel the tasklets of the group but not its body """
+        owners = []
+        for scope in list(self.scopes):
+            scope._cancel(owners)
+        _cancel_tasks(self.tasks, owners)
+        _cancel_owners(owners)
+
+    def _wait(self):
+        sched = get_scheduler()
+        curr = getcurrent()
+        self._waiter = curr
+        curr.blocked = True
+        sched.remove(curr)
+        try:
+            sched.schedule()
+        finally:
+            self._waiter = None
+
+    def _discard(self, task):
+        self.tasks.discard(task)
+        waiter = self._waiter
+        if not self.tasks and waiter is not None and waiter.blocked:
+            waiter.sched.unblock(waiter)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+import random
+import threading
+
+from .sched import get_scheduler
+from .channel import bomb, ChannelWaiter, _channel_lock
+from .timer import Timer
+
+# a select is done by the first of its cases claiming it
+_select_lock = threading.Lock()
+
+_NODEFAULT = object()
+
+class _SelectWaiter(ChannelWaiter):
+    """ waiter queued in the channel of a case """
+
+    __slots__ = ['selection', 'index']
+
+    def __init__(self, task, arg, selection, index):
+        super(_SelectWaiter, self).__init__(task, arg)
+        self.selection = selection
+        self.index = index
+
+
+class _Selection(object):
+    """ the waiters of a blocked select. It replaces the waiter of the
+    tasklet while it's blocked so cancelling it withdraws all of them. """
+
+    __slots__ = ['waiters', 'done', 'index']
+
+    def __init__(self):
+        self.waiters = []
+        self.done = False
+        self.index = None # index of the case done, None on timeout
+
+    def claim(self, waiter):
+        """ mark the select done by the case of `waiter`, None if it timed
+        out. Returns False if it's already done. """
+        with _select_lock:
+            if self.done:
+                return False
+            self.done = True
+            if waiter is not None:
+                self.index = waiter.index
+            return True
+
+    def release(self):
+        self.claim(None)
+        for waiter in self.waiters:
+            waiter.release()
+
+
+def _parse(cases):
+    ops = []
+    for case in cases:
+        if len(case) == 2 and case[1] == 'recv':
+            ops.append((case[0], -1, None))
+        elif len(case) == 3 and case[1] == 'send':
+            ops.append((case[0], 1, case[2]))
+        else:
+            raise ValueError("invalid select case: %r" % (case,))
+    return ops
+
+
+def select(cases, timeout=None, default=_NODEFAULT):
+    """ wait until one of the channel operations in `cases` can proceed
+    and do it, like the select statement of Go. A case is
+    ``(channel, 'recv')`` or ``(channel, 'send', value)``.
+
+    It returns a tuple (index of the case done, value received or None
+    for a send). When several cases are ready one is chosen at random.
+    With `default`, it doesn't block and returns (None, default) if no
+    case is ready. After `timeout` seconds without a ready case it
+    returns (None, None).
+    """
+    ops = _parse(cases)
+    if timeout is not None and timeout <= 0 and default is _NODEFAULT:
+        default = None
+    sched = get_scheduler()
+    curr = sched.getcurrent()
+
+    # the locks are always taken in the same order
+    locks = sorted(set(_channel_lock(ch) for ch, d, arg in ops), key=id)
+    for lock in locks:
+        lock.acquire()
+
+    try:
+        order = list(range(len(ops)))
+        random.shuffle(order)
+        for i in order:
+            ch, d, arg = ops[i]
+            done, value, target = ch._try_locked(d, arg)
+            if done:
+                break
+        else:
+            i = None
+            if default is _NODEFAULT:
+                # nothing is ready, wait on all the channels
+                selection = _Selection()
+                for index, (ch, d, arg) in enumerate(ops):
+                    waiter = _SelectWaiter(curr, arg, selection, index)
+                    waiter.channel = ch
+                    ch.enqueue(d if d > 0 else 0, waiter)
+                    selection.waiters.append(waiter)
+                curr.blocked = 1
+    finally:
+        for lock in locks:
+            lock.release()
+
+    if i is not None:
+        if target is not None:
+            target.task.sched.unblock(target.task)
+    elif default is not _NODEFAULT:
+        return None, default
+    else:
+        value = _wait(sched, curr, selection, timeout)
+        i = selection.index
+
+    if isinstance(value, bomb):
+        value.raise_()
+    return i, value
+
+
+def _wait(sched, curr, selection, timeout):
+    # block until a case claims the selection or the timeout expires and
+    # return the value received.
+    def expired(now, t):
+        if selection.claim(None):
+            curr.sched.unblock(curr)
+
+    timer = None
+    if timeout is not None:
+        timer = Timer(expired, timeout)
+        timer.start()
+
+    saved, curr._waiter = curr._waiter, selection
+    sched.remove(curr)
+    try:
+        sched.schedule()
+    finally:
+        curr._waiter = saved
+        if timer is not None:
+            timer.stop()
+        # withdraw from the channels of the other cases
+        for waiter in selection.waiters:
+            waiter.release()
+
+    if selection.index is None:
+        return None
+    waiter = selection.waiters[selection.index]
+    value, waiter.arg = waiter.arg, None
+    return value
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+from collections import deque
+import sys
+import threading
+
+import six
+
+from .sched import getcurrent, get_scheduler, helper_thread
+
+# same default as the libuv thread pool
+DEFAULT_SIZE = 4
+
+
+class CancelledError(Exception):
+    """ the call has been cancelled before it started """
+
+
+class WorkItem(object):
+    """ a call run in a thread of the pool. The tasklet waiting for it is
+    resumed by its own scheduler once the call returned. """
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.done = False
+        self.cancelled = False
+        self.running = False
+        self._result = None
+        self._exc_info = None
+        self._waiter = None # (scheduler, tasklet) waiting for the result
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """ cancel the call if it hasn't started yet. It returns True if
+        the call has been cancelled. """
+        with self._lock:
+            if self.running or self.done:
+                return self.cancelled
+            self.cancelled = True
+        self._finish(exc_info=(CancelledError, CancelledError(), None))
+        return True
+
+    def _run(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.running = True
+
+        try:
+            result = self.func(*self.args, **self.kwargs)
+        except Exception:
+            self._finish(exc_info=sys.exc_info())
+        else:
+            self._finish(result)
+
+    def _finish(self, result=None, exc_info=None):
+        """ set the outcome of the call and wake up the waiting tasklet.
+        It can be called from any thread. """
+        with self._lock:
+            if self.done:
+                return
+            self._result = result
+            self._exc_info = exc_info
+            self.done = True
+            self.running = False
+            waiter, self._waiter = self._waiter, None
+
+        if waiter is not None:
+            sched, task = waiter
+            sched.unblock(task)
+
+    def _result_or_raise(self):
+        if self._exc_info is not None:
+            six.reraise(*self._exc_info)
+        return self._result
+
+    def wait(self):
+        """ block the current tasklet until the call is done and return its
+        result or raise its exception. If the tasklet is killed while it
+        waits, the call is cancelled. """
+        sched = get_scheduler()
+        curr = getcurrent()
+
+        with self._lock:
+            if self.done:
+                return self._result_or_raise()
+            self._waiter = (sched, curr)
+            curr.blocked = True
+
+        sched.remove(curr)
+        sched.pending += 1
+        try:
+            sched.schedule()
+        except:
+            with self._lock:
+                self._waiter = None
+            if curr.blocked:
+                curr.blocked = False
+                sched.blocked -= 1
+            self.cancel()
+            raise
+        finally:
+            sched.pending -= 1
+
+        return self._result_or_raise()
+
+
+class ThreadPool(object):
+    """ a pool of threads running the blocking calls of the tasklets.
+
+    Threads are started when needed, up to `size` ones::
+
+        pool = ThreadPool(8)
+        addr = pool.run(socket.gethostbyname, "example.com")
+    """
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size = size
+        self.threads = []
+        self.idle = 0
+        self.queue = deque()
+        self._cond = threading.Condition()
+
+    def resize(self, size):
+        """ change the number of threads. The threads in excess stop once
+        their current call is done. """
+        with self._cond:
+            self.size = size
+            self._cond.notify_all()
+
+    def submit(self, func, *args, **kwargs):
+        """ queue a call and return its WorkItem without waiting """
+        item = WorkItem(func, args, kwargs)
+        with self._cond:
+            self.queue.append(item)
+            if not self.idle and len(self.threads) < self.size:
+                self._start_thread()
+            else:
+                self._cond.notify()
+        return item
+
+    def run(self, func, *args, **kwargs):
+        """ run `func(*args, **kwargs)` in a thread of the pool and wait
+        for its result """
+        return self.submit(func, *args, **kwargs).wait()
+
+    def _start_thread(self):
+        th = helper_thread(self._worker,
+                "flower-thread-%s" % len(self.threads))
+        self.threads.append(th)
+        th.start()
+
+    def _worker(self):
+        me = threading.current_thread()
+        while True:
+            with self._cond:
+                while not self.queue:
+                    if len(self.threads) > self.size:
+                        self.threads.remove(me)
+                        return
+                    self.idle += 1
+                    self._cond.wait()
+                    self.idle -= 1
+
+                if len(self.threads) > self.size:
+                    self.threads.remove(me)
+                    self._cond.notify()
+                    return
+                item = self.queue.popleft()
+            item._run()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_thread_pool():
+    """ return the thread pool used by run_in_thread """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPool()
+    return _pool
+
+def set_thread_pool_size(size):
+    get_thread_pool().resize(size)
+
+def run_in_thread(func, *args, **kwargs):
+    """ run a blocking function in a thread of the pool. The current
+    tasklet waits for the result while the others keep running. """
+    return get_thread_pool().run(func, *args, **kwargs)
@@ -3,31 +3,33 @@
 # This file is part of flower. See the NOTICE for more information.
 
 import heapq
-import operator
 import threading
 
 import six
 
-from .util import nanotime
+from .util import nanotime, from_nanotime
 from .sched import (tasklet, schedule, schedule_remove, get_scheduler,
         getcurrent, taskwakeup, getmain)
 from .channel import channel
 
 class Timers(object):
-
-    __slots__ = ['__dict__', '_lock', 'sleeping']
-
-    __shared_state__ = dict(
-            _timers = {},
-            _heap = [],
-            _timerproc = None
-    )
+    """ the timers started in a thread. They are fired by a tasklet of the
+    scheduler of the thread, so they don't depend on another thread
+    scheduling its tasklets. """
 
     def __init__(self):
-        self.__dict__ = self.__shared_state__
         self._lock = threading.RLock()
+        # entries [when, seq, timer], timer is None once stopped
+        self._heap = []
+        self._seq = 0
+        self._stopped = 0 # number of stopped entries in the heap
+        self._timerproc = None
         self.sleeping = False
 
+    @property
+    def task(self):
+        """ the tasklet firing the timers """
+        return self._timerproc
 
     def add(self, t):
         with self._lock:
@@ -35,63 +37,109 @@ class Timers(object):
 
             if self.sleeping:
                 self.sleeping = False
-                taskwakeup(self._timerproc)
+                self._timerproc.sched.taskwakeup(self._timerproc)
 
             if self._timerproc is None or not self._timerproc.alive:
                 self._timerproc = tasklet(self.timerproc)()
+                # shared by all the tasklets, it can't be cancelled with
+                # the scope it was started in
+                self._timerproc._leave_scope()
 
     def _add_timer(self, t):
         if not t.interval:
             return
-        heapq.heappush(self._heap, t)
-
+        if t._entry is not None:
+            # started again, the previous deadline is dropped
+            t._entry[2] = None
+            self._stopped += 1
+        self._seq += 1
+        t._entry = [t.when, self._seq, t]
+        heapq.heappush(self._heap, t._entry)
 
     def remove(self, t):
+        """ stop a timer. It is left in the heap and dropped when it
+        reaches the top, so stopping many timers stays cheap. """
         with self._lock:
-            try:
-                del self._heap[operator.indexOf(self._heap, t)]
-            except (KeyError, IndexError):
-                pass
+            entry, t._entry = t._entry, None
+            if entry is None:
+                # already fired or stopped
+                return
+            entry[2] = None
+            self._stopped += 1
+            if self._stopped > 64 and self._stopped * 2 > len(self._heap):
+                # mostly stopped timers, don't let them pile up
+                self._heap = [e for e in self._heap if e[2] is not None]
+                heapq.heapify(self._heap)
+                self._stopped = 0
 
     def timerproc(self):
         while True:
             self._lock.acquire()
 
             while True:
-                if not len(self._heap):
+                heap = self._heap
+                if not len(heap):
                     delta = -1
                     break
 
-                t = heapq.heappop(self._heap)
+                entry = heap[0]
+                t = entry[2]
+                if t is None:
+                    heapq.heappop(heap)
+                    self._stopped -= 1
+                    continue
+
                 now = nanotime()
                 delta = t.when - now
                 if delta > 0:
-                    heapq.heappush(self._heap, t)
                     break
-                else:
-                    # repeat ? reinsert the timer
-                    if t.period is not None and t.period > 0:
-                        np = nanotime(t.period)
-                        t.when += np * (1 - delta/np)
-                        heapq.heappush(self._heap, t)
 
-                    # run
-                    self._lock.release()
-                    t.callback(now, t, *t.args, **t.kwargs)
-                    self._lock.acquire()
+                heapq.heappop(heap)
+                t._entry = None
+                # repeat ? reinsert the timer
+                if t.period is not None and t.period > 0:
+                    np = nanotime(t.period)
+                    t.when += np * (1 - delta/np)
+                    self._add_timer(t)
+
+                # run
+                self._lock.release()
+                t.callback(now, t, *t.args, **t.kwargs)
+                self._lock.acquire()
 
 
+            self.sleeping = True
+            self._lock.release()
             if delta < 0:
-                self.sleeping = True
-                self._lock.release()
-                schedule_remove()
+                # no more timers, block until a new one is added. Only
+                # this thread can add one, run(wait=True) doesn't wait
+                # for it.
+                sched = get_scheduler()
+                getcurrent().blocked = True
+                sched.background += 1
+                try:
+                    schedule_remove()
+                finally:
+                    sched.background -= 1
             else:
-                self._lock.release()
-                schedule()
+                # wait for the next timer without spinning
+                get_scheduler().sleep(from_nanotime(delta))
+            self.sleeping = False
+
+def get_timers():
+    """ return the timers of the current thread """
+    sched = get_scheduler()
+    if sched.timers is None:
+        sched.timers = Timers()
+    return sched.timers
+
+def add_timer(t):
+    t.timers = get_timers()
+    t.timers.add(t)
 
-timers = Timers()
-add_timer = timers.add
-remove_timer = timers.remove
+def remove_timer(t):
+    if t.timers is not None:
+        t.timers.remove(t)
 
 
 class Timer(object):
@@ -108,9 +156,10 @@ class Timer(object):
         self.kwargs = kwargs or {}
         self.when = 0
         self.active = False
+        self.timers = None # the timers of the thread it was started in
+        self._entry = None # its entry in the heap of the timers
 
     def start(self):
-        global timers
         self.active = True
         self.when = nanotime() + nanotime(self.interval)
         add_timer(self)
@@ -137,4 +186,9 @@ def sleep(seconds=0):
 
     t = Timer(ready, seconds)
     t.start()
-    c.receive()
+    try:
+        c.receive()
+    except:
+        # cancelled, the timer must not fire
+        t.stop()
+        raise
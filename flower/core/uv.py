@@ -10,7 +10,8 @@ _tls = threading.local()
 import pyuv
 
 from flower.core.channel import channel
-from flower.core.sched import tasklet, getcurrent, schedule
+from flower.core.sched import (tasklet, getcurrent, get_scheduler, schedule,
+        PRIORITY_HIGH, default_group)
 
 def get_fd(io):
     if not isinstance(io, int):
@@ -47,36 +48,105 @@ class UV(object):
         self.fds = {}
         self._lock = threading.RLock()
         self.running = False
+        self.sched = get_scheduler()
+        self._blocking = False
 
-        # start the server task
-        self._runtask = tasklet(self.run, "uv_server")()
+        # start the server task. It runs first so I/O events are
+        # dispatched before the other tasks get the CPU. Its run time isn't
+        # charged to the group of the tasklet that started the loop.
+        self._runtask = tasklet(self.run, "uv_server",
+                priority=PRIORITY_HIGH, group=default_group)()
+        self._runtask._leave_scope()
+
+    @property
+    def task(self):
+        """ the tasklet running the loop """
+        return self._runtask
 
     def _wakeloop(self, handle):
+        # another thread woke up the loop, run what it handed to the
+        # scheduler
         self.loop.update_time()
+        self.sched.drain()
 
     def wakeup(self):
         self._async.send()
 
     def switch(self):
         if not self.running:
-            self._runtask = tasklet(self.run)()
+            self._runtask = tasklet(self.run, "uv_server",
+                    priority=PRIORITY_HIGH, group=default_group)()
+            self._runtask._leave_scope()
 
         getcurrent().remove()
         self._runtask.switch()
 
-    def idle(self, handle):
-        if getcurrent() is self._runtask:
+    def has_work(self):
+        """ return True if some other tasklets are waiting to run """
+        runnable = self.sched.runnable
+        return len(runnable) > (self._runtask in runnable)
+
+    def _prepare(self, handle):
+        # the loop is about to poll for I/O. Don't block if tasklets are
+        # waiting to run, otherwise sleep until an event, a timer or a
+        # wakeup arrives.
+        if self.has_work():
+            self._idle.start(self._idle_cb)
+            self._blocking = False
+        else:
+            self._idle.stop()
+            self._blocking = True
+            self.sched.begin_idle()
+
+    def _check(self, handle):
+        if self._blocking:
+            # the time spent waiting for events isn't run time
+            self.sched.end_idle()
+
+        # I/O has been polled, let a batch of the other tasklets run
+        if getcurrent() is self._runtask and self.has_work():
+            self.sched.run_batch(self._runtask)
+
+    def _idle_cb(self, handle):
+        pass
+
+    def sleep(self, seconds):
+        """ block the current tasklet for `seconds` while the loop keeps
+        polling. Used by the scheduler to wait for its next timer. """
+        curr = getcurrent()
+        def _wake(handle):
+            if curr.blocked:
+                self.sched.unblock(curr)
+
+        t = pyuv.Timer(self.loop)
+        t.start(_wake, seconds, 0)
+        curr.blocked = True
+        self.sched.remove(curr)
+        try:
             schedule()
+        finally:
+            t.stop()
 
     def run(self):
-        t = pyuv.Timer(self.loop)
-        t.start(self.idle, 0.0001, 0.0001)
-        t.unref()
+        self._prepare_h = pyuv.Prepare(self.loop)
+        self._prepare_h.start(self._prepare)
+        self._prepare_h.unref()
+        self._check_h = pyuv.Check(self.loop)
+        self._check_h.start(self._check)
+        self._check_h.unref()
+        self._idle = pyuv.Idle(self.loop)
+        self._idle.unref()
+
         self.running = True
+        self.sched.poller = self
         try:
             self.loop.run()
         finally:
+            self.sched.poller = None
             self.running = False
+            self._prepare_h.stop()
+            self._check_h.stop()
+            self._idle.stop()
 
 def uv_server():
     global _tls
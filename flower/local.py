@@ -15,27 +15,34 @@ class local(object):
     def __init__(self):
         self._d = weakref.WeakKeyDictionary()
 
-    def __getattr__(self, key):
+    def _attrs(self, create=False):
         d = self._d
         curr = getcurrent()
-        if not curr in d or not hasattr(d[curr], key):
+        attrs = d.get(curr)
+        if attrs is not None and attrs._generation != curr._generation:
+            # the tasklet has been recycled, the attributes were set by
+            # the function it ran before
+            attrs = None
+        if attrs is None and create:
+            attrs = d[curr] = self._local_attr()
+            attrs._generation = curr._generation
+        return attrs
+
+    def __getattr__(self, key):
+        attrs = self._attrs()
+        if attrs is None or not hasattr(attrs, key):
             raise AttributeError(key)
-        return getattr(d[curr], key)
+        return getattr(attrs, key)
 
     def __setattr__(self, key, value):
         if key == '_d':
             self.__dict__[key] = value
             object.__setattr__(self, key, value)
         else:
-            d = self._d
-            curr = getcurrent()
-            if not curr in d:
-                d[curr] = self._local_attr()
-            setattr(d[curr], key, value)
+            setattr(self._attrs(True), key, value)
 
     def __delattr__(self, key):
-        d = self._d
-        curr = getcurrent()
-        if not curr in d or not hasattr(d[curr], key):
+        attrs = self._attrs()
+        if attrs is None or not hasattr(attrs, key):
             raise AttributeError(key)
-        delattr(d[curr], key)
+        delattr(attrs, key)
@@ -6,6 +6,7 @@ from flower.net.tcp import TCPListen, dial_tcp
 from flower.net.udp import UDPListen, dial_udp
 from flower.net.pipe import PipeListen, dial_pipe
 from flower.net.sock import TCPSockListen, PipeSockListen
+from flower.net.prefork import PreforkServer
 
 LISTEN_HANDLERS = dict(
         tcp = TCPListen,
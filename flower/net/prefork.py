@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+import errno
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+from flower.core import tasklet
+from flower.util import cpu_count
+from flower.net.sock import TCPSockListen
+from flower.net.util import parse_address, is_ipv6
+
+
+class PreforkServer(object):
+    """ A pre-fork server. The master process binds the listening socket
+    then forks `workers` processes (one per CPU by default). Each worker
+    runs its own scheduler and accepts the connections on the shared
+    socket, `handler` being called in a new tasklet for each of them.
+
+    With ``reuse_port=True`` each worker binds its own socket using the
+    SO_REUSEPORT option and the kernel balances the connections. The
+    master then only binds its socket, to reserve the port, and doesn't
+    listen on it.
+
+    Dead workers are restarted. A worker dying less than `min_uptime`
+    seconds after its start is restarted after a delay, doubled each
+    time, up to `max_restart_delay` seconds. SIGTERM or SIGINT stops the
+    workers then the master.
+
+    `preload` is a list of modules to import, or a callable to run, in the
+    master before forking. The objects are then frozen out of the garbage
+    collector (when supported) so the memory pages they use are shared
+    with the workers instead of being copied.
+
+    Example::
+
+        def handle_connection(conn):
+            while True:
+                data = conn.read()
+                if not data:
+                    break
+                conn.write(data)
+
+        server = PreforkServer(('127.0.0.1', 8000), handle_connection)
+        server.serve_forever()
+    """
+
+    def __init__(self, addr, handler, workers=None, reuse_port=False,
+            backlog=128, preload=None):
+        if reuse_port and not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError("SO_REUSEPORT is not supported")
+
+        self.addr = parse_address(addr)
+        self.handler = handler
+        self.num_workers = workers or cpu_count()
+        self.reuse_port = reuse_port
+        self.backlog = backlog
+        self.preload = preload
+        self.sock = None
+        self.workers = {} # pid -> worker index
+        self.min_uptime = 1.0
+        self.max_restart_delay = 10.0
+        self._started = {} # worker index -> start time
+        self._delays = {} # worker index -> last restart delay
+        self.stopping = False
+        self.is_master = True
+
+    def create_socket(self, listen=True):
+        if is_ipv6(self.addr[0]):
+            family = socket.AF_INET6
+        else:
+            family = socket.AF_INET
+
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(self.addr)
+        sock.setblocking(0)
+        if listen:
+            sock.listen(self.backlog)
+        return sock
+
+    def do_preload(self):
+        if self.preload is not None:
+            if callable(self.preload):
+                self.preload()
+            else:
+                for name in self.preload:
+                    __import__(name)
+
+        # move the objects created until now out of the collector so the
+        # workers don't write to their pages when it runs
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+    def start(self):
+        """ preload, bind and spawn the workers """
+        if not hasattr(os, 'fork'):
+            raise RuntimeError("fork is not supported on this platform")
+
+        self.do_preload()
+        # with reuse_port, a listening socket in the master would get its
+        # share of the connections and nobody would accept them
+        self.sock = self.create_socket(listen=not self.reuse_port)
+        # resolve the port if 0 was given
+        self.addr = self.sock.getsockname()[:2]
+
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+
+        for i in range(self.num_workers):
+            self.spawn_worker(i)
+
+    def spawn_worker(self, index):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = index
+            self._started[index] = time.time()
+            return pid
+
+        # in the worker
+        self.is_master = False
+        self.workers = {}
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        status = 0
+        try:
+            self.run_worker(index)
+        except:
+            sys.excepthook(*sys.exc_info())
+            status = 1
+        finally:
+            os._exit(status)
+
+    def run_worker(self, index):
+        """ accept loop run by each worker """
+        if self.reuse_port:
+            sock = self.create_socket()
+            self.sock.close()
+        else:
+            sock = self.sock
+
+        listener = TCPSockListen(self.addr, sock=sock,
+                backlog=self.backlog)
+        try:
+            while True:
+                conn, err = listener.accept()
+                tasklet(self.handler)(conn)
+        finally:
+            listener.close()
+
+    def stop(self):
+        """ stop the workers """
+        self.stopping = True
+        self.kill_workers(signal.SIGTERM)
+
+    def _on_stop(self, signum, frame):
+        if self.is_master:
+            self.stop()
+
+    def kill_workers(self, sig):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, sig)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def wait(self):
+        """ wait for the workers, restarting those that die, until the
+        server is stopped """
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    break
+                raise
+
+            index = self.workers.pop(pid, None)
+            if index is None or self.stopping:
+                continue
+
+            # don't fork in a loop a worker crashing at its start
+            deadline = time.time() + self._restart_delay(index)
+            while not self.stopping and time.time() < deadline:
+                time.sleep(0.1)
+            if not self.stopping:
+                self.spawn_worker(index)
+
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def _restart_delay(self, index):
+        if time.time() - self._started.get(index, 0) < self.min_uptime:
+            delay = min(self._delays.get(index, 0) * 2 or 0.1,
+                    self.max_restart_delay)
+        else:
+            delay = 0
+        self._delays[index] = delay
+        return delay
+
+    def serve_forever(self):
+        self.start()
+        self.wait()
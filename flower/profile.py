@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+import gc
+import sys
+import threading
+import time
+import weakref
+
+import six
+
+from flower.core import sched
+from flower.core.sched import tasklet
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return "%s (%s:%s)" % (code.co_name, code.co_filename,
+            code.co_firstlineno)
+
+
+class Profiler(object):
+    """ sampling profiler for tasklets.
+
+    cProfile can't follow greenlets, their stacks interleave. The profiler
+    samples instead, from a helper thread and every `interval` seconds,
+    the stack of each live tasklet: the running ones through the frames of
+    their thread and the others through the frame their greenlet is
+    suspended in. Stacks are counted per tasklet label and can be written
+    in the collapsed format read by flamegraph.pl or speedscope::
+
+        from flower import profile
+
+        profile.start()
+        ...
+        profile.stop().write("out.collapsed")
+
+    The sampling interval is lengthened when needed so that no more than
+    `overhead` (a fraction of the time) is spent sampling. With
+    ``waiting=False`` only the running tasklets are sampled, which gives a
+    CPU profile instead of a wall clock one.
+    """
+
+    def __init__(self, interval=0.01, overhead=0.01, waiting=True,
+            max_depth=128):
+        self.interval = interval
+        self.overhead = overhead
+        self.waiting = waiting
+        self.max_depth = max_depth
+        self.stacks = {} # collapsed stack -> number of samples
+        self.samples = 0
+        self.sample_time = 0.0 # time spent sampling
+        self._tasklets = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        # track the tasklets spawned from now on and the ones already
+        # alive
+        sched.set_spawn_callback(self._add)
+        for obj in gc.get_objects():
+            if isinstance(obj, tasklet):
+                self._add(obj)
+
+        self._stop.clear()
+        self._thread = sched.helper_thread(self._run, "flower-profiler")
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        sched.set_spawn_callback(None)
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        with self._lock:
+            self._tasklets.clear()
+
+    def clear(self):
+        self.stacks = {}
+        self.samples = 0
+        self.sample_time = 0.0
+
+    def _add(self, task):
+        with self._lock:
+            self._tasklets.add(task)
+
+    def _run(self):
+        while not self._stop.is_set():
+            start = time.time()
+            self.sample()
+            cost = time.time() - start
+            self.sample_time += cost
+            self._stop.wait(max(self.interval, cost / self.overhead - cost))
+
+    def _record(self, label, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            names.append(_frame_name(frame))
+            frame = frame.f_back
+        names.append(label)
+        names.reverse()
+        key = ";".join(names)
+        self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def sample(self):
+        """ record the current stack of every tasklet """
+        me = threading.current_thread().ident
+        threads = dict((t.ident, t.name) for t in threading.enumerate())
+        schedulers = dict((s.thread_id, s) for s in sched.get_schedulers())
+
+        # the running tasklets
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+
+            s = schedulers.get(ident)
+            if s is not None:
+                label = s._last_task.label or "tasklet"
+            else:
+                label = threads.get(ident, "thread")
+            self._record(label, frame)
+
+        # the suspended tasklets
+        if self.waiting:
+            with self._lock:
+                tasks = list(self._tasklets)
+
+            for task in tasks:
+                if not task.alive:
+                    continue
+                gr = task._greenlet
+                frame = getattr(gr, 'gr_frame', None)
+                if frame is not None:
+                    self._record(task.label or "tasklet", frame)
+
+        self.samples += 1
+
+    def write(self, out):
+        """ write the stacks in the collapsed format to a file object or
+        a path """
+        if isinstance(out, six.string_types):
+            with open(out, 'w') as f:
+                return self.write(f)
+
+        for stack, count in sorted(self.stacks.items()):
+            out.write("%s %s\n" % (stack, count))
+
+
+_profiler = None
+
+def start(interval=0.01, overhead=0.01, waiting=True):
+    """ start profiling the tasklets of the process """
+    global _profiler
+    if _profiler is None:
+        _profiler = Profiler(interval, overhead, waiting)
+    _profiler.start()
+    return _profiler
+
+def stop():
+    """ stop the profiler and return it """
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
@@ -31,15 +31,18 @@ def idle():
     sched = core.get_scheduler()
     curr = core.getcurrent()
     def ready(now, h):
-        curr.blocked = False
-        sched.append(curr)
+        sched.unblock(curr)
         core.schedule()
 
     t = timer.Timer(ready, 0.0001)
     t.start()
 
     curr.blocked = True
-    core.schedule_remove()
+    try:
+        core.schedule_remove()
+    except:
+        t.stop()
+        raise
 
 def sleep(seconds=0):
     """ sleep the current tasklet for a while"""
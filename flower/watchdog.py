@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+import sys
+import threading
+import traceback
+
+from flower.core import sched
+from flower.core.sched import _clock
+
+
+class Stall(object):
+    """ a tasklet that has been running too long without switching """
+
+    def __init__(self, task, thread_id, duration, stack, suppressed=0):
+        self.task = task
+        self.label = task.label or "tasklet"
+        self.thread_id = thread_id
+        self.duration = duration
+        self.stack = stack # formatted lines, innermost frame last
+        self.suppressed = suppressed # stalls not reported before this one
+
+    def __str__(self):
+        lines = ["tasklet %s blocked thread %s for %.3fs" % (self.label,
+            self.thread_id, self.duration)]
+        if self.suppressed:
+            lines.append("(%s stalls not reported)" % self.suppressed)
+        lines.append("".join(self.stack).rstrip())
+        return "\n".join(lines)
+
+
+def _print_stall(stall):
+    sys.stderr.write("%s\n" % stall)
+
+
+class Watchdog(object):
+    """ detect the tasklets blocking their thread.
+
+    Tasklets are scheduled cooperatively: one doing blocking work freezes
+    the other tasklets of its thread and the I/O it handles. The watchdog
+    checks from a helper thread the time of the last switch of each
+    scheduler. When a tasklet has been running longer than `threshold`
+    seconds while other tasklets or the event loop are waiting, its label
+    and current stack are passed to `callback` (printed on stderr by
+    default)::
+
+        from flower import watchdog
+
+        watchdog.start(threshold=0.1)
+
+    A stall is reported once. No more than one report is made every `rate`
+    seconds, the stalls skipped are counted in the next report.
+    """
+
+    def __init__(self, threshold=0.1, callback=None, rate=1.0, max_depth=64):
+        self.threshold = threshold
+        self.callback = callback or _print_stall
+        self.rate = rate
+        self.max_depth = max_depth
+        self.interval = max(threshold / 2.0, 0.001)
+        self.stalls = 0 # number of stalls detected
+        self.suppressed = 0
+        self._last_report = None
+        self._reported = {} # thread id -> switches of the stall reported
+        self._started = _clock()
+        self._ready = {} # thread id -> last time nothing was waiting
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._started = _clock()
+        self._stop.clear()
+        self._thread = sched.helper_thread(self._run, "flower-watchdog")
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def _waiting(self, s):
+        # are some tasklets or the event loop waiting for the running
+        # tasklet?
+        if s._idle_start is not None:
+            # parked or waiting for I/O
+            return False
+        runnable = s.runnable
+        return (len(runnable) > (s._last_task in runnable) or
+                s.poller is not None)
+
+    def check(self):
+        """ check the schedulers once and report the new stalls. It returns
+        the stalls reported. """
+        now = _clock()
+        frames = sys._current_frames()
+        reported = []
+        for s in sched.get_schedulers():
+            frame = frames.get(s.thread_id)
+            if frame is None or not self._waiting(s):
+                self._ready[s.thread_id] = now
+                self._reported.pop(s.thread_id, None)
+                continue
+
+            # a thread that stopped scheduling a while ago only starts to
+            # stall when it gets some tasklets to run
+            since = max(s._switch_time, self._ready.get(s.thread_id,
+                self._started))
+            duration = now - since
+            if duration < self.threshold:
+                continue
+
+            # the same stall is reported once
+            switches = s.switches
+            if self._reported.get(s.thread_id) == switches:
+                continue
+            self._reported[s.thread_id] = switches
+            self.stalls += 1
+
+            if (self._last_report is not None and
+                    now - self._last_report < self.rate):
+                self.suppressed += 1
+                continue
+            self._last_report = now
+
+            stack = traceback.format_stack(frame, self.max_depth)
+            stall = Stall(s._last_task, s.thread_id, duration, stack,
+                    self.suppressed)
+            self.suppressed = 0
+            self.callback(stall)
+            reported.append(stall)
+        return reported
+
+
+_watchdog = None
+
+def start(threshold=0.1, callback=None, rate=1.0):
+    """ start watching the tasklets of the process """
+    global _watchdog
+    if _watchdog is None:
+        _watchdog = Watchdog(threshold, callback, rate)
+    _watchdog.start()
+    return _watchdog
+
+def stop():
+    """ stop the watchdog and return it """
+    global _watchdog
+    watchdog, _watchdog = _watchdog, None
+    if watchdog is not None:
+        watchdog.stop()
+    return watchdog
@@ -2,11 +2,37 @@
 #
 # This file is part of flower. See the NOTICE for more information.
 
-from flower.actor import (receive, send, spawn, spawn_after, ActorRef,
-        send_after, wrap, Actor)
+from flower.actor import (receive, send, spawn, spawn_many, spawn_after,
+        ActorRef, Mailbox, send_after, wrap, Actor)
 from flower import core
 from flower.time import sleep
+import gc
+import os
+import sys
 import time
+try:
+    import tracemalloc
+except ImportError:
+    # python < 3.4
+    tracemalloc = None
+import pytest
+
+
+def _object_size(make, n=10000):
+    # average memory allocated per object
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        objs = [make() for i in range(n)]
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return (used - sys.getsizeof(objs)) / n
+
+def _rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
 
 class Test_Actor:
 
@@ -105,6 +131,18 @@ class Test_Actor:
         assert len(messages) == 5
         assert sources == [5, 6]
 
+    def test_spawn_many(self):
+        r_list = []
+        def f(i):
+            r_list.append(i)
+
+        refs = spawn_many(f, [(i,) for i in range(3)])
+        assert len(refs) == 3
+        assert all(isinstance(ref, ActorRef) for ref in refs)
+
+        core.run()
+        assert r_list == [0, 1, 2]
+
     def test_spawn_after(self):
         r_list = []
         def f():
@@ -134,3 +172,30 @@ class Test_Actor:
         end = r_list[0]
         diff = end - start
         assert 0.29 <= diff <= 0.31
+
+    def test_memory_budget(self):
+        # see the memory budget in the README
+        if tracemalloc is None:
+            pytest.skip("needs tracemalloc")
+        actor = Actor()
+        assert _object_size(Mailbox) <= 64
+        assert _object_size(lambda: ActorRef(actor)) <= 96
+
+    def test_million_idle_actors(self):
+        if not os.path.exists('/proc/self/statm'):
+            pytest.skip("needs /proc to measure the memory used")
+
+        def idle():
+            pass
+
+        n = 1000000
+        gc.collect()
+        before = _rss()
+        refs = [spawn(idle) for i in range(n)]
+        used = _rss() - before
+
+        sched = core.get_scheduler()
+        for ref in refs:
+            sched.remove(ref.actor)
+
+        assert used <= n * 1024
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from flower import core
+from flower.core import aio
+from flower.core.timer import sleep
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    aio.install(loop)
+    yield loop
+    aio.uninstall()
+    loop.close()
+
+
+class Test_Asyncio:
+
+    def test_await(self, loop):
+        rlist = []
+
+        def f():
+            rlist.append(aio.await_(asyncio.sleep(0.01, result=42)))
+
+        def g():
+            for i in range(3):
+                rlist.append(i)
+                core.schedule()
+
+        def main():
+            core.tasklet(f)()
+            core.tasklet(g)()
+            return "done"
+
+        assert loop.run_until_complete(aio.to_asyncio(main)()) == "done"
+        loop.run_until_complete(asyncio.sleep(0.05))
+        assert rlist == [0, 1, 2, 42]
+
+    def test_await_exception(self, loop):
+        async def fail():
+            raise ValueError("fail")
+
+        def main():
+            with pytest.raises(ValueError):
+                aio.await_(fail())
+            return True
+
+        assert loop.run_until_complete(aio.to_asyncio(main)())
+
+    def test_to_asyncio_exception(self, loop):
+        def fail():
+            core.schedule()
+            raise ValueError("fail")
+
+        with pytest.raises(ValueError):
+            loop.run_until_complete(aio.to_asyncio(fail)())
+
+    def test_sleep(self, loop):
+        def main():
+            start = time.time()
+            sleep(0.02)
+            return time.time() - start
+
+        assert loop.run_until_complete(aio.to_asyncio(main)()) >= 0.015
+
+    def test_cancel_future(self, loop):
+        rlist = []
+        ch = core.channel()
+
+        def f():
+            try:
+                ch.receive()
+            except TaskletExit:
+                rlist.append("cancelled")
+                raise
+
+        async def main():
+            fut = aio.to_asyncio(f)()
+            await asyncio.sleep(0.01)
+            fut.cancel()
+            await asyncio.sleep(0.01)
+
+        loop.run_until_complete(main())
+        assert rlist == ["cancelled"]
+        assert ch.balance == 0
+
+    def test_kill_cancels_task(self, loop):
+        rlist = []
+
+        async def wait():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                rlist.append("cancelled")
+                raise
+
+        def f():
+            aio.await_(wait())
+
+        async def main():
+            t = core.tasklet(f)()
+            core.get_scheduler().wakeup()
+            await asyncio.sleep(0.01)
+            t.kill()
+            await asyncio.sleep(0.01)
+
+        loop.run_until_complete(main())
+        assert rlist == ["cancelled"]
+
+    def test_await_from_thread(self):
+        loop = asyncio.new_event_loop()
+        th = threading.Thread(target=loop.run_forever)
+        th.start()
+        rlist = []
+
+        def f():
+            rlist.append(aio.await_(asyncio.sleep(0.01, result=42), loop))
+
+        try:
+            core.tasklet(f)()
+            core.run()
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            th.join()
+            loop.close()
+        assert rlist == [42]
@@ -4,9 +4,19 @@
 
 from __future__ import absolute_import
 
+import gc
+import sys
+import threading
 import time
+try:
+    import tracemalloc
+except ImportError:
+    # python < 3.4
+    tracemalloc = None
+import py
 from py.test import skip
 from flower import core
+from flower.core.channel import ChannelWaiter
 
 SHOW_STRANGE = False
 
@@ -193,6 +203,24 @@ class Test_Channel:
             (chan, task, 0, 0)
         ]
 
+    def test_channel_callback_uses_channel(self):
+        # the callback can trace the operations to another channel
+        trace = core.channel(100)
+        def callback_function(chan, task, sending, willblock):
+            if chan is not trace:
+                trace.send((sending, willblock))
+
+        chan = core.channel()
+        core.set_channel_callback(callback_function)
+        try:
+            core.tasklet(chan.send)('hello')
+            assert chan.receive() == 'hello'
+        finally:
+            core.set_channel_callback(None)
+        core.run()
+        assert trace.receive() == (0, 1)
+        assert trace.receive() == (1, 0)
+
     def test_bomb(self):
         try:
             1/0
@@ -238,6 +266,26 @@ class Test_Channel:
         chan.send_sequence(iterable)
         assert res == [1,2,3,4,5,6]
 
+    def test_send_sequence_preference(self):
+        # each value is sent with send(): the receiver runs as soon as it
+        # gets one, before the next is taken from the iterable
+        log = []
+        chan = core.channel()
+        def gen():
+            for i in range(3):
+                log.append(('sent', i))
+                yield i
+        def f(chan):
+            for i in range(3):
+                log.append(('received', chan.receive()))
+
+        core.tasklet(f)(chan)
+        core.schedule()
+        chan.send_sequence(gen())
+        core.run()
+        assert log == [('sent', 0), ('received', 0), ('sent', 1),
+                ('received', 1), ('sent', 2), ('received', 2)]
+
     def test_getruncount(self):
         assert core.getruncount() == 1
         def with_schedule():
@@ -350,15 +398,66 @@ class Test_Channel:
 
     def test_nonblocking_channel(self):
         c = core.channel(100)
-        r1 = c.receive()
-        r2 = c.send(True)
-        r3 = c.receive()
-        r4 = c.receive()
+        sched = core.get_scheduler()
+        switches = sched.switches
+        r1 = c.send(True)
+        r2 = c.receive()
 
         assert r1 is None
-        assert r2 is None
-        assert r3 == True
-        assert r4 is None
+        assert r2 == True
+        # the buffer has room or a value, nobody is switched to
+        assert sched.switches == switches
+
+    def test_buffered_receive_blocks(self):
+        c = core.channel(2)
+        rlist = []
+
+        def f():
+            rlist.append(c.receive())
+
+        core.tasklet(f)()
+        core.schedule()
+        assert c.balance == -1
+        assert rlist == []
+
+        # the sender doesn't yield to the receiver
+        c.send(1)
+        assert rlist == []
+        core.run()
+        assert rlist == [1]
+        assert c.balance == 0
+
+    def test_buffered_send_blocks(self):
+        c = core.channel(2)
+        rlist = []
+
+        def f():
+            for i in range(5):
+                c.send(i)
+            rlist.append("sent")
+
+        core.tasklet(f)()
+        core.schedule()
+        # the buffer is full and a sender waits
+        assert c.balance == 3
+        assert rlist == []
+
+        values = [c.receive() for i in range(5)]
+        core.run()
+        assert values == list(range(5))
+        assert rlist == ["sent"]
+
+    def test_buffered_order(self):
+        # the values wrap around the ring buffer in order
+        c = core.channel(3)
+        values = []
+        for i in range(10):
+            c.send(i)
+            c.send(-i)
+            values.append(c.receive())
+            values.append(c.receive())
+        assert values == [v for i in range(10) for v in (i, -i)]
+        assert c.buffer.items == [None] * 3
 
     def test_async_channel(self):
         c = core.channel(100)
@@ -411,3 +510,242 @@ class Test_Channel:
 
         assert len(unblocked_recv) == 11
         assert diff > 0.1
+
+
+def test_handoff():
+    rlist = []
+
+    def receiver(ch):
+        rlist.append(ch.receive())
+
+    def other():
+        rlist.append("other")
+
+    for handoff, expected in ((False, ["other", 1]), (True, [1, "other"])):
+        del rlist[:]
+        ch = core.channel(handoff=handoff)
+        ch.preference = 1 # the sender keeps running by default
+        core.tasklet(receiver)(ch)
+        core.schedule()
+        core.tasklet(other)()
+        ch.send(1)
+        core.run()
+        assert rlist == expected
+
+
+def test_handoff_limit():
+    # the other runnable tasklets aren't starved by a pair of tasklets
+    # exchanging messages
+    ch = core.channel(handoff=True)
+    rlist = []
+
+    def ping(n):
+        for i in range(n):
+            ch.send(i)
+        rlist.append("ping")
+
+    def pong(n):
+        for i in range(n):
+            ch.receive()
+
+    def other():
+        rlist.append("other")
+
+    core.tasklet(pong)(100)
+    core.tasklet(ping)(100)
+    core.tasklet(other)()
+    core.run()
+    assert rlist == ["other", "ping"]
+
+
+def test_plain_threads():
+    # plain threads and tasklets exchanging values in both directions
+    ch = core.channel()
+    out = core.channel()
+    n = 1000
+
+    def echo():
+        for i in range(n):
+            out.send(ch.receive())
+
+    def producer():
+        for i in range(n):
+            ch.send(i)
+
+    results = []
+    def consumer():
+        for i in range(n):
+            results.append(out.receive())
+
+    def main():
+        # in its own thread: run(wait=True) also waits for the tasklets
+        # left blocked by the other tests
+        core.tasklet(echo)()
+        core.run(wait=True)
+
+    threads = [threading.Thread(target=producer),
+            threading.Thread(target=consumer), threading.Thread(target=main)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    assert results == list(range(n))
+
+
+def test_waiter_reused():
+    ch = core.channel()
+    rlist = []
+
+    def receiver():
+        for i in range(3):
+            rlist.append(ch.receive())
+            rlist.append(core.getcurrent()._waiter)
+
+    def sender():
+        for i in range(3):
+            ch.send(i)
+
+    r = core.tasklet(receiver)()
+    s = core.tasklet(sender)()
+    core.run()
+
+    assert rlist[0::2] == [0, 1, 2]
+    # the receiver blocked each time with the same waiter, the sender
+    # found it waiting and didn't need one
+    assert rlist[1] is rlist[3] is rlist[5] is r._waiter
+    assert r._waiter.arg is None
+    assert s._waiter is None
+
+
+def test_waiter_released_on_exception():
+    # a tasklet woken up by an exception doesn't leave its waiter queued
+    # in the channel it was waiting on
+    a = core.channel()
+    b = core.channel()
+    rlist = []
+
+    def receiver():
+        try:
+            a.receive()
+        except ValueError:
+            rlist.append("raised")
+        rlist.append(b.receive())
+
+    r = core.tasklet(receiver)()
+    core.schedule()
+    r.raise_exception(ValueError)
+    assert a.balance == 0
+    core.tasklet(a.send)("value-for-a")
+    core.schedule()
+    b.send("value-for-b")
+    core.run()
+    assert rlist == ["raised", "value-for-b"]
+    assert a.balance == 1
+    a.receive()
+
+
+def test_send_many_batch():
+    ch = core.channel()
+    rlist = []
+
+    def receiver():
+        rlist.append(ch.receive_many(3))
+        rlist.append(ch.receive_many(3))
+
+    core.tasklet(receiver)()
+    core.schedule()
+    sched = core.get_scheduler()
+    switches = sched.switches
+    # the waiting receiver gets a whole batch, the sender blocks until
+    # the value left is taken
+    assert ch.send_many(range(4)) == 4
+    core.run()
+    assert rlist == [[0, 1, 2], [3]]
+    assert sched.switches - switches <= 4
+
+
+def test_receive_many_ready():
+    ch = core.channel(4)
+    ch.send_many([1, 2, 3, 4])
+    assert ch.balance == 4
+    assert ch.receive_many(3) == [1, 2, 3]
+    assert ch.receive_many(3) == [4]
+    assert ch.receive_many(3, timeout=0) == []
+
+
+def test_receive_many_refills_buffer():
+    ch = core.channel(2)
+
+    def sender():
+        ch.send_many(range(5))
+
+    core.tasklet(sender)()
+    core.schedule()
+    # 2 values buffered, the sender is blocked on the third one
+    assert ch.balance == 3
+    assert ch.receive_many(10) == [0, 1, 2]
+    core.run()
+    assert ch.receive_many(10) == [3, 4]
+
+
+def test_receive_many_timeout():
+    ch = core.channel()
+    rlist = []
+
+    def receiver():
+        rlist.append(ch.receive_many(5, timeout=0.02))
+
+    core.tasklet(receiver)()
+    core.run()
+    assert rlist == [[]]
+    assert ch.balance == 0
+
+
+def test_receive_many_exception():
+    ch = core.channel(4)
+    ch.send(1)
+    ch.send_exception(ValueError, "boom")
+    ch.send(2)
+    # the values before the exception are received first
+    assert ch.receive_many(10) == [1]
+    with py.test.raises(ValueError):
+        ch.receive_many(10)
+    assert ch.receive_many(10) == [2]
+
+
+def test_iter_many():
+    ch = core.channel()
+    rlist = []
+
+    def receiver():
+        for value in ch.iter_many(prefetch=4):
+            rlist.append(value)
+        rlist.append("done")
+
+    core.tasklet(receiver)()
+    core.schedule()
+    ch.send_many(range(10))
+    ch.send_exception(StopIteration, "end")
+    core.run()
+    assert rlist == list(range(10)) + ["done"]
+
+
+def _object_size(make, n=10000):
+    # average memory allocated per object
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        objs = [make() for i in range(n)]
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return (used - sys.getsizeof(objs)) / n
+
+
+def test_memory_budget():
+    # see the memory budget in the README
+    if tracemalloc is None:
+        skip("needs tracemalloc")
+    assert _object_size(core.channel) <= 128
+    assert _object_size(lambda: ChannelWaiter(None, None)) <= 64
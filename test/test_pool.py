@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+import threading
+import time
+
+import pytest
+
+from flower import core
+from flower.core.pool import SchedulerPool
+from flower.core.sched import thread_ident
+from flower.core.timer import sleep
+
+
+class Test_SchedulerPool:
+
+    def test_spawn(self):
+        pool = SchedulerPool(2)
+        pool.start()
+
+        c = core.channel()
+        def f(i):
+            c.send((i, thread_ident()))
+
+        for i in range(10):
+            pool.spawn(f, i)
+
+        results = [c.receive() for i in range(10)]
+        pool.stop()
+
+        assert sorted(r[0] for r in results) == list(range(10))
+        main_thread = thread_ident()
+        assert all(r[1] != main_thread for r in results)
+
+    def test_sleep(self):
+        # start the timers of the main thread
+        sleep(0.01)
+
+        pool = SchedulerPool(1)
+        pool.start()
+        done = threading.Event()
+        def f():
+            sleep(0.05)
+            done.set()
+
+        pool.spawn(f)
+        # the worker fires its own timers while the main thread doesn't
+        # schedule
+        assert done.wait(1)
+        pool.stop()
+
+    def test_distribute(self):
+        pool = SchedulerPool(2)
+        pool.start()
+
+        c = core.channel()
+        def f():
+            # block the worker thread, the other worker should take the
+            # next tasklets
+            time.sleep(0.05)
+            c.send(thread_ident())
+
+        for i in range(4):
+            pool.spawn(f)
+
+        threads = set(c.receive() for i in range(4))
+        pool.stop()
+        assert len(threads) == 2
+
+    def test_spawn_on(self):
+        pool = SchedulerPool(3)
+        pool.start()
+
+        c = core.channel()
+        def f():
+            c.send(thread_ident())
+
+        for i in range(5):
+            pool.spawn_on(1, f)
+
+        threads = set(c.receive() for i in range(5))
+        pool.stop()
+        assert threads == set([pool.workers[1].thread.ident])
+
+    def test_submit(self):
+        pool = SchedulerPool(2)
+        pool.start()
+
+        c = core.channel()
+        def f(v):
+            c.send((v, thread_ident()))
+
+        t = core.tasklet(f)("hello")
+        assert t in core.get_scheduler()
+        pool.submit(t, 0)
+        assert t not in core.get_scheduler()
+
+        v, ident = c.receive()
+        pool.stop()
+        assert v == "hello"
+        assert ident == pool.workers[0].thread.ident
+        assert not t.alive
+
+    def test_submit_started(self):
+        pool = SchedulerPool(1)
+        c = core.channel()
+        def f():
+            c.receive()
+
+        t = core.tasklet(f)()
+        core.schedule()
+        with pytest.raises(RuntimeError):
+            pool.submit(t)
+        c.send(None)
+
+    def test_steal(self):
+        pool = SchedulerPool(2, batch=2)
+        pool.start()
+
+        c = core.channel()
+        def f():
+            time.sleep(0.01)
+            c.send(thread_ident())
+
+        # queue every tasklet on the first worker, the other one steals
+        # those not started
+        worker = pool.workers[0]
+        for i in range(10):
+            worker.put((core.tasklet(f), (), {}))
+
+        threads = set(c.receive() for i in range(10))
+        pool.stop()
+        assert len(threads) == 2
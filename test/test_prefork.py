@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+import os
+import signal
+import socket
+import threading
+import time
+
+import pytest
+
+from flower.net.prefork import PreforkServer
+
+if not hasattr(os, 'fork'):
+    pytest.skip("fork is not supported")
+
+
+def echo(conn):
+    while True:
+        data = conn.read()
+        if not data:
+            break
+        conn.write(data)
+
+def send_echo(addr, data):
+    # the workers may not listen yet
+    deadline = time.time() + 5
+    while True:
+        try:
+            sock = socket.create_connection(addr, timeout=5)
+            break
+        except socket.error:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.05)
+    try:
+        sock.sendall(data)
+        return sock.recv(1024)
+    finally:
+        sock.close()
+
+
+class PidServer(PreforkServer):
+    """ workers only report their pid """
+
+    def __init__(self, *args, **kwargs):
+        super(PidServer, self).__init__(*args, **kwargs)
+        self.r, self.w = os.pipe()
+
+    def run_worker(self, index):
+        os.write(self.w, ("%s\n" % os.getpid()).encode('ascii'))
+        time.sleep(30)
+
+    def read_pids(self, n):
+        pids = []
+        buf = b""
+        while len(pids) < n:
+            buf += os.read(self.r, 1024)
+            lines = buf.split(b"\n")
+            buf = lines.pop()
+            pids.extend(int(l) for l in lines)
+        return pids
+
+    def read_all_pids(self):
+        os.set_blocking(self.r, False)
+        data = b""
+        try:
+            while True:
+                chunk = os.read(self.r, 1024)
+                if not chunk:
+                    break
+                data += chunk
+        except BlockingIOError:
+            pass
+        return [int(l) for l in data.split()]
+
+
+class CrashServer(PidServer):
+    """ workers die at once """
+
+    def run_worker(self, index):
+        os.write(self.w, ("%s\n" % os.getpid()).encode('ascii'))
+        os._exit(1)
+
+
+class Test_PreforkServer:
+
+    def setup_method(self, method):
+        self.handlers = (signal.getsignal(signal.SIGTERM),
+                signal.getsignal(signal.SIGINT))
+
+    def teardown_method(self, method):
+        signal.signal(signal.SIGTERM, self.handlers[0])
+        signal.signal(signal.SIGINT, self.handlers[1])
+
+    def test_workers(self):
+        server = PidServer(('127.0.0.1', 0), None, workers=2)
+        server.start()
+        try:
+            assert server.addr[1] != 0
+            pids = server.read_pids(2)
+            assert sorted(pids) == sorted(server.workers)
+        finally:
+            server.stop()
+            server.wait()
+        assert server.workers == {}
+        assert server.sock is None
+
+    def test_restart(self):
+        server = PidServer(('127.0.0.1', 0), None, workers=2)
+        server.start()
+        waiter = threading.Thread(target=server.wait)
+        waiter.start()
+        try:
+            pids = server.read_pids(2)
+            os.kill(pids[0], signal.SIGKILL)
+
+            # wait() reaps the dead worker and spawns a new one
+            new_pid = server.read_pids(1)[0]
+            assert new_pid not in pids
+            assert sorted(server.workers) == sorted([pids[1], new_pid])
+        finally:
+            server.stop()
+            waiter.join(10)
+        assert server.workers == {}
+
+    def test_restart_backoff(self):
+        server = CrashServer(('127.0.0.1', 0), None, workers=1)
+        server.start()
+        waiter = threading.Thread(target=server.wait)
+        waiter.start()
+        time.sleep(1)
+        server.stop()
+        waiter.join(10)
+        # restarted after 0.1, 0.2 then 0.4s instead of in a loop
+        assert 2 <= len(server.read_all_pids()) <= 6
+
+    @pytest.mark.parametrize("reuse_port", [False, True])
+    def test_serve(self, reuse_port):
+        if reuse_port and not hasattr(socket, 'SO_REUSEPORT'):
+            pytest.skip("SO_REUSEPORT is not supported")
+
+        server = PreforkServer(('127.0.0.1', 0), echo, workers=2,
+                reuse_port=reuse_port)
+        server.start()
+        try:
+            if reuse_port and hasattr(socket, 'SO_ACCEPTCONN'):
+                # only the sockets of the workers get connections
+                assert not server.sock.getsockopt(socket.SOL_SOCKET,
+                        socket.SO_ACCEPTCONN)
+            for i in range(20):
+                assert send_echo(server.addr, b"hello") == b"hello"
+        finally:
+            server.stop()
+            server.wait()
+
+    def test_preload(self):
+        loaded = []
+        server = PidServer(('127.0.0.1', 0), None, workers=1,
+                preload=lambda: loaded.append(True))
+        server.do_preload()
+        assert loaded == [True]
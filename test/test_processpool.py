@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+import os
+
+import pytest
+
+from flower import core
+from flower.core.processpool import ProcessPool
+
+
+def square(x):
+    return x * x
+
+def fail(x):
+    raise ValueError(x)
+
+def getpid():
+    return os.getpid()
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = ProcessPool(2)
+    yield pool
+    pool.close()
+
+
+class Test_ProcessPool:
+
+    def test_run(self, pool):
+        rlist = []
+
+        def f():
+            rlist.append(pool.run(square, 3))
+            rlist.append(pool.run(getpid))
+
+        core.tasklet(f)()
+        core.run()
+
+        assert rlist[0] == 9
+        assert rlist[1] != os.getpid()
+
+    def test_run_exception(self, pool):
+        def f():
+            with pytest.raises(ValueError):
+                pool.run(fail, 1)
+
+        core.tasklet(f)()
+        core.run()
+
+    def test_run_unpicklable(self, pool):
+        rlist = []
+
+        def f():
+            try:
+                pool.run(lambda: 1)
+            except Exception as e:
+                rlist.append(e)
+
+        core.tasklet(f)()
+        core.run()
+        assert len(rlist) == 1
+
+    def test_others_keep_running(self, pool):
+        rlist = []
+
+        def f():
+            rlist.append(pool.run(square, 2))
+
+        def g():
+            rlist.append("g")
+
+        core.tasklet(f)()
+        core.tasklet(g)()
+        core.run()
+
+        assert rlist == ["g", 4]
+
+    def test_map(self, pool):
+        rlist = []
+
+        def f():
+            for result in pool.map(square, range(20), chunksize=3):
+                rlist.append(result)
+
+        core.tasklet(f)()
+        core.run()
+
+        assert rlist == [i * i for i in range(20)]
+
+    def test_map_unordered(self, pool):
+        results = list(pool.map(square, range(20), ordered=False))
+        assert sorted(results) == [i * i for i in range(20)]
+
+    def test_map_stop(self, pool):
+        results = pool.map(square, range(100))
+        assert next(results) == 0
+        assert next(results) == 1
+        results.close()
+
+    def test_map_exception(self, pool):
+        with pytest.raises(ValueError):
+            list(pool.map(fail, range(3)))
+
+    def test_process_map(self):
+        assert list(core.process_map(square, range(5))) == [0, 1, 4, 9, 16]
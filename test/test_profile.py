@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+import time
+
+import six
+
+from flower import core
+from flower.profile import Profiler
+
+
+def busy_loop(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+class Test_Profiler:
+
+    def test_running_tasklet(self):
+        profiler = Profiler(interval=0.001)
+
+        def f():
+            busy_loop(0.2)
+
+        core.tasklet(f, label="worker")()
+        profiler.start()
+        try:
+            core.run()
+        finally:
+            profiler.stop()
+
+        assert not profiler.running
+        assert profiler.samples > 0
+        stacks = [s for s in profiler.stacks if s.startswith("worker;")]
+        assert stacks
+        assert any("busy_loop" in s for s in stacks)
+
+    def test_waiting_tasklet(self):
+        profiler = Profiler(interval=0.001)
+        c = core.channel()
+
+        def waiter():
+            c.receive()
+
+        core.tasklet(waiter, label="waiter")()
+        core.schedule()
+
+        profiler.start()
+        busy_loop(0.05)
+        profiler.stop()
+        c.send(None)
+
+        stacks = [s for s in profiler.stacks if s.startswith("waiter;")]
+        assert stacks
+        assert all("receive" in s for s in stacks)
+
+    def test_running_only(self):
+        profiler = Profiler(interval=0.001, waiting=False)
+        c = core.channel()
+        core.tasklet(lambda: c.receive(), label="waiter")()
+        core.schedule()
+
+        profiler.start()
+        busy_loop(0.05)
+        profiler.stop()
+        c.send(None)
+
+        assert profiler.samples > 0
+        assert not [s for s in profiler.stacks if s.startswith("waiter;")]
+
+    def test_write(self):
+        profiler = Profiler()
+        profiler.stacks = {"main;f (a.py:1)": 2, "main;g (a.py:3)": 1}
+        out = six.StringIO()
+        profiler.write(out)
+        assert out.getvalue() == "main;f (a.py:1) 2\nmain;g (a.py:3) 1\n"
+
+    def test_overhead(self):
+        profiler = Profiler(interval=0.0001, overhead=0.01)
+        profiler.start()
+        busy_loop(0.2)
+        profiler.stop()
+        assert profiler.sample_time < 0.2 * 0.05
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+import pytest
+
+from flower import core
+from flower.core.runqueue import (RunQueue, PriorityRunQueue, TaskletGroup,
+        PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+
+
+def _tasks(n, priority=PRIORITY_NORMAL, group=None):
+    return [core.tasklet(label=str(i), priority=priority, group=group)
+            for i in range(n)]
+
+
+class Test_RunQueue:
+
+    def test_append(self):
+        rq = RunQueue()
+        t1, t2, t3 = _tasks(3)
+        rq.append(t1)
+        rq.append(t2)
+        rq.appendleft(t3)
+
+        assert len(rq) == 3
+        assert list(rq) == [t3, t1, t2]
+        assert rq[0] is t3
+        assert rq[-1] is t2
+
+    def test_appendnext(self):
+        rq = RunQueue()
+        t1, t2, t3 = _tasks(3)
+        rq.appendnext(t1)
+        rq.append(t2)
+        rq.appendnext(t3)
+        assert list(rq) == [t1, t3, t2]
+
+    def test_remove(self):
+        rq = RunQueue()
+        t1, t2, t3 = _tasks(3)
+        for t in (t1, t2, t3):
+            rq.append(t)
+
+        rq.remove(t2)
+        assert t2 not in rq
+        assert t1 in rq
+        assert list(rq) == [t1, t3]
+
+        with pytest.raises(ValueError):
+            rq.remove(t2)
+
+        rq.remove(t1)
+        rq.remove(t3)
+        assert not rq
+        with pytest.raises(IndexError):
+            rq[0]
+
+    def test_membership(self):
+        rq, rq1 = RunQueue(), RunQueue()
+        t1, t2 = _tasks(2)
+        rq.append(t1)
+        rq1.append(t2)
+
+        assert t1 in rq
+        assert t1 not in rq1
+        assert t2 in rq1
+
+        # queuing a task in another queue move it
+        rq1.append(t1)
+        assert t1 not in rq
+        assert list(rq1) == [t2, t1]
+        assert len(rq) == 0
+
+    def test_requeue(self):
+        rq = RunQueue()
+        t1, t2, t3 = _tasks(3)
+        for t in (t1, t2, t3):
+            rq.append(t)
+
+        rq.append(t1)
+        assert list(rq) == [t2, t3, t1]
+        rq.appendleft(t1)
+        assert list(rq) == [t1, t2, t3]
+        assert len(rq) == 3
+
+    def test_rotate(self):
+        rq = RunQueue()
+        t1, t2, t3 = _tasks(3)
+        for t in (t1, t2, t3):
+            rq.append(t)
+
+        rq.rotate()
+        assert list(rq) == [t2, t3, t1]
+        rq.rotate()
+        assert list(rq) == [t3, t1, t2]
+        assert rq.popleft() is t3
+        assert list(rq) == [t1, t2]
+
+    def test_scheduler_runnable(self):
+        sched = core.get_scheduler()
+        t = core.tasklet(lambda: None)()
+        assert t in sched
+        assert isinstance(sched.runnable, PriorityRunQueue)
+        core.run()
+        assert t not in sched
+
+
+class Test_PriorityRunQueue:
+
+    def test_levels(self):
+        rq = PriorityRunQueue()
+        low = _tasks(1, PRIORITY_LOW)[0]
+        normal = _tasks(1)[0]
+        high = _tasks(1, PRIORITY_HIGH)[0]
+        for t in (low, normal, high):
+            rq.append(t)
+
+        assert len(rq) == 3
+        assert list(rq) == [high, normal, low]
+        assert rq[0] is high
+        assert rq[-1] is low
+        assert normal in rq
+
+        rq.remove(normal)
+        assert normal not in rq
+        assert rq.popleft() is high
+        assert rq.popleft() is low
+        assert not rq
+
+    def test_pick(self):
+        rq = PriorityRunQueue()
+        main = _tasks(1)[0]
+        h1, h2 = _tasks(2, PRIORITY_HIGH)
+        rq.append(main)
+        assert rq.pick(main) is main
+
+        rq.append(h1)
+        rq.append(h2)
+        assert rq.pick(main) is h1
+        assert rq.pick(h1) is h2
+        assert rq.pick(h2) is h1
+
+    def test_yield_to_lower_level(self):
+        rq = PriorityRunQueue()
+        high = _tasks(1, PRIORITY_HIGH)[0]
+        n1, n2 = _tasks(2)
+        for t in (high, n1, n2):
+            rq.append(t)
+
+        # alone at its level, the high priority task gives one turn to
+        # the next level then runs again
+        assert rq.pick(high) is n1
+        assert rq.pick(n1) is high
+        assert rq.pick(high) is n2
+
+    def test_starvation(self):
+        rq = PriorityRunQueue(starvation_limit=4)
+        h1, h2 = _tasks(2, PRIORITY_HIGH)
+        low = _tasks(1, PRIORITY_LOW)[0]
+        for t in (h1, h2, low):
+            rq.append(t)
+
+        picked = []
+        curr = h1
+        for i in range(10):
+            curr = rq.pick(curr)
+            picked.append(curr)
+
+        # the low priority task runs after 4 high priority switches
+        assert picked.index(low) == 3
+        assert picked.count(low) == 2
+
+
+class Test_Groups:
+
+    def test_least_usage_first(self):
+        rq = PriorityRunQueue()
+        g1, g2 = TaskletGroup('g1'), TaskletGroup('g2')
+        a1, a2 = _tasks(2, group=g1)
+        b1 = _tasks(1, group=g2)[0]
+        for t in (a1, a2, b1):
+            rq.append(t)
+
+        assert len(rq) == 3
+        g1.charge(0.5)
+        assert rq.pick(a1) is b1
+        g2.charge(1.0)
+        assert rq.pick(b1) is a2
+
+    def test_many_tasks_dont_monopolize(self):
+        rq = PriorityRunQueue()
+        greedy, small = TaskletGroup('greedy'), TaskletGroup('small')
+        tasks = _tasks(100, group=greedy) + _tasks(1, group=small)
+        for t in tasks:
+            rq.append(t)
+
+        # each task runs for 1ms
+        picked = []
+        curr = tasks[0]
+        for i in range(20):
+            curr = rq.pick(curr)
+            curr.group.charge(0.001)
+            picked.append(curr)
+
+        assert sum(1 for t in picked if t.group is small) == 10
+
+    def test_shares(self):
+        rq = PriorityRunQueue()
+        g1, g2 = TaskletGroup('g1', shares=3), TaskletGroup('g2')
+        tasks = _tasks(2, group=g1) + _tasks(2, group=g2)
+        for t in tasks:
+            rq.append(t)
+
+        picked = []
+        curr = tasks[0]
+        for i in range(40):
+            curr = rq.pick(curr)
+            curr.group.charge(0.001)
+            picked.append(curr)
+
+        assert sum(1 for t in picked if t.group is g1) == 30
+
+    def test_idle_group_catches_up(self):
+        rq = PriorityRunQueue()
+        old, new = TaskletGroup('old'), TaskletGroup('new')
+        t1 = _tasks(1, group=old)[0]
+        rq.append(t1)
+        old.charge(10)
+
+        # the new group doesn't get 10s of CPU for itself
+        t2 = _tasks(1, group=new)[0]
+        rq.append(t2)
+        assert new.vtime == old.vtime
+        assert new.usage == 0
+
+    def test_invalid_shares(self):
+        with pytest.raises(ValueError):
+            TaskletGroup(shares=0)
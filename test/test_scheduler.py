@@ -4,9 +4,20 @@
 
 from __future__ import absolute_import
 
+import gc
+import sys
+import threading
 import time
+try:
+    import tracemalloc
+except ImportError:
+    # python < 3.4
+    tracemalloc = None
+import pytest
 from py.test import skip
 from flower import core
+from flower.core import timer
+from flower.core.sched import helper_thread
 
 SHOW_STRANGE = False
 
@@ -148,6 +159,29 @@ class Test_Stackless:
         t.kill()
         assert not t.alive
 
+    def test_raise_exception_blocked(self):
+        ch = core.channel()
+        rlist = []
+
+        def f():
+            try:
+                ch.receive()
+            except ValueError:
+                rlist.append('E')
+            core.schedule()
+            rlist.append('f')
+
+        sched = core.get_scheduler()
+        blocked = sched.blocked
+        t = core.tasklet(f)()
+        core.schedule()
+        assert sched.blocked == blocked + 1
+        t.raise_exception(ValueError)
+        assert sched.blocked == blocked
+        core.run()
+        assert rlist == ['E', 'f']
+        assert ch.balance == 0
+
     def test_catch_taskletexit(self):
         # Tests if TaskletExit can be caught in the tasklet being killed.
         global taskletexit
@@ -157,7 +191,6 @@ class Test_Stackless:
             try:
                 core.schedule()
             except TaskletExit:
-                global TaskletExit
                 taskletexit = True
                 raise
 
@@ -315,3 +348,453 @@ class Test_Stackless:
         core.tasklet(task)(5)
 
         core.run()
+
+    def test_park_wakeup(self):
+        sched = core.get_scheduler()
+
+        def wakeup():
+            time.sleep(0.05)
+            sched.wakeup()
+
+        th = threading.Thread(target=wakeup)
+        start = time.time()
+        th.start()
+        sched.park(5)
+        th.join()
+        assert time.time() - start < 1
+
+    def test_park_blocked_on_thread(self):
+        ch = core.channel()
+
+        def sender():
+            time.sleep(0.05)
+            ch.send("hello")
+
+        th = threading.Thread(target=sender)
+        th.start()
+        # the main tasklet is the only one and is blocked: the thread is
+        # parked until the other thread sends the value
+        assert ch.receive() == "hello"
+        th.join()
+
+    def test_park_blocked_on_scheduler_thread(self):
+        ch = core.channel()
+        started = threading.Event()
+
+        def sender():
+            core.get_scheduler()
+            started.set()
+            time.sleep(0.3)
+            ch.send("hello")
+
+        th = threading.Thread(target=sender)
+        th.start()
+        started.wait()
+        # the other thread runs a scheduler, wait for it as long as needed
+        assert ch.receive() == "hello"
+        th.join()
+
+    def test_park_blocked_on_slow_thread(self):
+        ch = core.channel()
+
+        def sender():
+            time.sleep(0.3)
+            ch.send("hello")
+
+        th = threading.Thread(target=sender)
+        th.start()
+        # any thread can wake up the tasklet, however long it takes
+        assert ch.receive() == "hello"
+        th.join()
+
+    def test_deadlock_with_helper_thread(self):
+        # the helper threads of flower don't wake up tasklets on their
+        # own, a deadlock is reported instead of parking forever
+        stop = threading.Event()
+        th = helper_thread(stop.wait, "helper")
+        th.start()
+        try:
+            with pytest.raises(RuntimeError):
+                core.channel().receive()
+        finally:
+            stop.set()
+            th.join()
+        # the main tasklet was left blocked
+        core.get_scheduler().unblock(core.getcurrent())
+
+    def test_call_soon_threadsafe(self):
+        sched = core.get_scheduler()
+        calls = []
+
+        def call():
+            calls.append(threading.current_thread())
+
+        th = threading.Thread(target=sched.call_soon_threadsafe,
+                args=(call,))
+        th.start()
+        th.join()
+        assert calls == []
+
+        # the call is run by the scheduler thread
+        core.schedule()
+        assert calls == [threading.current_thread()]
+
+        # consume the wakeup sent with the call
+        sched.park(0)
+
+    def test_run_wait(self):
+        ch = core.channel()
+        rlist = []
+
+        def receiver():
+            for i in range(3):
+                rlist.append(ch.receive())
+
+        def sender():
+            for i in range(3):
+                time.sleep(0.01)
+                ch.send(i)
+
+        def main():
+            core.tasklet(receiver)()
+            # the receiver is blocked, wait for the sender to wake it up
+            core.run(wait=True)
+
+        threads = [threading.Thread(target=sender),
+                threading.Thread(target=main)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        assert rlist == [0, 1, 2]
+
+    def test_run_wait_timers(self):
+        # the timers tasklet left without timers isn't waited for
+        rlist = []
+
+        def sleeper():
+            timer.sleep(0.01)
+            rlist.append('slept')
+
+        def main():
+            core.tasklet(sleeper)()
+            core.run(wait=True)
+            rlist.append('done')
+
+        th = threading.Thread(target=main)
+        th.daemon = True
+        th.start()
+        th.join(5)
+        assert not th.is_alive()
+        assert rlist == ['slept', 'done']
+
+    def test_priority(self):
+        rlist = []
+        def f(name):
+            rlist.append(name)
+
+        core.tasklet(f, priority=core.PRIORITY_LOW)('low')
+        core.tasklet(f)('normal')
+        core.tasklet(f, priority=core.PRIORITY_HIGH)('high')
+        core.run()
+
+        assert rlist == ['high', 'normal', 'low']
+
+    def test_priority_no_starvation(self):
+        rlist = []
+        def busy(name):
+            for i in range(100):
+                rlist.append(name)
+                core.schedule()
+
+        def background():
+            rlist.append('low')
+
+        core.tasklet(busy, priority=core.PRIORITY_HIGH)('h1')
+        core.tasklet(busy, priority=core.PRIORITY_HIGH)('h2')
+        core.tasklet(background, priority=core.PRIORITY_LOW)()
+        core.run()
+
+        # the low priority tasklet ran before the high priority ones end
+        assert 'low' in rlist[:-10]
+
+    def test_invalid_priority(self):
+        with pytest.raises(ValueError):
+            core.tasklet(lambda: None, priority=10)
+
+    def test_group_inherited(self):
+        group = core.TaskletGroup('tenant')
+        children = []
+
+        def child():
+            pass
+
+        def parent():
+            children.append(core.tasklet(child)())
+
+        t = core.tasklet(parent, group=group)()
+        core.run()
+
+        assert t.group is group
+        assert children[0].group is group
+        assert core.tasklet(child).group is None
+
+    def test_group_usage(self):
+        busy, lazy = core.TaskletGroup('busy'), core.TaskletGroup('lazy')
+
+        def spin(seconds):
+            end = time.time() + seconds
+            while time.time() < end:
+                pass
+            core.schedule()
+
+        core.tasklet(spin, group=busy)(0.05)
+        core.tasklet(spin, group=lazy)(0)
+        core.run()
+
+        assert busy.usage >= 0.05
+        assert lazy.usage < busy.usage
+        assert busy.switches >= 1
+
+        stats = dict((s['name'], s) for s in core.group_stats())
+        assert stats['busy']['usage'] == busy.usage
+
+    def test_stats(self):
+        sched = core.get_scheduler()
+        switches = sched.switches
+        core.get_stats()
+
+        def f():
+            for i in range(10):
+                core.schedule()
+
+        tasks = [core.tasklet(f)() for i in range(5)]
+        runnable_max = core.get_stats()['runnable_max']
+        core.run()
+
+        stats = core.get_stats()
+        assert stats['switches'] - switches >= 50
+        assert stats['switches_per_sec'] > 0
+        assert stats['runnable_max'] >= 6
+        assert runnable_max >= 6
+        assert stats['runnable'] == 1
+        assert stats['busy_time'] > 0
+        for t in tasks:
+            assert t.switches >= 10
+            assert t.run_time > 0
+
+    def test_stats_idle_time(self):
+        sched = core.get_scheduler()
+        main = core.getmain()
+        idle_time = sched.idle_time
+        sched.park(0.05)
+
+        # switch so the time since the last switch is charged
+        run_time = main.run_time
+        core.tasklet(lambda: None)()
+        core.run()
+
+        stats = core.get_stats()
+        assert stats['idle_time'] - idle_time >= 0.04
+        # the main tasklet isn't charged for the time it was parked
+        assert main.run_time - run_time < 0.04
+
+    def _run_poller(self, workers, batch, interval=None, work=None):
+        # a tasklet standing for the event loop, it polls then lets a
+        # batch of the other tasklets run
+        sched = core.get_scheduler()
+        rlist = []
+
+        def poller():
+            while any(t.alive for t in tasks):
+                rlist.append("poll")
+                sched.run_batch(core.getcurrent())
+
+        def f(i):
+            for j in range(2):
+                rlist.append(i)
+                if work is not None:
+                    work()
+                core.schedule()
+
+        tasks = [core.tasklet(f)(i) for i in range(workers)]
+        core.tasklet(poller, priority=core.PRIORITY_HIGH)()
+        sched.set_poll_cadence(batch, interval)
+        try:
+            core.run()
+        finally:
+            sched.set_poll_cadence()
+        return rlist
+
+    def test_poll_cadence(self):
+        rlist = self._run_poller(4, 1)
+        assert rlist[:8] == ["poll", 0, "poll", 1, "poll", 2, "poll", 3]
+
+        rlist = self._run_poller(4, 2)
+        assert rlist[:7] == ["poll", 0, 1, "poll", 2, 3, "poll"]
+
+    def test_poll_cadence_adapts(self):
+        # the batch is limited to the tasklets waiting to run
+        rlist = self._run_poller(2, 100)
+        assert rlist[:7] == ["poll", 0, 1, "poll", 0, 1, "poll"]
+
+    def test_poll_interval(self):
+        rlist = self._run_poller(4, 100, 0.01, lambda: time.sleep(0.02))
+        assert rlist[:6] == ["poll", 0, "poll", 1, "poll", 2]
+
+    def test_poll_cadence_invalid(self):
+        with pytest.raises(ValueError):
+            core.set_poll_cadence(0)
+
+    def test_spawn_recycle(self):
+        sched = core.get_scheduler()
+        rlist = []
+
+        def f(i):
+            rlist.append(i)
+
+        t1 = core.spawn(f, 1)
+        core.run()
+        assert not t1.alive
+        assert t1 in sched.free
+
+        t2 = core.spawn(f, 2)
+        assert t2 is t1
+        assert t2.alive
+        core.run()
+        assert rlist == [1, 2]
+
+    def test_spawn_error_not_recycled(self):
+        sched = core.get_scheduler()
+        del sched.free[:]
+
+        def f():
+            raise ValueError()
+
+        t = core.spawn(f)
+        with pytest.raises(ValueError):
+            core.run()
+        assert t not in sched.free
+        assert core.spawn(lambda: None) is not t
+        core.run()
+
+    def test_spawn_kill_recycled(self):
+        rlist = []
+        t = core.spawn(lambda: None)
+        core.run()
+        # killing a stale reference doesn't break the free list
+        t.kill()
+        t2 = core.spawn(rlist.append, 1)
+        core.run()
+        assert t2 is t
+        assert rlist == [1]
+
+    def test_spawn_local(self):
+        from flower.local import local
+        d = local()
+        seen = []
+
+        def f(value):
+            seen.append(getattr(d, 'a', None))
+            d.a = value
+
+        core.spawn(f, 1)
+        core.run()
+        core.spawn(f, 2)
+        core.run()
+        assert seen == [None, None]
+
+    def test_spawn_many(self):
+        rlist = []
+
+        def f(a, b):
+            rlist.append(a + b)
+
+        tasks = core.spawn_many(f, [(i, 1) for i in range(5)])
+        assert len(tasks) == 5
+        assert all(t in core.get_scheduler() for t in tasks)
+        core.run()
+        assert rlist == [1, 2, 3, 4, 5]
+
+    def test_spawn_many_limit(self):
+        running = [0]
+        rlist = []
+
+        def f(i):
+            running[0] += 1
+            rlist.append(running[0])
+            core.schedule()
+            running[0] -= 1
+
+        tasks = core.spawn_many(f, ((i,) for i in range(20)), limit=3)
+        # the tasklets spawned so far
+        assert len(tasks) == 3
+        assert all(t in core.get_scheduler() for t in tasks)
+        assert core.getruncount() == 4
+        core.run()
+        assert len(rlist) == 20
+        assert len(tasks) == 20
+        assert not any(t.alive for t in tasks)
+        assert max(rlist) == 3
+
+    def test_lazy_greenlet(self):
+        rlist = []
+        t = core.tasklet(rlist.append)(1)
+        assert t._greenlet is None
+        assert t.alive
+        assert not t.is_alive
+
+        core.run()
+        assert t._greenlet is not None
+        assert rlist == [1]
+        assert not t.alive
+
+    def test_start_from_blocked(self):
+        # each tasklet blocks and starts the next one, the recursion depth
+        # must not add up
+        ch = core.channel()
+        count = sys.getrecursionlimit()
+
+        def f():
+            ch.receive()
+
+        tasks = [core.tasklet(f)() for i in range(count)]
+        core.schedule()
+        assert ch.balance == -count
+        for i in range(count):
+            ch.send(None)
+        core.run()
+        assert not any(t.alive for t in tasks)
+
+    def test_memory_budget(self):
+        if tracemalloc is None:
+            skip("needs tracemalloc")
+
+        def f():
+            pass
+
+        def size(make, n=10000):
+            gc.collect()
+            tracemalloc.start()
+            try:
+                before = tracemalloc.get_traced_memory()[0]
+                objs = [make() for i in range(n)]
+                used = tracemalloc.get_traced_memory()[0] - before
+            finally:
+                tracemalloc.stop()
+            for t in objs:
+                if t.alive:
+                    t.remove()
+            # the ids are ints allocated apart from the tasklets
+            used -= sum(sys.getsizeof(t._task_id) for t in objs
+                    if t._task_id > 256)
+            return (used - sys.getsizeof(objs)) / n
+
+        # the attributes set in the __dict__ of any tasklet by the other
+        # tests make the dicts of the new ones bigger, measure a fresh class
+        class tasklet(core.tasklet):
+            __slots__ = ()
+
+        # see the memory budget in the README
+        assert size(tasklet) <= 256
+        assert size(lambda: tasklet(f)()) <= 384
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+import threading
+import time
+
+from flower import core
+from flower.core.timer import sleep
+
+
+class Test_CancelScope:
+
+    def test_cancel_blocked(self):
+        ch = core.channel()
+        rlist = []
+
+        def f():
+            try:
+                ch.receive()
+            except TaskletExit:
+                rlist.append("cancelled")
+                raise
+
+        with core.cancel_scope() as scope:
+            t = core.tasklet(f)()
+            core.schedule()
+            assert scope.tasks == set([t])
+            scope.cancel()
+            assert False, "not reached"
+
+        assert scope.cancelled_caught
+        core.run()
+        assert rlist == ["cancelled"]
+        assert not t.alive
+        # the channel forgot the waiter
+        assert ch.balance == 0
+        assert scope.tasks == set()
+
+    def test_timeout(self):
+        ch = core.channel()
+        rlist = []
+
+        def f():
+            try:
+                ch.receive()
+            finally:
+                rlist.append("f")
+
+        def main():
+            with core.cancel_scope(timeout=0.05) as scope:
+                core.tasklet(f)()
+                ch.receive()
+            rlist.append(scope.cancelled_caught)
+
+        start = time.time()
+        core.tasklet(main)()
+        core.run()
+
+        assert time.time() - start < 1
+        assert sorted(rlist, key=str) == [True, "f"]
+        assert ch.balance == 0
+
+    def test_no_timeout(self):
+        def main():
+            with core.cancel_scope(timeout=1) as scope:
+                sleep(0.01)
+            assert not scope.cancelled_caught
+            assert not scope.cancel_called
+
+        core.tasklet(main)()
+        core.run()
+
+    def test_cancel_sleep(self):
+        rlist = []
+
+        def f():
+            try:
+                sleep(10)
+            except TaskletExit:
+                rlist.append("cancelled")
+
+        def main():
+            with core.cancel_scope(timeout=0.05):
+                core.tasklet(f)()
+                sleep(10)
+
+        start = time.time()
+        core.tasklet(main)()
+        core.run()
+        assert rlist == ["cancelled"]
+        assert time.time() - start < 1
+
+    def test_cancel_not_started(self):
+        rlist = []
+
+        with core.cancel_scope() as scope:
+            t = core.tasklet(rlist.append)(1)
+            s = core.spawn(rlist.append, 2)
+            scope.cancel()
+
+        core.run()
+        assert rlist == []
+        assert not t.alive
+        assert not s.alive
+
+    def test_children_of_children(self):
+        ch = core.channel()
+        rlist = []
+
+        def child():
+            try:
+                ch.receive()
+            except TaskletExit:
+                rlist.append("child")
+
+        def parent():
+            core.tasklet(child)()
+            try:
+                ch.receive()
+            except TaskletExit:
+                rlist.append("parent")
+
+        with core.cancel_scope() as scope:
+            core.tasklet(parent)()
+            core.schedule()
+            core.schedule()
+            assert len(scope.tasks) == 2
+            scope.cancel()
+
+        core.run()
+        assert sorted(rlist) == ["child", "parent"]
+
+    def test_nested(self):
+        ch = core.channel()
+        rlist = []
+
+        def f(name):
+            try:
+                ch.receive()
+            except TaskletExit:
+                rlist.append(name)
+
+        with core.cancel_scope() as outer:
+            core.tasklet(f)("outer")
+            with core.cancel_scope() as inner:
+                core.tasklet(f)("inner")
+                core.schedule()
+                outer.cancel()
+
+        assert outer.cancelled_caught
+        assert not inner.cancelled_caught
+        core.run()
+        assert sorted(rlist) == ["inner", "outer"]
+
+    def test_cancel_from_thread(self):
+        ch = core.channel()
+
+        def main():
+            with core.cancel_scope() as scope:
+                th = threading.Thread(target=scope.cancel)
+                th.start()
+                ch.receive()
+            th.join()
+            assert scope.cancelled_caught
+
+        def run():
+            core.tasklet(main)()
+            core.run(wait=True)
+
+        th = threading.Thread(target=run)
+        th.start()
+        th.join(5)
+        assert not th.is_alive()
+
+
+class Test_TaskGroup:
+
+    def test_wait(self):
+        rlist = []
+
+        def f(i):
+            sleep(0.01 * i)
+            rlist.append(i)
+
+        def main():
+            with core.task_group():
+                for i in range(3):
+                    core.tasklet(f)(i)
+            rlist.append("done")
+
+        core.tasklet(main)()
+        core.run()
+        assert rlist == [0, 1, 2, "done"]
+
+    def test_timeout(self):
+        rlist = []
+
+        def f(i):
+            try:
+                sleep(i)
+                rlist.append(i)
+            except TaskletExit:
+                rlist.append("cancelled")
+
+        def main():
+            with core.task_group(timeout=0.1) as group:
+                core.tasklet(f)(0.01)
+                core.tasklet(f)(10)
+            rlist.append(group.cancelled_caught)
+
+        start = time.time()
+        core.tasklet(main)()
+        core.run()
+        assert rlist == [0.01, "cancelled", True]
+        assert time.time() - start < 1
+
+    def test_error(self):
+        rlist = []
+        ch = core.channel()
+
+        def f():
+            try:
+                ch.receive()
+            except TaskletExit:
+                rlist.append("cancelled")
+
+        def main():
+            try:
+                with core.task_group():
+                    core.tasklet(f)()
+                    core.schedule()
+                    raise ValueError()
+            except ValueError:
+                rlist.append("error")
+
+        core.tasklet(main)()
+        core.run()
+        assert rlist == ["cancelled", "error"]
+
+    def test_cancel_from_child(self):
+        # the first tasklet done cancels the others
+        rlist = []
+
+        def slow():
+            try:
+                sleep(10)
+            except TaskletExit:
+                rlist.append("cancelled")
+                raise
+
+        def fast(group):
+            sleep(0.01)
+            rlist.append("first")
+            group.cancel()
+            rlist.append("not reached")
+
+        def main():
+            with core.task_group() as group:
+                for i in range(5):
+                    core.tasklet(slow)()
+                core.tasklet(fast)(group)
+                core.schedule()
+            rlist.append(group.cancelled_caught)
+
+        start = time.time()
+        core.tasklet(main)()
+        core.run()
+        assert rlist == ["first"] + ["cancelled"] * 5 + [True]
+        assert time.time() - start < 1
+
+    def test_cancel_children_from_child(self):
+        rlist = []
+        ch = core.channel()
+
+        def waiter():
+            try:
+                ch.receive()
+            except TaskletExit:
+                rlist.append("cancelled")
+                raise
+
+        def canceller(group):
+            group.cancel_children()
+
+        def main():
+            with core.task_group() as group:
+                for i in range(3):
+                    core.tasklet(waiter)()
+                core.tasklet(canceller)(group)
+            rlist.append(group.cancelled_caught)
+
+        core.tasklet(main)()
+        core.run()
+        assert rlist == ["cancelled"] * 3 + [False]
+        assert ch.balance == 0
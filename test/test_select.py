@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+import threading
+import time
+
+import pytest
+
+from flower import core
+from flower.core.sched import TaskletExit
+
+
+def test_select_ready_recv():
+    ch1 = core.channel(1)
+    ch2 = core.channel(1)
+    ch2.send("b")
+    assert core.select([(ch1, 'recv'), (ch2, 'recv')]) == (1, "b")
+    assert ch2.balance == 0
+
+
+def test_select_ready_send():
+    ch1 = core.channel()
+    ch2 = core.channel(1)
+    assert core.select([(ch1, 'send', "a"), (ch2, 'send', "b")]) == (1, None)
+    assert ch2.receive() == "b"
+
+
+def test_select_random():
+    ch1 = core.channel(100)
+    ch2 = core.channel(100)
+    for i in range(100):
+        ch1.send(i)
+        ch2.send(i)
+
+    chosen = set()
+    for i in range(50):
+        chosen.add(core.select([(ch1, 'recv'), (ch2, 'recv')])[0])
+    assert chosen == set([0, 1])
+
+
+def test_select_blocks():
+    ch1 = core.channel()
+    ch2 = core.channel()
+    rlist = []
+
+    def selector():
+        rlist.append(core.select([(ch1, 'recv'), (ch2, 'recv')]))
+
+    core.tasklet(selector)()
+    core.schedule()
+    assert ch1.balance == ch2.balance == -1
+    ch2.send("b")
+    core.run()
+    assert rlist == [(1, "b")]
+    # the waiter on the other channel is withdrawn
+    assert ch1.balance == 0
+
+
+def test_select_blocked_send():
+    ch1 = core.channel()
+    ch2 = core.channel()
+    rlist = []
+
+    def selector():
+        rlist.append(core.select([(ch1, 'send', "a"), (ch2, 'send', "b")]))
+
+    core.tasklet(selector)()
+    core.schedule()
+    rlist.append(ch1.receive())
+    core.run()
+    assert sorted(rlist, key=str) == [(0, None), "a"]
+    assert ch2.balance == 0
+
+
+def test_select_done_once():
+    # once a case is done, the waiters left in the other channels are
+    # skipped by their peers
+    ch1 = core.channel()
+    ch2 = core.channel()
+    rlist = []
+
+    def selector():
+        rlist.append(core.select([(ch1, 'recv'), (ch2, 'recv')]))
+
+    def sender(ch, value):
+        ch.send(value)
+        rlist.append(value)
+
+    core.tasklet(selector)()
+    core.schedule()
+    core.tasklet(sender)(ch1, "a")
+    core.tasklet(sender)(ch2, "b")
+    core.schedule()
+    assert ch2.balance == 1
+    assert ch2.receive() == "b"
+    core.run()
+    assert (0, "a") in rlist and "b" in rlist
+
+
+def test_select_default():
+    ch = core.channel()
+    assert core.select([(ch, 'recv')], default=42) == (None, 42)
+    assert core.select([(ch, 'send', 1)], default=None) == (None, None)
+    assert ch.balance == 0
+
+
+def test_select_timeout():
+    ch = core.channel()
+    rlist = []
+
+    def selector():
+        start = time.time()
+        rlist.append(core.select([(ch, 'recv')], timeout=0.05))
+        rlist.append(time.time() - start)
+
+    core.tasklet(selector)()
+    core.run()
+    assert rlist[0] == (None, None)
+    assert rlist[1] >= 0.04
+    assert ch.balance == 0
+
+
+def test_select_cancel():
+    ch1 = core.channel()
+    ch2 = core.channel()
+    rlist = []
+
+    def selector():
+        try:
+            core.select([(ch1, 'recv'), (ch2, 'send', 1)])
+        except TaskletExit:
+            rlist.append("cancelled")
+            raise
+
+    t = core.tasklet(selector)()
+    core.schedule()
+    t.cancel()
+    core.run()
+    assert rlist == ["cancelled"]
+    assert ch1.balance == ch2.balance == 0
+
+
+def test_select_exception():
+    ch = core.channel()
+
+    def sender():
+        ch.send_exception(ValueError, "boom")
+
+    core.tasklet(sender)()
+    core.schedule()
+    with pytest.raises(ValueError):
+        core.select([(ch, 'recv')])
+
+
+def test_select_plain_thread():
+    ch1 = core.channel()
+    ch2 = core.channel()
+    rlist = []
+
+    def selector():
+        rlist.append(core.select([(ch1, 'recv'), (ch2, 'recv')]))
+
+    def main():
+        core.tasklet(selector)()
+        core.run(wait=True)
+
+    th = threading.Thread(target=main)
+    th.start()
+    while ch2.balance == 0:
+        time.sleep(0.001)
+    ch2.send("b")
+    th.join()
+    assert rlist == [(1, "b")]
+
+
+def test_select_invalid_case():
+    ch = core.channel()
+    with pytest.raises(ValueError):
+        core.select([(ch, 'peek')])
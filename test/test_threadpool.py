@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+import threading
+import time
+
+import pytest
+
+from flower import core
+from flower.core.threadpool import ThreadPool, CancelledError
+
+
+class Test_ThreadPool:
+
+    def test_run_in_thread(self):
+        rlist = []
+
+        def f():
+            rlist.append(core.run_in_thread(threading.current_thread))
+
+        core.tasklet(f)()
+        core.run()
+
+        assert len(rlist) == 1
+        assert rlist[0] is not threading.current_thread()
+
+    def test_others_keep_running(self):
+        pool = ThreadPool(2)
+        rlist = []
+
+        def blocking():
+            time.sleep(0.1)
+            rlist.append("blocking")
+            return 42
+
+        def f():
+            rlist.append(pool.run(blocking))
+
+        def g():
+            for i in range(3):
+                rlist.append(i)
+                core.schedule()
+
+        core.tasklet(f)()
+        core.tasklet(g)()
+        core.run()
+
+        assert rlist == [0, 1, 2, "blocking", 42]
+
+    def test_exception(self):
+        pool = ThreadPool(1)
+
+        def fail():
+            raise ValueError("fail")
+
+        def f():
+            with pytest.raises(ValueError):
+                pool.run(fail)
+
+        core.tasklet(f)()
+        core.run()
+
+    def test_size(self):
+        pool = ThreadPool(2)
+        ev = threading.Event()
+        items = [pool.submit(ev.wait, 5) for i in range(4)]
+        assert len(pool.threads) == 2
+        ev.set()
+        assert [item.wait() for item in items] == [True] * 4
+
+        pool.resize(1)
+        time.sleep(0.05)
+        assert len(pool.threads) == 1
+        assert pool.run(lambda: 1) == 1
+
+    def test_cancel(self):
+        pool = ThreadPool(1)
+        ev = threading.Event()
+        first = pool.submit(ev.wait, 5)
+        second = pool.submit(lambda: 1)
+        while not first.running:
+            time.sleep(0.001)
+        assert second.cancel()
+        assert not first.cancel()
+        ev.set()
+
+        assert first.wait()
+        with pytest.raises(CancelledError):
+            second.wait()
+
+    def test_kill_waiting(self):
+        pool = ThreadPool(1)
+        ev = threading.Event()
+        rlist = []
+        first = pool.submit(ev.wait, 5)
+
+        def f():
+            try:
+                pool.run(rlist.append, "called")
+            except TaskletExit:
+                rlist.append("killed")
+
+        t = core.tasklet(f)()
+        core.schedule()
+        t.kill()
+        ev.set()
+        first.wait()
+
+        # the call was cancelled before it started
+        assert rlist == ["killed"]
+        assert core.get_scheduler().pending == 0
@@ -79,5 +79,13 @@ class Test_Time:
 
         assert rlist == ['b', 'a']
 
+    def test_sleep0_blocked(self):
+        sched = core.get_scheduler()
+        sleep()
+        blocked = sched.blocked
+        for i in range(10):
+            sleep()
+        assert sched.blocked == blocked
+
 
 
@@ -2,6 +2,7 @@
 #
 # This file is part of flower. See the NOTICE for more information.
 
+import os
 import time
 
 from flower.core.util import from_nanotime
@@ -89,3 +90,32 @@ def test_multiple_sleep():
     assert r1[0] > r2[0]
     assert (now + 0.39) <= r1[0] <= (now + 0.41), r1[0]
     assert (now + 0.09) <= r2[0] <= (now + 0.11), r2[0]
+
+def test_sleep_idle_cpu():
+    def cpu_time():
+        t = os.times()
+        return t[0] + t[1]
+
+    start = cpu_time()
+    tasklet(sleep)(0.3)
+    run()
+    # the thread is parked while waiting for the timer
+    assert cpu_time() - start < 0.1
+
+def test_stop_many():
+    fired = []
+    def f(now, t):
+        fired.append(t)
+
+    timers = [Timer(f, 0.05 + i * 1e-6) for i in range(1000)]
+    for t in timers:
+        t.start()
+    for t in timers[1:]:
+        t.stop()
+    # the stopped timers don't pile up in the heap
+    assert len(timers[0].timers._heap) < 1000
+
+    # a timer started again only fires at its new deadline
+    timers[0].start()
+    run()
+    assert fired == [timers[0]]
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+import sys
+import threading
+import time
+
+import pytest
+import six
+
+pyuv = pytest.importorskip("pyuv")
+
+from flower import core
+from flower.core.uv import uv_server
+
+
+def _in_thread(func):
+    # each thread has its own scheduler and event loop
+    errors = []
+
+    def run():
+        try:
+            func()
+        except Exception:
+            errors.append(sys.exc_info())
+
+    th = threading.Thread(target=run)
+    th.start()
+    th.join(10)
+    assert not th.is_alive()
+    if errors:
+        six.reraise(*errors[0])
+
+
+def test_loop_sleep_and_wakeup():
+    def main():
+        sched = core.get_scheduler()
+        uv_server()
+        ch = core.channel()
+        rlist = []
+
+        def sleeper():
+            # the loop polls while the tasklet waits for its timer
+            sched.sleep(0.2)
+            rlist.append("slept")
+
+        def receiver():
+            rlist.append(ch.receive())
+
+        def send_later():
+            time.sleep(0.05)
+            ch.send("from thread")
+
+        core.tasklet(sleeper)()
+        core.tasklet(receiver)()
+        th = threading.Thread(target=send_later)
+        th.start()
+
+        idle, polls = sched.idle_time, sched.polls
+        start = time.time()
+        core.run()
+        th.join()
+
+        # the thread woke up the loop blocked waiting for events
+        assert rlist == ["from thread", "slept"]
+        assert time.time() - start >= 0.19
+        # the loop waited without spinning and ran the tasklets in
+        # between its polls
+        assert sched.idle_time - idle >= 0.1
+        assert sched.polls > polls
+
+    _in_thread(main)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -
+#
+# This file is part of flower. See the NOTICE for more information.
+
+import time
+
+from flower import core
+from flower.watchdog import Watchdog
+
+
+def blocking_call(seconds):
+    time.sleep(seconds)
+
+
+class Test_Watchdog:
+
+    def test_stall(self):
+        stalls = []
+        watchdog = Watchdog(threshold=0.05, callback=stalls.append)
+
+        def f():
+            blocking_call(0.3)
+
+        core.tasklet(f, label="blocker")()
+        core.tasklet(lambda: None)()
+        watchdog.start()
+        try:
+            core.run()
+        finally:
+            watchdog.stop()
+
+        assert not watchdog.running
+        # reported once
+        assert len(stalls) == 1
+        stall = stalls[0]
+        assert stall.label == "blocker"
+        assert stall.duration >= 0.05
+        assert "blocking_call" in stall.stack[-1]
+        assert "blocker" in str(stall)
+
+    def test_no_stall(self):
+        stalls = []
+        watchdog = Watchdog(threshold=0.05, callback=stalls.append)
+
+        def f():
+            for i in range(20):
+                blocking_call(0.005)
+                core.schedule()
+
+        core.tasklet(f)()
+        core.tasklet(f)()
+        watchdog.start()
+        try:
+            core.run()
+            # waiting isn't a stall
+            core.get_scheduler().park(0.2)
+        finally:
+            watchdog.stop()
+
+        assert stalls == []
+
+    def test_rate_limit(self):
+        stalls = []
+        watchdog = Watchdog(threshold=0.01, callback=stalls.append, rate=60)
+
+        def f():
+            blocking_call(0.02)
+            watchdog.check()
+            core.schedule()
+            blocking_call(0.02)
+            watchdog.check()
+
+        core.tasklet(f)()
+        core.tasklet(f)()
+        core.run()
+
+        # the stalls after the first one are only counted. The last
+        # tasklet blocks no one.
+        assert len(stalls) == 1
+        assert watchdog.stalls == 3
+        assert watchdog.suppressed == 2